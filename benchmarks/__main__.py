@@ -0,0 +1,41 @@
+"""Runs performance benchmarks and reports the results as JSON.
+
+Benchmarks use the stand-ins in `process_request.test_helpers`, so they are
+kept out of the application and run from the repository root with
+`python -m benchmarks [suite ...]`.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import django
+
+
+def main(argv=None, stdout=sys.stdout):
+    from .suites import SUITES, run_suites
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "suites", nargs="*",
+        help="Benchmark suites to run (default: all). Available: {}".format(", ".join(sorted(SUITES))))
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per timing run.")
+    parser.add_argument("--output", help="Write results to this file instead of standard output.")
+    args = parser.parse_args(argv)
+    try:
+        results = run_suites(args.suites, args.iterations)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        stdout.write("Wrote benchmark results to {}\n".format(args.output))
+    else:
+        stdout.write(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "request_broker.settings")
+    django.setup()
+    main()
@@ -0,0 +1,338 @@
+"""Benchmarks for request processing.
+
+Suites are registered with the `suite` decorator and run with
+`python -m benchmarks`, which writes results as JSON so they can be compared
+between versions.
+"""
+
+import platform
+import time
+import tracemalloc
+from glob import glob
+from os.path import basename, join
+from unittest.mock import patch
+
+from asnake.utils import text_in_note
+from django.conf import settings
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from process_request.codec import CODECS, CodecJSONRenderer, stdlib_dumps
+from process_request.helpers import (CLOSED_TEXT, CONFIDENCE_RATIO, OPEN_TEXT,
+                                     classify_note_text, get_instance_data,
+                                     get_locations, get_normalized_note_text,
+                                     get_preferred_format, get_rights_status,
+                                     get_size, indicator_to_integer,
+                                     parse_text_content, pluralize,
+                                     prepare_values, strip_tags)
+from process_request.routines import AeonRequester, Processor, export_fields
+from process_request.test_helpers import (FIXTURES_DIR,
+                                          archival_objects_from_fixture,
+                                          count_upstream_calls,
+                                          json_from_fixture,
+                                          synthetic_archival_object)
+
+HELPER_SCALES = (10, 200, 1000)  # Numbers of instances in synthetic records.
+MARKUP_SAMPLES = {
+    "plain": "Annual reports, 1947-1952",
+    "mixed_content": "<title render='italic'>Annual reports</title> of the <emph render=\"bold\">Foundation</emph> &amp; affiliates, 1947&#8211;1952",
+    "malformed": "Reports <emph render='italic'>of the Foundation & affiliates</title>, 1947-1952",
+    "unsupported": "Reports <!-- draft --> of the <![CDATA[Foundation]]>, 1947-1952",
+}
+UPSTREAM_SCALES = (1, 25, 100)  # Numbers of items in a request.
+UPSTREAM_LATENCY = 0.02  # Seconds of latency injected into each ArchivesSpace call.
+RECORD_SCALES = (100, 1000)  # Numbers of items in a request.
+FETCH_STRATEGIES = ("resolve", "projected")
+CODEC_SCALES = (25, 100)  # Numbers of items in a response.
+
+SUITES = {}
+
+
+def suite(name):
+    """Registers a function as a benchmark suite.
+
+    Suite functions accept a number of iterations and return a dict of results.
+    """
+    def register(fn):
+        SUITES[name] = fn
+        return fn
+    return register
+
+
+def measure(fn, iterations, repeat=5):
+    """Times repeated calls to a function.
+
+    Args:
+        fn (callable): a function which takes no arguments.
+        iterations (int): calls per timing run.
+        repeat (int): number of timing runs.
+
+    Returns:
+        dict: the best and mean time per call in microseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - start) / iterations * 1e6)
+    return {"best_us": round(min(timings), 3), "mean_us": round(sum(timings) / len(timings), 3), "iterations": iterations}
+
+
+def run_suites(names, iterations):
+    """Runs benchmark suites.
+
+    Args:
+        names (list): names of suites to run, or an empty list to run all suites.
+        iterations (int): calls per timing run.
+
+    Returns:
+        dict: machine-readable results keyed by suite name.
+    """
+    unknown = set(names) - set(SUITES)
+    if unknown:
+        raise ValueError("Unknown benchmark suite(s): {}".format(", ".join(sorted(unknown))))
+    return {
+        "python": platform.python_version(),
+        "iterations": iterations,
+        "suites": {name: SUITES[name](iterations) for name in (names or SUITES)},
+    }
+
+
+def legacy_notes_status(notes):
+    """Classifies accessrestrict notes by fuzzy matching every note against
+    every query, as `get_rights_status` did before notes were classified once."""
+    if any([text_in_note(n, text, None, confidence=CONFIDENCE_RATIO) for text in CLOSED_TEXT for n in notes]):
+        status = "closed"
+        if any([text_in_note(n, text, None, confidence=CONFIDENCE_RATIO) for text in OPEN_TEXT for n in notes]):
+            status = "open"
+    elif any([text_in_note(n, text, None, confidence=CONFIDENCE_RATIO) for text in OPEN_TEXT for n in notes]):
+        status = "open"
+    else:
+        status = "conditional"
+    return status
+
+
+@suite("note_classifier")
+def note_classifier(iterations):
+    """Measures accessrestrict note classification for each restricted note fixture."""
+    results = {}
+    for path in sorted(glob(join(FIXTURES_DIR, "object_restricted_note*.json"))):
+        item = json_from_fixture(basename(path))
+        notes = [n for n in item["notes"] if n.get("type") == "accessrestrict"]
+
+        def uncached():
+            classify_note_text.cache_clear()
+            get_rights_status(item, None)
+
+        results[basename(path)] = {
+            "notes": len(notes),
+            "status": get_rights_status(item, None),
+            "legacy": measure(lambda: legacy_notes_status(notes), iterations),
+            "uncached": measure(uncached, iterations),
+            "cached": measure(lambda: get_rights_status(item, None), iterations),
+            "normalize": measure(lambda: [get_normalized_note_text(n, None) for n in notes], iterations),
+        }
+    return results
+
+
+@suite("helpers")
+def helpers(iterations):
+    """Measures the pure helpers used to format items, against synthetic
+    records with increasing numbers of instances.
+
+    Iterations are scaled down as records grow so that each scale takes a
+    similar amount of time.
+    """
+    processor = Processor()
+    results = {}
+    for scale in HELPER_SCALES:
+        item = synthetic_archival_object(instances=scale)
+        instances = item["instances"]
+        top_containers = [i["sub_container"]["top_container"]["_resolved"] for i in instances if i.get("sub_container")]
+        indicators = [i["sub_container"]["indicator_2"] for i in instances if "indicator_2" in i.get("sub_container", {})]
+        values = [[i.get("instance_type"), None, i.get("instance_type")] * 2 for i in instances]
+        scaled = max(1, iterations * 10 // scale)
+
+        def uncached_size():
+            pluralize.cache_clear()
+            get_size(instances)
+
+        def uncached_rights():
+            classify_note_text.cache_clear()
+            get_rights_status(item, None)
+
+        results[scale] = {
+            "get_size": measure(lambda: get_size(instances), scaled),
+            "get_size_uncached": measure(uncached_size, scaled),
+            "get_instance_data": measure(lambda: get_instance_data(instances), scaled),
+            "get_preferred_format": measure(lambda: get_preferred_format(item), scaled),
+            "get_locations": measure(lambda: [get_locations(c) for c in top_containers], scaled),
+            "get_rights_status": measure(lambda: get_rights_status(item, None), scaled),
+            "get_rights_status_uncached": measure(uncached_rights, scaled),
+            "indicator_to_integer": measure(
+                lambda: [indicator_to_integer(p.strip()) for i in indicators for p in i.split("-")], scaled),
+            "prepare_values": measure(lambda: prepare_values(list(values)), scaled),
+            "strip_tags": measure(lambda: processor.strip_tags(item["display_string"]), iterations),
+            "strip_tags_malformed": measure(
+                lambda: processor.strip_tags(item["display_string"].replace("</title>", "")), iterations),
+        }
+    return results
+
+
+@suite("upstream_calls")
+def upstream_calls(iterations):
+    """Counts ArchivesSpace calls made by `Processor.get_data` for lists of
+    items spread across several resources and top containers, and measures
+    wall time with latency injected into each call.
+
+    Runs once per scale regardless of `iterations`.
+    """
+    results = {}
+    for scale in UPSTREAM_SCALES:
+        objects = archival_objects_from_fixture(scale, resources=3, containers=5, instance_type="mixed materials")
+        report = count_upstream_calls(
+            lambda: Processor().get_data(list(objects), "https://dimes.rockarch.org"), objects, latency=UPSTREAM_LATENCY)
+        results[scale] = dict(report, calls_per_item=round(report["calls"] / scale, 3))
+    return results
+
+
+@suite("fetch_strategies")
+def fetch_strategies(iterations):
+    """Compares the size of ArchivesSpace responses, and the time taken to
+    decode them, for each strategy of fetching archival objects.
+
+    Runs once per scale regardless of `iterations`.
+    """
+    results = {}
+    for scale in UPSTREAM_SCALES:
+        objects = archival_objects_from_fixture(scale, resources=3, containers=5, instance_type="mixed materials")
+        results[scale] = {}
+        for strategy in FETCH_STRATEGIES:
+            with patch.dict(settings.ARCHIVESSPACE, {"fetch_strategy": strategy}):
+                report = count_upstream_calls(
+                    lambda: Processor().get_data(list(objects), "https://dimes.rockarch.org"), objects, measure_decode=True)
+            results[scale][strategy] = {
+                "calls": report["calls"],
+                "bytes_per_item": round(report["response_bytes"] / scale),
+                "decode_ms_per_item": round(report["decode_ms"] / scale, 4),
+            }
+    return results
+
+
+@suite("json_codecs")
+def json_codecs(iterations):
+    """Compares the installed JSON codecs decoding archival object responses
+    and a container search page, including the `json` field of each hit, and
+    rendering Aeon request data.
+
+    DRF's own JSONRenderer is included as a baseline for rendering.
+    """
+    search_page = stdlib_dumps(json_from_fixture("restricted_search.json"))
+
+    def decode_search(loads):
+        for hit in loads(search_page)["results"]:
+            loads(hit["json"])
+            for ancestors in hit["_resolved_ancestors"].values():
+                [loads(ancestor["json"]) for ancestor in ancestors]
+
+    results = {"restricted_search.json": {
+        "bytes": len(search_page),
+        "decode": {name: measure(lambda: decode_search(loads), iterations) for name, (loads, _) in CODECS.items()},
+    }}
+    for scale in CODEC_SCALES:
+        objects = archival_objects_from_fixture(scale, resources=3, containers=5, instance_type="mixed materials")
+        response = stdlib_dumps(list(objects.values()))
+        aeon_data = []
+        count_upstream_calls(
+            lambda: aeon_data.append(AeonRequester().get_request_data(
+                "readingroom", "https://dimes.rockarch.org", items=list(objects), scheduledDate="2026-01-01")),
+            objects)
+        scaled = max(1, iterations * 10 // scale)
+        render = {"drf_json": measure(lambda: JSONRenderer().render(aeon_data[0]), scaled)}
+        for name in CODECS:
+            with override_settings(JSON_CODEC=name):
+                render[name] = measure(lambda: CodecJSONRenderer().render(aeon_data[0]), scaled)
+        results[scale] = {
+            "response_bytes": len(response),
+            "decode": {name: measure(lambda: loads(response), scaled) for name, (loads, _) in CODECS.items()},
+            "render_aeon": render,
+        }
+    return results
+
+
+@suite("strip_tags")
+def strip_tags_throughput(iterations):
+    """Measures markup sanitization throughput for plain, mixed-content,
+    malformed and unsupported strings, repeated to several lengths.
+
+    Compares parsing each string with ElementTree against the single-pass
+    scanner, with and without the result cache.
+    """
+    results = {}
+    for name, sample in MARKUP_SAMPLES.items():
+        for repeat in (1, 20):
+            value = sample * repeat
+
+            def uncached():
+                strip_tags.cache_clear()
+                strip_tags(value)
+
+            timings = {
+                "parser": measure(lambda: parse_text_content(value), iterations),
+                "uncached": measure(uncached, iterations),
+                "cached": measure(lambda: strip_tags(value), iterations),
+            }
+            for timing in timings.values():
+                timing["chars_per_s"] = round(len(value) / timing["best_us"] * 1e6) if timing["best_us"] else None
+            results["{}_x{}".format(name, repeat)] = dict(timings, chars=len(value))
+    return results
+
+
+@suite("records")
+def records(iterations):
+    """Compares slotted item records with the dicts which were returned for
+    each item before, for the fields used in CSV and email exports and for
+    titles alone.
+
+    Reports memory held per item by a fetched list, measured with tracemalloc
+    as the memory released when the list is discarded, and the time until the
+    title of the first item is available. Runs once per scale regardless of
+    `iterations`.
+    """
+    strategies = {
+        "dicts": (export_fields(), lambda items: (dict(item) for item in items)),
+        "records": (export_fields(), lambda items: items),
+        "records_title_only": (("title",), lambda items: items),
+    }
+    results = {}
+    for scale in RECORD_SCALES:
+        objects = archival_objects_from_fixture(scale, resources=3, containers=5, instance_type="mixed materials")
+        results[scale] = {}
+        for name, (fields, materialize) in strategies.items():
+            measured = {"first_field_ms": None}
+
+            def run(traced):
+                if traced:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                items = materialize(Processor().iter_data(list(objects), "https://dimes.rockarch.org", fields))
+                first = next(items)
+                first["title"]
+                if not traced:
+                    elapsed = round((time.perf_counter() - start) * 1000, 3)
+                    measured["first_field_ms"] = min(elapsed, measured["first_field_ms"] or elapsed)
+                retained = [first] + list(items)
+                if traced:
+                    # Only memory released along with the list is counted,
+                    # leaving out caches and other state kept by the run.
+                    held = tracemalloc.get_traced_memory()[0]
+                    count = len(retained)
+                    del first, items, retained
+                    measured["bytes_per_item"] = round((held - tracemalloc.get_traced_memory()[0]) / count)
+                    tracemalloc.stop()
+
+            for traced in (False, False, False, True):
+                count_upstream_calls(lambda: run(traced), objects)
+            results[scale][name] = measured
+    return results
@@ -0,0 +1,361 @@
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlencode
+
+from asnake.client import ASnakeClient
+from django.core.cache import caches
+
+from request_broker import settings
+
+from .codec import dumps, loads
+
+RECORD_TYPE_PATTERNS = [
+    ("tree_node", re.compile(r"/resources/\d+/tree/(node|waypoint)")),
+    ("resource", re.compile(r"/resources/\d+$")),
+    ("agent", re.compile(r"^/?agents/\w+/\d+$")),
+    ("top_container", re.compile(r"/top_containers/\d+$")),
+    ("archival_object", re.compile(r"/(archival_objects|find_by_id/archival_objects)$")),
+]
+
+
+def get_record_type(url, params=None):
+    """Determines which kind of ArchivesSpace record a GET request fetches.
+
+    Args:
+        url (str): a URL path, optionally including a query string.
+        params (dict): query parameters passed separately from the URL.
+
+    Returns:
+        str or None: a record type as used in the cache TTL settings, or None
+            if responses from this URL should not be cached.
+    """
+    path, _, query = url.partition("?")
+    query = "{}&{}".format(query, urlencode(params or {}, doseq=True))
+    if path.endswith("/search"):
+        if "type[]=agent_" in query or "type%5B%5D=agent_" in query:
+            return "agent"
+        if "top_container_uri" in query:
+            return "top_container"
+        return None
+    for record_type, pattern in RECORD_TYPE_PATTERNS:
+        if pattern.search(path):
+            return record_type
+    return None
+
+
+def make_key(url, params=None):
+    """Returns a stable cache key for a GET request."""
+    normalized = "{}?{}".format(url, urlencode(sorted((params or {}).items()), doseq=True))
+    return "aspace:{}".format(hashlib.sha1(normalized.encode("utf-8")).hexdigest())
+
+
+class LRUCache(object):
+    """Thread-safe in-process cache bounded by entry count and total size.
+
+    Entries expire after their TTL; when either bound is exceeded the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns a tuple of (found, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires, size = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.size -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RecordCache(object):
+    """Two-tier cache for ArchivesSpace responses.
+
+    A bounded in-process LRU sits in front of a Django cache backend which is
+    shared between processes. Values found in the shared backend are promoted
+    into the local LRU. Response bodies are stored encoded, so cached data
+    cannot be modified by callers. Hits and misses are counted per record type.
+    """
+
+    def __init__(self, alias="archivesspace"):
+        self.alias = alias
+        config = settings.ARCHIVESSPACE_CACHE
+        self.ttls = config["ttls"]
+        self.local = LRUCache(config["max_entries"], config["max_bytes"])
+        self._counters = defaultdict(lambda: {"l1_hits": 0, "l2_hits": 0, "misses": 0})
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def ttl(self, record_type):
+        return self.ttls.get(record_type, 0) if record_type else 0
+
+    def get(self, record_type, key):
+        """Looks up a value in the local and then the shared cache.
+
+        Returns:
+            tuple: (found, value).
+        """
+        found, value = self.local.get(key)
+        if found:
+            self._count(record_type, "l1_hits")
+            return True, value
+        entry = self.shared.get(key)
+        if entry is not None:
+            value, size, expires = entry
+            self.local.set(key, value, max(expires - time.time(), 0), size)
+            self._count(record_type, "l2_hits")
+            return True, value
+        self._count(record_type, "misses")
+        return False, None
+
+    def set(self, record_type, key, value, size):
+        ttl = self.ttl(record_type)
+        self.local.set(key, value, ttl, size)
+        self.shared.set(key, (value, size, time.time() + ttl), ttl)
+
+    def clear(self):
+        """Empties both tiers and resets counters."""
+        self.local.clear()
+        self.shared.clear()
+        with self._lock:
+            self._counters.clear()
+
+    def stats(self):
+        """Returns hit and miss counts per record type."""
+        with self._lock:
+            counters = {k: dict(v) for k, v in self._counters.items()}
+        return {"entries": len(self.local), "bytes": self.local.size, "record_types": counters}
+
+    def _count(self, record_type, counter):
+        with self._lock:
+            self._counters[record_type][counter] += 1
+
+
+record_cache = RecordCache()
+
+
+class CachedResponse(object):
+    """Read-only stand-in for a requests Response served from the cache.
+
+    The body is kept encoded, and each call to `json` decodes a new copy, so
+    callers may modify the data they are given without affecting the cache
+    or other callers.
+
+    Args:
+        content (bytes): the JSON body of the response.
+    """
+
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    @classmethod
+    def from_data(cls, data):
+        """Returns a response with a body encoding `data`."""
+        return cls(dumps(data))
+
+    def json(self):
+        return loads(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+
+class Flight(object):
+    """A fetch in progress, which other threads wait on for the result."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Collapses concurrent fetches of the same key into a single fetch.
+
+    Within a process, threads asking for a key which is already being fetched
+    wait for that fetch, and each is given its own copy of a successful
+    response. Across processes, the process
+    which fetches a key holds a lease in the shared cache backend, and
+    publishes successful responses there for a short time; other processes
+    wait for the result instead of fetching it too. If the lease expires
+    before a result appears, waiting processes fetch the key themselves.
+    """
+
+    def __init__(self, alias="archivesspace"):
+        self.alias = alias
+        self._flights = {}
+        self._counters = {"fetches": 0, "shared_in_process": 0, "shared_across_processes": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def fetch(self, key, fetch):
+        """Returns the response from `fetch`, or from a concurrent fetch of
+        the same key.
+
+        Args:
+            key (str): cache key identifying the request.
+            fetch (callable): function which takes no arguments and returns a
+                requests Response.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self._counters["shared_in_process"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            if flight.response.status_code == 200:
+                return CachedResponse(flight.response.content)
+            return flight.response
+        try:
+            flight.response = self._fetch_with_lease(key, fetch)
+            return flight.response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _fetch_with_lease(self, key, fetch):
+        config = settings.ARCHIVESSPACE_SINGLE_FLIGHT
+        lease_key = "{}:lease".format(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + config["lease"]
+        holder = None
+        while True:
+            # Results are published under the holder's token, so only
+            # processes which waited on that fetch read them.
+            if holder:
+                content = self.shared.get("{}:result:{}".format(key, holder))
+                if content is not None:
+                    self._count("shared_across_processes")
+                    return CachedResponse(content)
+            if self.shared.add(lease_key, token, config["lease"]) or time.monotonic() > deadline:
+                break
+            holder = self.shared.get(lease_key) or holder
+            time.sleep(config["poll_interval"])
+        try:
+            self._count("fetches")
+            response = fetch()
+            if response.status_code == 200:
+                self.shared.set("{}:result:{}".format(key, token), response.content, config["result_ttl"])
+            return response
+        finally:
+            if self.shared.get(lease_key) == token:
+                self.shared.delete(lease_key)
+
+    def stats(self):
+        """Returns the number of fetches made, and of fetches avoided by
+        sharing a result."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+single_flight = SingleFlight()
+
+
+class CachingClient(object):
+    """Wraps an ASnake client so that GET requests for cacheable record types
+    are answered from a RecordCache, and concurrent identical GET requests
+    for them are collapsed into one by a SingleFlight.
+
+    Requests for other record types, such as chunks of archival objects, are
+    sent straight to the wrapped client, since a single flight would add
+    round trips to the shared cache backend to every one of them.
+
+    Only successful responses are cached. `get_paged` requests each page
+    through `get`. Other methods and attributes are passed through to the
+    wrapped client.
+    """
+
+    get_paged = ASnakeClient.get_paged
+
+    def __init__(self, client, cache=None, flights=None):
+        self.client = client
+        self.cache = cache or record_cache
+        self.flights = flights or single_flight
+
+    def get(self, url, *args, **kwargs):
+        params = kwargs.get("params")
+        record_type = get_record_type(url, params)
+        if not self.cache.ttl(record_type):
+            return self.client.get(url, *args, **kwargs)
+        key = make_key(url, params)
+        found, content = self.cache.get(record_type, key)
+        if found:
+            return CachedResponse(content)
+        if not settings.ARCHIVESSPACE_SINGLE_FLIGHT["enabled"]:
+            return self._fetch(record_type, key, url, *args, **kwargs)
+        return self.flights.fetch(key, lambda: self._fetch(record_type, key, url, *args, **kwargs))
+
+    def _fetch(self, record_type, key, url, *args, **kwargs):
+        response = self.client.get(url, *args, **kwargs)
+        if response.status_code == 200:
+            self.cache.set(record_type, key, response.content, len(response.content))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -1,7 +1,27 @@
-from requests import Session
+import smtplib
+import threading
+import time
+
+from asnake.client import ASnakeClient
+from django.core.mail import get_connection
+from requests import ConnectionError as RequestsConnectionError
+from requests import ConnectTimeout, Session, Timeout
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 from request_broker import settings
 
+from .cache import CachingClient
+from .mirror import MirrorClient
+
+
+class ArchivesSpaceError(Exception):
+    """Raised when ArchivesSpace responds with an error."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 def http_meth_factory(meth):
     """Utility method for producing HTTP proxy methods.
@@ -25,12 +45,277 @@ class ProxyMethods(type):
             setattr(cls, meth, fn)
 
 
+class AeonError(Exception):
+    """Raised when the Aeon API rejects a transaction or cannot be reached."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class AeonAPIClient(metaclass=ProxyMethods):
+    """Client for the Aeon API, which keeps connections alive in a sized pool."""
+
+    create_request_path = "Requests/create"
 
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, api_key=None, pool_size=10):
         self.baseurl = baseurl
         self.session = Session()
         self.session.headers.update(
             {"Accept": "application/json",
              "User-Agent": "AeonAPIClient/0.1",
-             "X-AEON-API-KEY": settings.AEON_API_KEY})
+             "X-AEON-API-KEY": api_key or settings.AEON["api_key"] or ""})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def create_request(self, transaction):
+        """Creates a transaction in Aeon.
+
+        Aeon does not recognize a transaction which is sent twice, so a
+        transaction is only sent again if a connection to Aeon could not be
+        established, up to `AEON["max_attempts"]` times with exponential
+        backoff. Errors and timeouts once the transaction may have been sent
+        are not retried.
+
+        Args:
+            transaction (dict): transaction data, in the Aeon API request schema.
+
+        Returns:
+            dict: the transaction created by Aeon.
+
+        Raises:
+            AeonError: if Aeon rejects the transaction, or it could not be sent.
+        """
+        max_attempts = settings.AEON["max_attempts"]
+        for attempt in range(1, max_attempts + 1):
+            try:
+                resp = self.post(self.create_request_path, json=transaction, timeout=settings.AEON["timeout"])
+            except (RequestsConnectionError, Timeout) as e:
+                if attempt == max_attempts or not connection_not_established(e):
+                    raise AeonError("Error connecting to Aeon: {}".format(e))
+                time.sleep(settings.AEON["backoff"] * 2 ** (attempt - 1))
+                continue
+            if resp.status_code >= 400:
+                raise AeonError("Aeon responded with {}: {}".format(resp.status_code, resp.text), resp.status_code)
+            return resp.json()
+
+
+def connection_not_established(error):
+    """Returns True if a requests error was raised before any part of the
+    request was sent."""
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class AeonClientPool(object):
+    """Process-wide holder for an Aeon API client, so that every transaction
+    sent by the process reuses the same pooled connections."""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Returns the shared Aeon client, creating it if necessary."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = AeonAPIClient(settings.AEON["baseurl"], pool_size=settings.AEON["pool_size"])
+        return self._client
+
+    def reset(self):
+        """Discards the shared client, closing its pooled connections."""
+        with self._lock:
+            if self._client is not None:
+                self._client.session.close()
+            self._client = None
+
+
+class ArchivesSpaceSessionPool(object):
+    """Process-wide holder for an authenticated ArchivesSpace client.
+
+    The client is created and logged in the first time it is requested, and
+    the session token is then reused by every request handled by the process.
+    Re-authentication happens transparently when ArchivesSpace rejects an
+    expired token, and is serialized so that concurrent threads only log in
+    once. Connections are kept alive in a sized urllib3 pool.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Returns the shared ASnake client, creating it if necessary."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._make_client()
+        return self._client
+
+    def _make_client(self):
+        client = ASnakeClient(baseurl=settings.ARCHIVESSPACE["baseurl"],
+                              username=settings.ARCHIVESSPACE["username"],
+                              password=settings.ARCHIVESSPACE["password"],
+                              retry_with_auth=True)
+        pool_size = settings.ARCHIVESSPACE["pool_size"]
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        client.session.mount("http://", adapter)
+        client.session.mount("https://", adapter)
+        authorize = client.authorize
+
+        def locked_authorize(*args, **kwargs):
+            """Logs in unless another thread already replaced the token this
+            thread was using."""
+            stale_token = client.session.headers.get("X-ArchivesSpace-Session")
+            with self._auth_lock:
+                current_token = client.session.headers.get("X-ArchivesSpace-Session")
+                if current_token and current_token != stale_token:
+                    return current_token
+                return authorize(*args, **kwargs)
+
+        # ASnakeClient calls `self.authorize()` when a request returns a 403,
+        # so the instance attribute also guards those re-authentications.
+        client.authorize = locked_authorize
+        client.authorize()
+        return client
+
+    def warm_up(self):
+        """Logs in and opens a connection before the first request arrives."""
+        resp = self.client.get("version")
+        resp.raise_for_status()
+        return resp
+
+    def reset(self):
+        """Discards the shared client, closing its pooled connections."""
+        with self._lock:
+            if self._client is not None:
+                self._client.session.close()
+            self._client = None
+
+
+class ConcurrencyLimitedClient(object):
+    """Wraps an ASnake client so that requests wait for a slot from a shared
+    semaphore, bounding the number of requests in flight to ArchivesSpace.
+
+    `get_paged` requests each page through `get`, so every page waits for a
+    slot, rather than through the wrapped client."""
+
+    get_paged = ASnakeClient.get_paged
+
+    def __init__(self, client, semaphore):
+        self.client = client
+        self.semaphore = semaphore
+
+    def get(self, *args, **kwargs):
+        with self.semaphore:
+            return self.client.get(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        with self.semaphore:
+            return self.client.post(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class SMTPConnection(object):
+    """Long-lived connection to the mail server, shared by every message sent
+    by a process.
+
+    The connection is opened the first time a message is sent, and reused for
+    later messages so that connection setup and TLS negotiation only happen
+    once. It is reopened if it has been idle for longer than
+    `EMAIL_CONNECTION_IDLE_TIMEOUT` seconds, or if the server has closed it.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._last_used = 0
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages):
+        """Sends each message in turn over the shared connection.
+
+        Args:
+            messages (list): django.core.mail.EmailMessage objects.
+
+        Returns:
+            list: None for each message which was sent, or the exception
+                raised while sending it.
+        """
+        results = []
+        with self._lock:
+            for message in messages:
+                try:
+                    self._send(message)
+                    results.append(None)
+                except Exception as e:
+                    self._close()
+                    results.append(e)
+        return results
+
+    def _send(self, message):
+        try:
+            self._open().send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            self._close()
+            self._open().send_messages([message])
+        self._last_used = time.monotonic()
+
+    def _open(self):
+        if self._connection is not None and time.monotonic() - self._last_used > settings.EMAIL_CONNECTION_IDLE_TIMEOUT:
+            self._close()
+        if self._connection is None:
+            self._connection = get_connection(fail_silently=False)
+            self._connection.open()
+            self._last_used = time.monotonic()
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def close(self):
+        """Closes the shared connection."""
+        with self._lock:
+            self._close()
+
+
+aeon_pool = AeonClientPool()
+aspace_pool = ArchivesSpaceSessionPool()
+aspace_requests = threading.BoundedSemaphore(settings.ARCHIVESSPACE["max_in_flight"])
+smtp_connection = SMTPConnection()
+
+
+def get_aspace_client(data_source=None, cached=True):
+    """Returns the process-wide authenticated ArchivesSpace client.
+
+    GET requests for cacheable records are answered from the record cache, and
+    at most `ARCHIVESSPACE["max_in_flight"]` requests are sent concurrently by
+    the process. With the `mirror` data source, requests are answered from the
+    local mirror of ArchivesSpace records where possible.
+
+    Args:
+        data_source (str): `live` or `mirror`, defaulting to
+            `ARCHIVESSPACE["data_source"]`.
+        cached (bool): answer requests from the record cache. Callers which
+            need current data, such as the mirror sync, should pass False.
+    """
+    data_source = data_source or settings.ARCHIVESSPACE["data_source"]
+    if data_source not in ("live", "mirror"):
+        raise ValueError("Unknown data source '{}', expected either 'live' or 'mirror'".format(data_source))
+    client = ConcurrencyLimitedClient(aspace_pool.client, aspace_requests)
+    if cached:
+        client = CachingClient(client)
+    return MirrorClient(client) if data_source == "mirror" else client
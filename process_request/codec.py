@@ -0,0 +1,98 @@
+import json
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_dumps(obj, default=None):
+    return json.dumps(obj, default=default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_dumps(obj, default=None):
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+# Functions to decode and encode JSON, keyed by the name used in the
+# JSON_CODEC setting. Encoders return compact UTF-8 bytes.
+CODECS = {"json": (json.loads, stdlib_dumps)}
+if orjson:
+    CODECS["orjson"] = (orjson.loads, orjson_dumps)
+
+
+def codec_name():
+    """Returns the name of the codec chosen by the JSON_CODEC setting.
+
+    `auto` picks the fastest codec which is installed.
+    """
+    name = settings.JSON_CODEC
+    if name == "auto":
+        return "orjson" if "orjson" in CODECS else "json"
+    if name not in CODECS:
+        raise ImproperlyConfigured("JSON codec {} is not available, choose one of {}".format(name, ", ".join(CODECS)))
+    return name
+
+
+def loads(data):
+    """Decodes a JSON document from str or UTF-8 bytes."""
+    return CODECS[codec_name()][0](data)
+
+
+def dumps(obj, default=None):
+    """Encodes an object as compact JSON, returned as UTF-8 bytes.
+
+    Args:
+        default (callable): called for objects the codec cannot encode, and
+            returns an encodable replacement.
+    """
+    return CODECS[codec_name()][1](obj, default)
+
+
+def decode_response(response):
+    """Decodes the body of a response from ArchivesSpace.
+
+    Responses which already hold decoded data, such as cached responses, are
+    returned by their own `json` method.
+    """
+    if isinstance(response, requests.Response):
+        return loads(response.content)
+    return response.json()
+
+
+class CodecJSONRenderer(JSONRenderer):
+    """Renders compact JSON with the configured codec.
+
+    Requests for indented output fall back to the stdlib renderer.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped for the same reason as in JSONRenderer: they are valid in
+        # JSON but not in JavaScript.
+        return dumps(data, self.encoder.default).replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class CodecJSONParser(JSONParser):
+    """Parses JSON request bodies with the configured codec."""
+
+    renderer_class = CodecJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError("JSON parse error - {}".format(exc))
@@ -1,17 +1,31 @@
-import json
 import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 
 import inflect
 import shortuuid
 from request_broker import settings
 from asnake.utils import (format_resource_id, get_date_display, get_note_text,
-                          text_in_note, resolve_to_uri)
+                          resolve_to_uri)
 from django.conf import settings
 from ordered_set import OrderedSet
+from rapidfuzz import fuzz
+
+from .codec import decode_response, loads
+from .models import RestrictedSubcontainer
 
 CONFIDENCE_RATIO = 97  # Minimum confidence ratio to match against.
 OPEN_TEXT = ["Open for research", "Open for scholarly research"]
 CLOSED_TEXT = ["Restricted"]
+OPEN_QUERIES = tuple(text.lower() for text in OPEN_TEXT)
+CLOSED_QUERIES = tuple(text.lower() for text in CLOSED_TEXT)
+CONTAINER_SEARCH_PAGE_SIZE = 100  # Number of results per page when searching for items in a container.
+WAYPOINT_SIZE = 200  # Number of children returned by ArchivesSpace tree/waypoint requests.
+STRIP_TAGS_CACHE_SIZE = 8192  # Number of sanitized strings to keep.
+INFLECT_ENGINE = inflect.engine()  # Building an engine compiles its word lists, so build it once.
 
 
 def get_container_indicators(item_json):
@@ -168,69 +182,128 @@ def get_preferred_format(item_json):
     return preferred
 
 
-def get_restricted_in_container(container_uri, client):
+def iter_search_results(search_uri, client):
+    """Yields the results from every page of an ArchivesSpace search.
+
+    The first page is fetched to find out how many pages there are, and the
+    remaining pages are then fetched concurrently, a few at a time. Results
+    are yielded in page order.
+
+    Args:
+        search_uri (string): a search URI, without a page parameter.
+        client: an ASnake client
+
+    Yields:
+        dict: search results.
+    """
+    def fetch_page(page):
+        return decode_response(client.get(f"{search_uri}&page={page}"))
+
+    first_page = fetch_page(1)
+    yield from first_page["results"]
+    remaining = list(range(2, first_page["last_page"] + 1))
+    if remaining:
+        max_workers = min(settings.ARCHIVESSPACE["max_in_flight"], len(remaining))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for pages in list_chunks(remaining, max_workers):
+                for page in executor.map(fetch_page, pages):
+                    yield from page["results"]
+
+
+def get_restricted_subcontainers(item, client, ancestor_statuses):
+    """Gets the subcontainers of a restricted archival object search result.
+
+    Args:
+        item (dict): a search result with resolved ancestors.
+        client: an ASnake client
+        ancestor_statuses (dict): rights statuses already determined for
+            ancestors, keyed by URI. Updated with any new ancestors.
+
+    Returns:
+        list: tuples of top container URI and subcontainer display string for
+            each instance, or an empty list if the object is not restricted.
+    """
+    item_json = loads(item["json"])
+    status = get_rights_status(item_json, client)
+    if not status:
+        for ancestor_uri in item["_resolved_ancestors"]:
+            for ancestor in item["_resolved_ancestors"][ancestor_uri]:
+                if ancestor_uri not in ancestor_statuses:
+                    ancestor_statuses[ancestor_uri] = get_rights_status(loads(ancestor["json"]), client)
+                status = ancestor_statuses[ancestor_uri]
+                if status:
+                    break
+    restricted = []
+    if status in ["closed", "conditional"]:
+        for instance in item_json["instances"]:
+            sub_container = instance.get("sub_container", {})
+            if all(["type_2" in sub_container, "indicator_2" in sub_container]):
+                restricted.append((
+                    sub_container.get("top_container", {}).get("ref"),
+                    f"{sub_container['type_2'].capitalize()} {sub_container['indicator_2']}"))
+    return restricted
+
+
+def get_restricted_in_container(container_uri, client, index_fresh=None):
     """Fetches information about other restricted items in the same container.
 
+    Reads from the container restriction index when it is fresh, and otherwise
+    searches ArchivesSpace. Rights decisions for ancestors are made once per
+    ancestor URI and reused for every item in the container which inherits them.
+
     Args:
         container_uri (string): A URI for an ArchivesSpace Top Container.
+        index_fresh (bool): whether the index is fresh, if already known.
 
     Returns:
         restricted (string): a comma-separated list of other restricted items in
             the same container.
     """
+    indexed = RestrictedSubcontainer.for_container(container_uri, index_fresh)
+    if indexed is not None:
+        return ", ".join(indexed)
+    escaped_url = container_uri.replace('/', '\\/')
+    search_uri = f"repositories/{settings.ARCHIVESSPACE['repo_id']}/search?q=top_container_uri_u_sstr:{escaped_url}&fields[]=uri,json,ancestors&resolve[]=ancestors:id&type[]=archival_object&page_size={CONTAINER_SEARCH_PAGE_SIZE}"
+    ancestor_statuses = {}
     restricted = []
-    this_page = 1
-    more = True
-    while more:
-        escaped_url = container_uri.replace('/', '\\/')
-        search_uri = f"repositories/{settings.ARCHIVESSPACE['repo_id']}/search?q=top_container_uri_u_sstr:{escaped_url}&page={this_page}&fields[]=uri,json,ancestors&resolve[]=ancestors:id&type[]=archival_object&page_size=25"
-        items_in_container = client.get(search_uri).json()
-        for item in items_in_container["results"]:
-            item_json = json.loads(item["json"])
-            status = get_rights_status(item_json, client)
-            if not status:
-                for ancestor_uri in item["_resolved_ancestors"]:
-                    for ancestor in item["_resolved_ancestors"][ancestor_uri]:
-                        status = get_rights_status(json.loads(ancestor["json"]), client)
-                        if status:
-                            break
-            if status in ["closed", "conditional"]:
-                for instance in item_json["instances"]:
-                    sub_container = instance["sub_container"]
-                    if all(["type_2" in sub_container, "indicator_2" in sub_container]):
-                        restricted.append(f"{sub_container['type_2'].capitalize()} {sub_container['indicator_2']}")
-        this_page += 1
-        if this_page > items_in_container["last_page"]:
-            more = False
+    for item in iter_search_results(search_uri, client):
+        restricted += [subcontainer for _, subcontainer in get_restricted_subcontainers(item, client, ancestor_statuses)]
     return ", ".join(restricted)
 
 
-def get_rights_info(item_json, client):
+def get_rights_info(item_json, client, ancestor_rights=None):
     """Gets rights status and text for an archival object.
 
     If no parseable rights status is available, it is assumed the item is open.
+    Ancestors are walked once, stopping as soon as both a status and text have
+    been found. Status and text are determined together for each ancestor and
+    memoized by URI and lock version, so siblings which share ancestors only
+    evaluate each ancestor once.
 
     Args:
         item_json (dict): json for an archival object
         client: an ASnake client
+        ancestor_rights (dict): optional store of rights already determined
+            for ancestors, shared between calls.
 
     Returns:
         status, text: A tuple containing the rights status and text. Status is
         one of "closed", "conditional" or "open". Text is either None or a string
         describing the restriction.
     """
+    ancestor_rights = {} if ancestor_rights is None else ancestor_rights
     status = get_rights_status(item_json, client)
-    if not status:
-        for ancestor in item_json["ancestors"]:
-            status = get_rights_status(ancestor["_resolved"], client)
-            if status:
-                break
     text = get_rights_text(item_json, client)
-    if not text:
-        for ancestor in item_json["ancestors"]:
-            text = get_rights_text(ancestor["_resolved"], client)
-            if text:
-                break
+    for ancestor in item_json["ancestors"]:
+        if status and text:
+            break
+        resolved = ancestor["_resolved"]
+        key = (resolved.get("uri", ancestor.get("ref")), resolved.get("lock_version"))
+        if key not in ancestor_rights:
+            ancestor_rights[key] = (get_rights_status(resolved, client), get_rights_text(resolved, client))
+        ancestor_status, ancestor_text = ancestor_rights[key]
+        status = status or ancestor_status
+        text = text or ancestor_text
     return status if status else "open", text
 
 
@@ -257,17 +330,49 @@ def get_rights_status(item_json, client):
                 status = "conditional"
     elif [n for n in item_json.get("notes", []) if n.get("type") == "accessrestrict"]:
         notes = [n for n in item_json["notes"] if n.get("type") == "accessrestrict"]
-        if any([text_in_note(n, text, client, confidence=CONFIDENCE_RATIO) for text in CLOSED_TEXT for n in notes]):
+        matches = [classify_note_text(get_normalized_note_text(n, client)) for n in notes]
+        if any(closed for closed, _ in matches):
             status = "closed"
-            if any([text_in_note(n, text, client, confidence=CONFIDENCE_RATIO) for text in OPEN_TEXT for n in notes]):
+            if any(is_open for _, is_open in matches):
                 status = "open"
-        elif any([text_in_note(n, text, client, confidence=CONFIDENCE_RATIO) for text in OPEN_TEXT for n in notes]):
+        elif any(is_open for _, is_open in matches):
             status = "open"
         else:
             status = "conditional"
     return status
 
 
+def get_normalized_note_text(note, client):
+    """Returns the lowercased text of a note, joined into a single string."""
+    return " ".join([n.lower() for n in get_note_text(note, client)])
+
+
+def text_matches(note_text, query):
+    """Indicates whether normalized note text matches a lowercased query.
+
+    Equivalent to `asnake.utils.text_in_note` with `CONFIDENCE_RATIO`, but
+    checks for an exact substring match before falling back to fuzzy matching.
+    A partial ratio of 100 means the shorter string appears in the longer one.
+    """
+    if query in note_text or (note_text and note_text in query):
+        return True
+    return bool(fuzz.partial_ratio(note_text, query, score_cutoff=CONFIDENCE_RATIO))
+
+
+@lru_cache(maxsize=4096)
+def classify_note_text(note_text):
+    """Classifies normalized accessrestrict note text.
+
+    Results are cached by note text, since the same notes recur across items.
+
+    Returns:
+        closed, open: booleans indicating whether the text matches any of
+            `CLOSED_TEXT` or `OPEN_TEXT`.
+    """
+    return (any(text_matches(note_text, query) for query in CLOSED_QUERIES),
+            any(text_matches(note_text, query) for query in OPEN_QUERIES))
+
+
 def get_rights_text(item_json, client):
     """Fetches text describing restrictions on an archival object.
 
@@ -367,7 +472,13 @@ def get_size(instances):
             raise Exception("Error parsing instances") from e
     return ", ".join(
         ["{} {}".format(
-            e["number"], inflect.engine().plural(e["extent_type"], e["number"])) for e in extents])
+            e["number"], pluralize(e["extent_type"], e["number"])) for e in extents])
+
+
+@lru_cache(maxsize=1024)
+def pluralize(word, count):
+    """Returns the plural form of a word for a count, using a shared inflect engine."""
+    return INFLECT_ENGINE.plural(word, count)
 
 
 def get_parent_title(obj_json):
@@ -382,10 +493,14 @@ def get_parent_title(obj_json):
     return title
 
 
-def get_url(obj_json, client, host=None):
-    """Returns a full or relative URL for an object, depending on if a host is provided."""
+def get_url(obj_json, client, host=None, children=None):
+    """Returns a full or relative URL for an object, depending on if a host is provided.
+
+    Whether or not the object has children is looked up unless already known.
+    """
     uuid = shortuuid.uuid(name=obj_json["uri"])
-    path = "collections" if has_children(obj_json, client) else "objects"
+    children = has_children(obj_json, client) if children is None else children
+    path = "collections" if children else "objects"
     return f"{host}/{path}/{uuid}" if host else f"/{path}/{uuid}"
 
 
@@ -396,6 +511,45 @@ def has_children(obj_json, client):
     return True if tree_node['child_count'] > 0 else False
 
 
+def get_child_statuses(objects, client, waypoints=None):
+    """Determines which of a list of archival objects have children.
+
+    Siblings are grouped together and looked up with a single tree/waypoint
+    request, which returns the child count for every node in the waypoint.
+    Objects which are not found in their waypoint fall back to `has_children`.
+
+    Args:
+        objects (list): json for archival objects.
+        client: an ASnake client
+        waypoints (dict): optional store of child counts already fetched,
+            keyed by resource tree, parent node and waypoint offset.
+
+    Returns:
+        dict: booleans indicating whether an object has children, keyed by
+            archival object URI.
+    """
+    statuses = {}
+    waypoints = {} if waypoints is None else waypoints
+    siblings = defaultdict(list)
+    for obj in objects:
+        parent_uri = obj.get("parent", {}).get("ref")
+        offset = (obj.get("position") or 0) // WAYPOINT_SIZE
+        siblings[(obj["resource"]["ref"], parent_uri, offset)].append(obj)
+    for key, group in siblings.items():
+        if key not in waypoints:
+            resource_uri, parent_uri, offset = key
+            params = {"offset": offset, "parent_node": parent_uri} if parent_uri else {"offset": offset}
+            waypoint = client.get("{}/tree/waypoint".format(resource_uri), params=params)
+            waypoints[key] = {n["uri"]: n["child_count"] for n in waypoint.json()} if waypoint.status_code == 200 else {}
+        child_counts = waypoints[key]
+        for obj in group:
+            if obj["uri"] in child_counts:
+                statuses[obj["uri"]] = child_counts[obj["uri"]] > 0
+            else:
+                statuses[obj["uri"]] = has_children(obj, client)
+    return statuses
+
+
 def indicator_to_integer(indicator):
     """Converts an instance indicator to an integer.
 
@@ -454,3 +608,142 @@ def get_formatted_resource_id(resource, client):
     Concatenates the resource id parts using the separator from the config
     """
     return format_resource_id(resource, client, settings.RESOURCE_ID_SEPARATOR)
+
+
+TAG_PATTERN = re.compile(r'<[/\w][^>]+>')
+TAG_CONTENT_PATTERN = re.compile(r"""
+    ([A-Za-z_][\w.-]*)((?:\s+[A-Za-z_][\w.-]*\s*=\s*(?:"[^"<&]*"|'[^'<&]*'))*)\s*(/?)
+    | /([A-Za-z_][\w.-]*)\s*
+""", re.ASCII | re.VERBOSE)
+ATTRIBUTE_NAME_PATTERN = re.compile(r'([A-Za-z_][\w.-]*)\s*=', re.ASCII)
+CHARACTER_REFERENCE_PATTERN = re.compile(r'&#(?:([0-9]+)|x([0-9a-fA-F]+));')
+INVALID_REFERENCE_PATTERN = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|#[0-9]+|#x[0-9a-fA-F]+);)')
+INVALID_CHARACTERS_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\ud800-\udfff]')
+SURROGATES_PATTERN = re.compile('[\ud800-\udfff]')
+XML_ENTITIES = (("&lt;", "<"), ("&gt;", ">"), ("&quot;", '"'), ("&apos;", "'"), ("&amp;", "&"))
+
+
+class MalformedMarkup(Exception):
+    """Raised when markup is known not to be well-formed XML."""
+    pass
+
+
+class UnsupportedMarkup(Exception):
+    """Raised when markup needs to be parsed to determine its text content."""
+    pass
+
+
+@lru_cache(maxsize=STRIP_TAGS_CACHE_SIZE)
+def strip_tags(user_string):
+    """Strips XML and HTML tags from a string.
+
+    Well-formed markup is replaced by its text content, with entity and
+    character references decoded. If the markup is not well-formed, only tags
+    are removed. Results are cached, since titles and container strings repeat
+    across a list.
+
+    Most strings are handled by `scan_text_content` in a single pass. Markup
+    it does not handle, such as comments, CDATA sections or non-ASCII tag
+    names, is parsed with ElementTree instead.
+    """
+    try:
+        return scan_text_content(user_string)
+    except MalformedMarkup:
+        return TAG_PATTERN.sub('', user_string)
+    except UnsupportedMarkup:
+        return parse_text_content(user_string)
+
+
+def scan_text_content(user_string):
+    """Returns the text content of a string of markup, as ElementTree would
+    find it once the string is wrapped in a root element.
+
+    The string is split on tag boundaries in a single pass without building a
+    tree. Tags are classified with `classify_tag`, which is cached since the
+    same few tags recur, and only their nesting is checked here.
+
+    Raises:
+        MalformedMarkup: if the string is not well-formed XML.
+        UnsupportedMarkup: if the string contains markup which is not scanned.
+    """
+    if "<" not in user_string and "&" not in user_string and "\r" not in user_string:
+        return user_string
+    if "\r" in user_string or "]]>" in user_string:
+        raise UnsupportedMarkup
+    if INVALID_CHARACTERS_PATTERN.search(user_string):
+        # ElementTree cannot encode surrogates, and rejects other characters.
+        raise UnsupportedMarkup if SURROGATES_PATTERN.search(user_string) else MalformedMarkup
+    if "&" in user_string and INVALID_REFERENCE_PATTERN.search(user_string):
+        raise MalformedMarkup
+    pieces = user_string.split("<")
+    text = [pieces[0]]
+    open_tags = []
+    for piece in islice(pieces, 1, None):
+        tag, closed, tail = piece.partition(">")
+        if not closed:
+            raise UnsupportedMarkup
+        opened, name = classify_tag(tag)
+        if opened:
+            open_tags.append(name)
+        elif name and (not open_tags or open_tags.pop() != name):
+            raise MalformedMarkup
+        text.append(tail)
+    if open_tags:
+        raise MalformedMarkup
+    return decode_references("".join(text))
+
+
+def decode_references(text):
+    """Decodes entity and character references which are known to be valid."""
+    if "&" in text:
+        if "&#" in text:
+            text = CHARACTER_REFERENCE_PATTERN.sub(decode_character_reference, text)
+        for entity, character in XML_ENTITIES:
+            text = text.replace(entity, character)
+    return text
+
+
+@lru_cache(maxsize=1024)
+def classify_tag(tag):
+    """Classifies the content of a tag, between its angle brackets.
+
+    Returns:
+        opened, name: whether the tag opens an element, and the name of the
+            element, or None for empty-element tags.
+
+    Raises:
+        MalformedMarkup: if the tag repeats an attribute.
+        UnsupportedMarkup: if the tag is not a start, end or empty-element tag.
+    """
+    match = TAG_CONTENT_PATTERN.fullmatch(tag)
+    if not match:
+        # Comments, CDATA sections, processing instructions or stray brackets.
+        raise UnsupportedMarkup
+    name, attributes, empty, close = match.groups()
+    if attributes:
+        names = ATTRIBUTE_NAME_PATTERN.findall(attributes)
+        if len(names) != len(set(names)):
+            raise MalformedMarkup
+    if close:
+        return False, close
+    return (False, None) if empty else (True, name)
+
+
+def decode_character_reference(match):
+    """Returns the character for a matched character reference."""
+    decimal, hexadecimal = match.groups()
+    codepoint = int(decimal, 10) if decimal else int(hexadecimal, 16)
+    if not (codepoint in (0x9, 0xA, 0xD) or 0x20 <= codepoint <= 0xD7FF or 0xE000 <= codepoint <= 0xFFFD or 0x10000 <= codepoint <= 0x10FFFF):
+        raise MalformedMarkup
+    return chr(codepoint)
+
+
+def parse_text_content(user_string):
+    """Strips tags from a string by parsing it with ElementTree, falling back
+    to removing anything which looks like a tag if the string is not
+    well-formed."""
+    try:
+        xmldoc = ET.fromstring(f'<xml>{user_string}</xml>')
+        return ''.join(xmldoc.itertext())
+    except ET.ParseError:
+        return TAG_PATTERN.sub('', user_string)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from process_request.routines import ContainerRestrictionIndexer
+
+
+class Command(BaseCommand):
+    help = "Indexes restricted subcontainers in each ArchivesSpace top container."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Rebuild the index from scratch instead of only refreshing records modified since the last run.")
+
+    def handle(self, *args, **options):
+        run = ContainerRestrictionIndexer().run(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(
+            "Indexed {} archival objects in {}.".format(run.indexed, run.finished - run.started)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from process_request.routines import EmailJobWorker
+
+
+class Command(BaseCommand):
+    help = "Delivers queued email jobs, retrying transient errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Exit once there are no more jobs due, instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        attempted = EmailJobWorker().run(once=options["once"])
+        self.stdout.write(self.style.SUCCESS("Attempted {} email jobs.".format(attempted)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from process_request.routines import MirrorSyncer
+
+
+class Command(BaseCommand):
+    help = "Copies ArchivesSpace records into the local mirror."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Copy every record and remove deleted records, instead of only copying records modified since the last run.")
+
+    def handle(self, *args, **options):
+        run = MirrorSyncer().run(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(
+            "Synced {} records in {}.".format(run.synced, run.finished - run.started)))
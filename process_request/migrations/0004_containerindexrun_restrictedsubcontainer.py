@@ -0,0 +1,32 @@
+# Generated by Django 4.0.9 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_request', '0003_auto_20211106_1625'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerIndexRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('indexed', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RestrictedSubcontainer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('top_container_uri', models.CharField(db_index=True, max_length=255)),
+                ('archival_object_uri', models.CharField(db_index=True, max_length=255)),
+                ('subcontainer', models.CharField(max_length=255)),
+            ],
+        ),
+    ]
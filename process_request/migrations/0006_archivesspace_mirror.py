@@ -0,0 +1,55 @@
+# Generated by Django 4.0.9 on 2026-10-17 01:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_request', '0005_emailjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirroredContainer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('top_container_uri', models.CharField(db_index=True, max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirroredRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uri', models.CharField(max_length=255, unique=True)),
+                ('record_type', models.CharField(db_index=True, max_length=50)),
+                ('ref_id', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('resource_uri', models.CharField(blank=True, max_length=255)),
+                ('parent_uri', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('position', models.IntegerField(blank=True, null=True)),
+                ('system_mtime', models.DateTimeField(blank=True, null=True)),
+                ('synced', models.DateTimeField()),
+                ('json', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorSyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('synced', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mirroredrecord',
+            index=models.Index(fields=['resource_uri', 'parent_uri', 'position'], name='process_req_resourc_82c88e_idx'),
+        ),
+        migrations.AddField(
+            model_name='mirroredcontainer',
+            name='record',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='containers', to='process_request.mirroredrecord'),
+        ),
+    ]
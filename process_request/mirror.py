@@ -0,0 +1,241 @@
+import re
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from asnake.client import ASnakeClient
+from django.db import close_old_connections
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .cache import CachedResponse
+from .codec import decode_response, dumps
+from .helpers import WAYPOINT_SIZE
+from .models import MirroredRecord, MirrorSyncRun
+
+RECORDS_PATTERN = re.compile(
+    r"^/(repositories/\d+/(archival_objects|resources|top_containers|digital_objects)|locations|agents/(people|corporate_entities|families|software))$")
+FIND_BY_ID_PATTERN = re.compile(r"^/repositories/\d+/find_by_id/archival_objects$")
+TREE_NODE_PATTERN = re.compile(r"^(/repositories/\d+/resources/\d+)/tree/node$")
+TREE_WAYPOINT_PATTERN = re.compile(r"^(/repositories/\d+/resources/\d+)/tree/waypoint$")
+SEARCH_PATTERN = re.compile(r"^/repositories/\d+/search$")
+CONTAINER_QUERY_PREFIX = "top_container_uri_u_sstr:"
+
+
+def parse_request(url, params=None):
+    """Returns the path of a GET request, and its query parameters as lists
+    of strings keyed by name without any `[]` suffix."""
+    parsed = urlparse(url)
+    query = {}
+    for key, values in parse_qs(parsed.query).items():
+        query.setdefault(key[:-2] if key.endswith("[]") else key, []).extend(values)
+    for key, values in (params or {}).items():
+        values = values if isinstance(values, (list, tuple)) else [values]
+        query.setdefault(key[:-2] if key.endswith("[]") else key, []).extend(str(v) for v in values)
+    return "/" + parsed.path.lstrip("/"), query
+
+
+def attach(data, path, loaded, wanted):
+    """Attaches `_resolved` records to the references at `path`, which are
+    found at any depth in `data`, as ArchivesSpace does for a `resolve[]`
+    parameter such as `top_container::container_locations`.
+
+    Args:
+        data (dict or list): json to resolve references in.
+        path (list): names of keys holding references, outermost first.
+        loaded (dict): json for records keyed by URI, or None for records
+            which are not available.
+        wanted (set): URIs of records which are not in `loaded` yet.
+
+    Returns:
+        bool: whether every reference was resolved.
+    """
+    if isinstance(data, list):
+        return all([attach(item, path, loaded, wanted) for item in data])
+    if not isinstance(data, dict):
+        return True
+    complete = True
+    for key, value in data.items():
+        if key == "_resolved":
+            continue
+        if key != path[0]:
+            complete = attach(value, path, loaded, wanted) and complete
+            continue
+        for pointer in value if isinstance(value, list) else [value]:
+            complete = attach_pointer(pointer, path, loaded, wanted) and complete
+    return complete
+
+
+def attach_pointer(pointer, path, loaded, wanted):
+    """Resolves a value found at the first key of `path`, and then the rest
+    of `path` within it."""
+    if not isinstance(pointer, dict):
+        return True
+    if "ref" in pointer:
+        if loaded.get(pointer["ref"]) is None:
+            wanted.add(pointer["ref"])
+            return False
+        pointer["_resolved"] = loaded[pointer["ref"]]
+        pointer = pointer["_resolved"]
+    return len(path) == 1 or attach(pointer, path[1:], loaded, wanted)
+
+
+def resolve_records(records, resolve, mirror_fresh=None):
+    """Resolves references in mirrored records from the mirror.
+
+    Resolved records are shared between the records which refer to them, and
+    must not be modified.
+
+    Args:
+        records (list): json for mirrored records.
+        resolve (list): values of a `resolve[]` parameter.
+        mirror_fresh (bool): whether the mirror is fresh, if already known.
+
+    Returns:
+        dict: json for the records whose references could all be resolved,
+            keyed by URI.
+    """
+    paths = [name.split("::") for name in resolve]
+    loaded = {}
+    while True:
+        wanted = set()
+        complete = [all([attach(record, path, loaded, wanted) for path in paths]) for record in records]
+        wanted -= set(loaded)
+        if not wanted:
+            break
+        found = dict(MirroredRecord.fresh(mirror_fresh, uri__in=wanted).values_list("uri", "json"))
+        loaded.update({uri: found.get(uri) for uri in wanted})
+    return {record["uri"]: record for record, resolved in zip(records, complete) if resolved}
+
+
+class MirrorClient(object):
+    """Wraps an ASnake client so that GET requests made while processing
+    items are answered from the local mirror of ArchivesSpace records.
+
+    Records which are missing from the mirror, or stale, are fetched from
+    ArchivesSpace individually. Answers which depend on the whole mirror,
+    such as child counts and the contents of top containers, are only given
+    while the mirror is fresh. Whether it is fresh is looked up once, when
+    the client is created, so a client should only be used for one request.
+    `get_paged` requests each page through `get`. Other requests and methods
+    are passed through to the wrapped client.
+
+    Django only closes database connections at the end of each request, so
+    connections opened by worker threads are closed after each lookup, unless
+    `CONN_MAX_AGE` allows them to be kept.
+
+    Args:
+        client: an ASnake client.
+        fresh (bool): whether the mirror is fresh, if already known.
+    """
+
+    get_paged = ASnakeClient.get_paged
+
+    def __init__(self, client, fresh=None):
+        self.client = client
+        self.fresh = MirrorSyncRun.is_fresh() if fresh is None else fresh
+        self.thread = threading.get_ident()
+        self.handlers = [
+            (FIND_BY_ID_PATTERN, self.find_by_id),
+            (RECORDS_PATTERN, self.records),
+            (TREE_NODE_PATTERN, self.tree_node),
+            (TREE_WAYPOINT_PATTERN, self.tree_waypoint),
+            (SEARCH_PATTERN, self.search),
+        ]
+
+    def get(self, url, *args, **kwargs):
+        path, query = parse_request(url, kwargs.get("params"))
+        for pattern, handler in self.handlers:
+            match = pattern.match(path)
+            if match:
+                try:
+                    response = handler(match, query, url, *args, **kwargs)
+                finally:
+                    if threading.get_ident() != self.thread:
+                        close_old_connections()
+                if response is not None:
+                    return response
+                break
+        return self.client.get(url, *args, **kwargs)
+
+    def records(self, match, query, url, *args, **kwargs):
+        """Answers requests for records by id, fetching records which are
+        not in the mirror from ArchivesSpace."""
+        ids = query.get("id_set")
+        if not ids or "id_set" not in (kwargs.get("params") or {}):
+            return None
+        uris = ["{}/{}".format(match.group(0), id) for id in ids]
+        found = resolve_records(
+            list(MirroredRecord.fresh(self.fresh, uri__in=uris).values_list("json", flat=True)), query.get("resolve", []), self.fresh)
+        records = [found[uri] for uri in uris if uri in found]
+        missing = [id for id, uri in zip(ids, uris) if uri not in found]
+        if missing:
+            live = self.client.get(url, *args, **dict(kwargs, params=dict(kwargs["params"], id_set=missing)))
+            if live.status_code != 200:
+                return live
+            records += decode_response(live)
+        return CachedResponse.from_data(records)
+
+    def find_by_id(self, match, query, url, *args, **kwargs):
+        ref_ids = query.get("ref_id", [])
+        found = dict(MirroredRecord.fresh(self.fresh, record_type="archival_object", ref_id__in=ref_ids).values_list("ref_id", "json"))
+        if not ref_ids or set(ref_ids) - set(found):
+            return None
+        return CachedResponse.from_data({"archival_objects": [{"ref": found[ref_id]["uri"], "_resolved": found[ref_id]} for ref_id in ref_ids]})
+
+    def tree_node(self, match, query, url, *args, **kwargs):
+        node_uri = query.get("node_uri", [None])[0]
+        if not self.fresh or not MirroredRecord.objects.filter(uri=node_uri).exists():
+            return None
+        return CachedResponse.from_data({"uri": node_uri, "child_count": MirroredRecord.objects.filter(parent_uri=node_uri).count()})
+
+    def tree_waypoint(self, match, query, url, *args, **kwargs):
+        parent_uri = query.get("parent_node", [""])[0]
+        if not self.fresh or (parent_uri and not MirroredRecord.objects.filter(uri=parent_uri).exists()):
+            return None
+        offset = int(query.get("offset", [0])[0])
+        child_counts = MirroredRecord.objects.filter(parent_uri=OuterRef("uri")).order_by().values("parent_uri").annotate(
+            count=Count("pk")).values("count")
+        children = MirroredRecord.objects.filter(
+            record_type="archival_object", resource_uri=match.group(1), parent_uri=parent_uri).order_by("position", "pk").annotate(
+            child_count=Coalesce(Subquery(child_counts, output_field=IntegerField()), 0))
+        return CachedResponse.from_data([
+            {"uri": uri, "position": position, "child_count": child_count}
+            for uri, position, child_count in children[offset * WAYPOINT_SIZE:(offset + 1) * WAYPOINT_SIZE].values_list(
+                "uri", "position", "child_count")])
+
+    def search(self, match, query, url, *args, **kwargs):
+        """Answers searches for the archival objects in a top container, and
+        for the titles of agents."""
+        q = query.get("q", [""])[0]
+        if q.startswith(CONTAINER_QUERY_PREFIX):
+            return self.container_search(q[len(CONTAINER_QUERY_PREFIX):].replace("\\/", "/"))
+        if any(t.startswith("agent_") for t in query.get("type", [])):
+            return self.agent_search([uri.strip().replace("\\/", "/") for uri in q.split(" OR ")])
+        return None
+
+    def container_search(self, container_uri):
+        if not self.fresh:
+            return None
+        objects = list(MirroredRecord.objects.filter(
+            record_type="archival_object", containers__top_container_uri=container_uri).distinct().order_by("pk").values_list("json", flat=True))
+        ancestor_uris = set(ancestor["ref"] for obj in objects for ancestor in obj.get("ancestors", []))
+        ancestors = dict(MirroredRecord.objects.filter(uri__in=ancestor_uris).values_list("uri", "json"))
+        if ancestor_uris - set(ancestors):
+            return None
+        return CachedResponse.from_data({"results": [{
+            "uri": obj["uri"],
+            "json": dumps(obj).decode("utf-8"),
+            "ancestors": [ancestor["ref"] for ancestor in obj.get("ancestors", [])],
+            "_resolved_ancestors": {
+                ancestor["ref"]: [{"uri": ancestor["ref"], "json": dumps(ancestors[ancestor["ref"]]).decode("utf-8")}]
+                for ancestor in obj.get("ancestors", [])},
+        } for obj in objects], "this_page": 1, "last_page": 1})
+
+    def agent_search(self, agent_uris):
+        found = dict(MirroredRecord.fresh(self.fresh, uri__in=agent_uris).values_list("uri", "json"))
+        if set(agent_uris) - set(found):
+            return None
+        return CachedResponse.from_data({"results": [{"title": found[uri]["title"]} for uri in agent_uris], "this_page": 1, "last_page": 1})
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -1,4 +1,12 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 
 class User(AbstractUser):
@@ -25,3 +33,288 @@ class User(AbstractUser):
         Returns the full name and email of a user.
         """
         return '{} <{}>'.format(self.full_name, self.email)
+
+
+class ContainerIndexRun(models.Model):
+    """A crawl of ArchivesSpace which updated the container restriction index."""
+
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    indexed = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def last_completed(cls):
+        """Returns the most recently started run which finished, or None."""
+        return cls.objects.filter(finished__isnull=False).order_by("-started").first()
+
+    @classmethod
+    def is_fresh(cls):
+        """Indicates whether the index was completely built, and has been
+        refreshed within `CONTAINER_INDEX_MAX_AGE` seconds."""
+        if not settings.CONTAINER_INDEX_MAX_AGE or not cls.objects.filter(full=True, finished__isnull=False).exists():
+            return False
+        last_run = cls.last_completed()
+        return last_run.started > timezone.now() - timedelta(seconds=settings.CONTAINER_INDEX_MAX_AGE)
+
+    def __str__(self):
+        return "{} index run started {}".format("Full" if self.full else "Incremental", self.started.isoformat())
+
+
+class RestrictedSubcontainer(models.Model):
+    """A restricted archival object's subcontainer within a top container."""
+
+    top_container_uri = models.CharField(max_length=255, db_index=True)
+    archival_object_uri = models.CharField(max_length=255, db_index=True)
+    subcontainer = models.CharField(max_length=255)
+
+    @classmethod
+    def for_container(cls, top_container_uri, index_fresh=None):
+        """Returns restricted subcontainers in a top container from the index.
+
+        Args:
+            top_container_uri (str): URI of the top container.
+            index_fresh (bool): whether the index is fresh, if already known.
+                Otherwise it is looked up.
+
+        Returns:
+            list or None: subcontainer display strings, or None if the index
+                is not fresh enough to be used.
+        """
+        if not (ContainerIndexRun.is_fresh() if index_fresh is None else index_fresh):
+            return None
+        return list(cls.objects.filter(top_container_uri=top_container_uri).order_by("pk").values_list("subcontainer", flat=True))
+
+    def __str__(self):
+        return "{} in {}".format(self.subcontainer, self.top_container_uri)
+
+
+class MirrorSyncRun(models.Model):
+    """A sync of ArchivesSpace records into the local mirror."""
+
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    synced = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def last_completed(cls):
+        """Returns the most recently started run which finished, or None."""
+        return cls.objects.filter(finished__isnull=False).order_by("-started").first()
+
+    @classmethod
+    def is_fresh(cls):
+        """Indicates whether the mirror was completely built, and has been
+        synced within `ARCHIVESSPACE_MIRROR["max_age"]` seconds."""
+        if not cls.objects.filter(full=True, finished__isnull=False).exists():
+            return False
+        return cls.last_completed().started > timezone.now() - timedelta(seconds=settings.ARCHIVESSPACE_MIRROR["max_age"])
+
+    def __str__(self):
+        return "{} mirror sync started {}".format("Full" if self.full else "Incremental", self.started.isoformat())
+
+
+class MirroredRecord(models.Model):
+    """Json for an ArchivesSpace record, copied into the local mirror.
+
+    Values which records are looked up by are copied out of the json into
+    indexed columns.
+    """
+
+    uri = models.CharField(max_length=255, unique=True)
+    record_type = models.CharField(max_length=50, db_index=True)
+    ref_id = models.CharField(max_length=255, blank=True, db_index=True)
+    resource_uri = models.CharField(max_length=255, blank=True)
+    parent_uri = models.CharField(max_length=255, blank=True, db_index=True)
+    position = models.IntegerField(null=True, blank=True)
+    system_mtime = models.DateTimeField(null=True, blank=True)
+    synced = models.DateTimeField()
+    json = models.JSONField()
+
+    class Meta:
+        indexes = [models.Index(fields=["resource_uri", "parent_uri", "position"])]
+
+    @classmethod
+    def from_json(cls, record_json, synced):
+        """Creates an unsaved record from ArchivesSpace json."""
+        return cls(
+            uri=record_json["uri"],
+            record_type=record_json["jsonmodel_type"],
+            ref_id=record_json.get("ref_id", ""),
+            resource_uri=record_json.get("resource", {}).get("ref", ""),
+            parent_uri=record_json.get("parent", {}).get("ref", ""),
+            position=record_json.get("position"),
+            system_mtime=parse_datetime(record_json["system_mtime"]) if record_json.get("system_mtime") else None,
+            synced=synced,
+            json=record_json)
+
+    @classmethod
+    def fresh(cls, mirror_fresh=None, **filters):
+        """Returns mirrored records which may be used instead of asking
+        ArchivesSpace.
+
+        Every record is fresh while the mirror is fresh. Otherwise only
+        records synced within `ARCHIVESSPACE_MIRROR["max_age"]` seconds are.
+
+        Args:
+            mirror_fresh (bool): whether the mirror is fresh, if already
+                known. Otherwise it is looked up.
+            **filters: lookups which records must match.
+        """
+        records = cls.objects.filter(**filters)
+        if not (MirrorSyncRun.is_fresh() if mirror_fresh is None else mirror_fresh):
+            records = records.filter(synced__gt=timezone.now() - timedelta(seconds=settings.ARCHIVESSPACE_MIRROR["max_age"]))
+        return records
+
+    def __str__(self):
+        return self.uri
+
+
+class MirroredContainer(models.Model):
+    """A top container holding a mirrored archival object."""
+
+    record = models.ForeignKey(MirroredRecord, on_delete=models.CASCADE, related_name="containers")
+    top_container_uri = models.CharField(max_length=255, db_index=True)
+
+    def __str__(self):
+        return "{} in {}".format(self.record.uri, self.top_container_uri)
+
+
+class EmailJob(models.Model):
+    """A list of items to be emailed, which is delivered by a worker running
+    the `process_email_jobs` command."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipients = models.JSONField()
+    items = models.JSONField()
+    subject = models.CharField(max_length=255, blank=True)
+    message = models.TextField(blank=True)
+    baseurl = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def enqueue(cls, email, items, subject, message, baseurl):
+        """Queues a list of items to be emailed to an address or list of addresses."""
+        if not email:
+            raise ValueError("An email address is required.")
+        if not items:
+            raise ValueError("At least one item is required.")
+        return cls.objects.create(
+            recipients=email if isinstance(email, list) else [email],
+            items=items,
+            subject=subject or "",
+            message=message or "",
+            baseurl=baseurl,
+            total=len(items))
+
+    @classmethod
+    def claim(cls):
+        """Marks the next due job as running and returns it.
+
+        Running jobs whose lease has expired are assumed to have been
+        abandoned by a worker, and are claimed again unless they have used
+        up their attempts, in which case they are marked as failed. Jobs are
+        only claimed if no other worker has claimed them first.
+
+        Returns:
+            EmailJob or None: the claimed job, or None if no jobs are due.
+        """
+        now = timezone.now()
+        abandoned = Q(status=cls.RUNNING, locked_until__lt=now)
+        cls.objects.filter(abandoned, attempts__gte=settings.EMAIL_JOBS["max_attempts"]).update(
+            status=cls.FAILED,
+            error="Job was abandoned by a worker after its last attempt.",
+            locked_until=None,
+            finished=now)
+        due = cls.objects.filter(
+            Q(status=cls.QUEUED, run_after__lte=now) | abandoned).order_by("run_after")
+        for job in due[:10]:
+            claimed = cls.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+                status=cls.RUNNING,
+                attempts=F("attempts") + 1,
+                processed=0,
+                locked_until=cls.lease_expiry())
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    @classmethod
+    def claim_batch(cls, size):
+        """Claims up to `size` due jobs.
+
+        Returns:
+            list: the claimed jobs.
+        """
+        jobs = []
+        while len(jobs) < size:
+            job = cls.claim()
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def lease_expiry():
+        return timezone.now() + timedelta(seconds=settings.EMAIL_JOBS["lease"])
+
+    def extend_lease(self):
+        """Extends the job's lease, unless it has been claimed by another
+        worker since this one claimed it.
+
+        Returns:
+            bool: whether the lease is still held.
+        """
+        self.locked_until = self.lease_expiry()
+        return bool(EmailJob.objects.filter(pk=self.pk, status=self.RUNNING, attempts=self.attempts).update(
+            locked_until=self.locked_until))
+
+    def record_progress(self, processed):
+        """Records the number of items fetched, and extends the job's lease
+        so that it is not claimed by another worker while it is making
+        progress."""
+        self.processed = processed
+        self.locked_until = self.lease_expiry()
+        self.save(update_fields=["processed", "locked_until"])
+
+    def complete(self):
+        self.status = self.SENT
+        self.error = ""
+        self.locked_until = None
+        self.finished = timezone.now()
+        self.save()
+
+    def fail(self, error, retry=False):
+        """Records an error, and either queues the job to be retried with
+        exponential backoff or marks it as failed."""
+        self.error = error
+        self.locked_until = None
+        if retry and self.attempts < settings.EMAIL_JOBS["max_attempts"]:
+            self.status = self.QUEUED
+            self.run_after = timezone.now() + timedelta(seconds=settings.EMAIL_JOBS["retry_delay"] * 2 ** (self.attempts - 1))
+        else:
+            self.status = self.FAILED
+            self.finished = timezone.now()
+        self.save()
+
+    def __str__(self):
+        return "Email to {} ({})".format(", ".join(self.recipients), self.status)
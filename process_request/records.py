@@ -0,0 +1,49 @@
+from collections.abc import Mapping
+
+# Fields of the data returned for each archival object, in order.
+ITEM_FIELDS = (
+    "ead_id", "creators", "restrictions", "restrictions_text", "restricted_in_container",
+    "collection_name", "parent", "dates", "resource_id", "title", "uri", "dimes_url",
+    "containers", "size", "preferred_instance")
+
+
+class ItemRecord(Mapping):
+    """Data about an archival object.
+
+    Values are kept in slots rather than a per-record dict, and only the
+    fields which were requested are set, so a long list of records holds
+    little besides the values themselves. Records are read-only mappings, so
+    they can be used wherever a dict of item data was, and fields can also be
+    read as attributes.
+
+    Args:
+        fields (tuple): fields included in the record, in order.
+        **values: the value of each field.
+    """
+
+    __slots__ = ITEM_FIELDS + ("_fields",)
+
+    def __init__(self, fields, **values):
+        object.__setattr__(self, "_fields", fields)
+        for field in fields:
+            object.__setattr__(self, field, values[field])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ItemRecord fields are read-only")
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "<ItemRecord {}>".format(self.get("uri", ""))
@@ -1,94 +1,392 @@
-import re
-import xml.etree.ElementTree as ET
-
-from asnake.aspace import ASpace
+import smtplib
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+
+import requests
 from django.conf import settings
-from django.core.mail import send_mail
-
-from .helpers import (get_container_indicators, get_dates,
+from django.core.mail import EmailMessage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .clients import (AeonError, ArchivesSpaceError, aeon_pool,
+                      get_aspace_client, smtp_connection)
+from .codec import decode_response
+from .helpers import (CONTAINER_SEARCH_PAGE_SIZE, get_child_statuses,
+                      get_container_indicators, get_dates,
                       get_formatted_resource_id, get_parent_title,
                       get_preferred_format, get_resource_creators,
-                      get_restricted_in_container, get_rights_info, get_size,
-                      get_url, list_chunks)
+                      get_restricted_in_container,
+                      get_restricted_subcontainers, get_rights_info, get_size,
+                      get_url, iter_search_results, list_chunks, strip_tags)
+from .models import (ContainerIndexRun, EmailJob, MirroredContainer,
+                     MirroredRecord, MirrorSyncRun, RestrictedSubcontainer)
+from .records import ITEM_FIELDS, ItemRecord
+
+# Records which the `projected` fetch strategy fetches separately from archival
+# objects, with the references they need resolved.
+SHARED_RECORD_RESOLVE = {"top_containers": ["container_locations"]}
+
+# Aeon API transaction fields for each field of the Aeon web request form.
+# Request-level fields apply to every item, and item fields, which carry the
+# item's request number as a suffix, take precedence over them.
+AEON_TRANSACTION_FIELDS = {
+    "RequestType": "requestType", "DocumentType": "documentType", "WebRequestForm": "webRequestForm",
+    "ScheduledDate": "scheduledDate", "SpecialRequest": "specialRequest", "Site": "site", "Format": "format",
+    "Location": "location", "EADNumber": "eadNumber", "CallNumber": "callNumber", "ItemNumber": "itemNumber",
+    "ItemTitle": "itemTitle", "ItemSubtitle": "itemSubTitle", "ItemAuthor": "itemAuthor", "ItemDate": "itemDate",
+    "ItemVolume": "itemVolume", "ItemIssue": "itemIssue", "ItemCitation": "itemCitation", "ItemInfo1": "itemInfo1",
+    "ItemInfo2": "itemInfo2", "ItemInfo3": "itemInfo3", "ItemInfo4": "itemInfo4", "ItemInfo5": "itemInfo5",
+}
+
+# Endpoints listing the ArchivesSpace records copied into the local mirror.
+MIRROR_ENDPOINTS = [
+    "repositories/{repo_id}/resources", "repositories/{repo_id}/archival_objects",
+    "repositories/{repo_id}/top_containers", "repositories/{repo_id}/digital_objects", "locations",
+    "agents/people", "agents/corporate_entities", "agents/families", "agents/software"]
+
+# Fields consumed by each caller, so that lookups behind other fields are skipped.
+PARSE_FIELDS = frozenset(["uri", "restrictions", "restrictions_text", "preferred_instance"])
+AEON_FIELDS = frozenset([
+    "ead_id", "creators", "restrictions", "restrictions_text", "restricted_in_container",
+    "collection_name", "parent", "dates", "resource_id", "title", "uri", "preferred_instance"])
+
+
+def export_fields():
+    """Returns the fields used in email and CSV exports."""
+    return frozenset([key for key, _ in settings.EXPORT_FIELDS] + ["uri"])
+
+
+class ResolutionContext(object):
+    """Memoizes resource-level values for the duration of a single request.
+
+    Items in a list usually share a handful of collections, so values which
+    only depend on the resource record (creators, identifiers and titles) are
+    computed once per resource URI and reused for every item. Child counts
+    fetched from each resource tree, rights determined for each ancestor and
+    other restricted items in each top container are also kept for the whole
+    request, and whether the container restriction index is fresh is only
+    looked up once.
+
+    Django only closes database connections at the end of each request, so
+    connections opened by worker threads to read the index are closed after
+    each lookup, unless `CONN_MAX_AGE` allows them to be kept.
+    """
+
+    def __init__(self, client, processor):
+        self.client = client
+        self.processor = processor
+        self.thread = threading.get_ident()
+        self.waypoints = {}
+        self.ancestor_rights = {}
+        self._values = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def _memoize(self, field, key, resolver):
+        key = (field, key)
+        if key not in self._values:
+            # Items are enriched concurrently, so only one thread resolves a key.
+            with self._lock:
+                key_lock = self._locks[key]
+            with key_lock:
+                if key not in self._values:
+                    self._values[key] = resolver()
+        return self._values[key]
+
+    def creators(self, resource):
+        return self._memoize("creators", resource["uri"], lambda: get_resource_creators(resource, self.client))
+
+    def resource_id(self, resource):
+        return self._memoize("resource_id", resource["uri"], lambda: get_formatted_resource_id(resource, self.client))
+
+    def ead_id(self, resource):
+        return self._memoize("ead_id", resource["uri"], lambda: resource.get("ead_id"))
+
+    def collection_name(self, resource):
+        return self._memoize("collection_name", resource["uri"], lambda: self.processor.strip_tags(resource.get("title")))
+
+    def parent(self, ancestor):
+        return self._memoize("parent", ancestor["uri"], lambda: self.processor.strip_tags(get_parent_title(ancestor)))
+
+    def _read_database(self, lookup):
+        try:
+            return lookup()
+        finally:
+            if threading.get_ident() != self.thread:
+                close_old_connections()
+
+    def restricted_in_container(self, container_uri):
+        return self._memoize(
+            "restricted_in_container", container_uri,
+            lambda: self._read_database(lambda: get_restricted_in_container(container_uri, self.client, self.container_index_fresh())))
+
+    def container_index_fresh(self):
+        return self._memoize("container_index_fresh", None, lambda: self._read_database(ContainerIndexRun.is_fresh))
 
 
 class Processor(object):
     """
     Processes requests by getting json information, checking restrictions, and getting
     delivery formats.
+
+    Args:
+        data_source (str): `live` to fetch records from ArchivesSpace, or
+            `mirror` to read them from the local mirror where possible.
+            Defaults to `ARCHIVESSPACE["data_source"]`.
     """
 
+    def __init__(self, data_source=None):
+        self.data_source = data_source
+
     def strip_tags(self, user_string):
         """Strips XML and HTML tags from a string."""
         if user_string is None:
             return None
+        return strip_tags(user_string)
+
+    def fetch_chunk(self, id_chunk, client, resolved=None):
+        """Fetches a chunk of archival objects, with the json needed by
+        `get_data` resolved.
+
+        With the default `resolve` fetch strategy, ArchivesSpace resolves
+        ancestors, top containers and digital objects into every object. With
+        the `projected` strategy, objects are fetched without them, and each
+        distinct ancestor, top container and digital object is fetched once
+        and shared between the objects which refer to it.
+
+        Args:
+            id_chunk (list): ArchivesSpace archival object identifiers.
+            client: an ASnake client
+            resolved (dict): futures for records fetched for other chunks,
+                keyed by URI. Only used by the `projected` strategy.
+
+        Returns:
+            list: json for each archival object, in the order of `id_chunk`.
+        """
+        projected = settings.ARCHIVESSPACE["fetch_strategy"] == "projected"
+        params = {"id_set": id_chunk}
+        if not projected:
+            params["resolve"] = [
+                "ancestors", "top_container", "top_container::container_locations", "instances::digital_object"]
+        resp = client.get("/repositories/{}/archival_objects".format(settings.ARCHIVESSPACE["repo_id"]), params=params)
+        if resp.status_code != 200:
+            raise ArchivesSpaceError(resp.json()["error"], resp.status_code)
+        objects = decode_response(resp)
+        if projected:
+            self.resolve_shared_records(objects, client, {} if resolved is None else resolved)
+        positions = {}
+        for n, id in enumerate(id_chunk):
+            positions.setdefault(str(id), n)
+        return sorted(objects, key=lambda obj: positions.get(obj["uri"].split("/")[-1], len(positions)))
+
+    def resolve_shared_records(self, objects, client, resolved):
+        """Attaches ancestors, top containers and digital objects to archival
+        objects, fetching those which are not already in `resolved`.
+
+        Chunks which are fetched concurrently share `resolved`, which maps
+        URIs to futures for their records, so each record is fetched by only
+        one chunk. Records are shared between the objects which refer to
+        them, and must not be modified.
+        """
+        pointers = [pointer for obj in objects for pointer in self.shared_record_pointers(obj)]
+        futures = {}
+        claimed = defaultdict(list)
+        for pointer in pointers:
+            if pointer["ref"] in futures:
+                continue
+            future = Future()
+            futures[pointer["ref"]] = resolved.setdefault(pointer["ref"], future)
+            if futures[pointer["ref"]] is future:
+                record_type, id = pointer["ref"].split("/")[-2:]
+                claimed[record_type].append((id, future))
         try:
-            xmldoc = ET.fromstring(f'<xml>{user_string}</xml>')
-            textcontent = ''.join(xmldoc.itertext())
-        except ET.ParseError:
-            tagregxp = re.compile(r'<[/\w][^>]+>')
-            textcontent = tagregxp.sub('', user_string)
-        return textcontent
-
-    def get_data(self, uri_list, dimes_baseurl):
+            for record_type, ids in claimed.items():
+                for id_chunk in list_chunks(sorted(ids, key=lambda claim: claim[0]), 25):
+                    self.fetch_shared_records(record_type, id_chunk, client)
+        except Exception as e:
+            for future in [future for ids in claimed.values() for _, future in ids if not future.done()]:
+                future.set_exception(e)
+            raise
+        for pointer in pointers:
+            record = futures[pointer["ref"]].result()
+            if record is not None:
+                pointer["_resolved"] = record
+
+    def fetch_shared_records(self, record_type, id_chunk, client):
+        """Fetches records of one type, setting the result of the future
+        paired with each identifier to its record, or None if it was not
+        found."""
+        params = {"id_set": [id for id, _ in id_chunk], "resolve": SHARED_RECORD_RESOLVE.get(record_type, [])}
+        resp = client.get("/repositories/{}/{}".format(settings.ARCHIVESSPACE["repo_id"], record_type), params=params)
+        if resp.status_code != 200:
+            raise ArchivesSpaceError(resp.json()["error"], resp.status_code)
+        found = {record["uri"].split("/")[-1]: record for record in decode_response(resp)}
+        for id, future in id_chunk:
+            future.set_result(found.get(id))
+
+    def shared_record_pointers(self, obj):
+        """Returns references from an archival object to its ancestors, top
+        containers and digital objects."""
+        pointers = list(obj.get("ancestors", []))
+        for instance in obj.get("instances", []):
+            if instance.get("sub_container", {}).get("top_container"):
+                pointers.append(instance["sub_container"]["top_container"])
+            if instance.get("digital_object"):
+                pointers.append(instance["digital_object"])
+        return pointers
+
+    def fetch_objects(self, uri_list, client):
+        """Fetches archival objects in chunks, requesting several chunks at once.
+
+        At most `ARCHIVESSPACE["max_in_flight"]` chunk requests are made
+        concurrently, which is also the limit shared by every request the
+        process sends to ArchivesSpace. No more chunks than that are fetched
+        ahead of the caller, so memory use does not grow with the length of
+        `uri_list`. Chunks are yielded in the order of `uri_list`.
+
+        Args:
+            uri_list (list): A list of ArchivesSpace Archival Object URIs.
+            client: an ASnake client
+
+        Yields:
+            list: json for each archival object in a chunk.
+        """
+        chunks = list(list_chunks([uri.split("/")[-1] for uri in uri_list], 25))
+        resolved = {}
+        if len(chunks) <= 1:
+            yield from (self.fetch_chunk(chunk, client, resolved) for chunk in chunks)
+            return
+        max_workers = min(settings.ARCHIVESSPACE["max_in_flight"], len(chunks))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            try:
+                for chunk in chunks:
+                    pending.append(executor.submit(self.fetch_chunk, chunk, client, resolved))
+                    if len(pending) > max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def iter_data(self, uri_list, dimes_baseurl, fields=None):
+        """Yields data about archival objects from ArchivesSpace as each chunk
+        of objects is enriched.
+
+        Values shared between items are memoized for the whole list, but only
+        a few chunks of archival object json are held at a time.
+
+        Args:
+            uri_list (list): A list of ArchivesSpace Archival Object URIs.
+            dimes_baseurl (str): base URL for links to objects in DIMES
+            fields (set): fields to include for each object. Lookups needed
+                only by other fields are skipped. Defaults to all fields.
+
+        Yields:
+            dict: data about an archival object, in the order of `uri_list`.
+
+        Raises:
+            ValueError: if an unknown field is requested.
+        """
+        fields = ITEM_FIELDS if fields is None else fields
+        unknown = set(fields) - set(ITEM_FIELDS)
+        if unknown:
+            raise ValueError("Unknown fields: {}".format(", ".join(sorted(unknown))))
+        fields = tuple(field for field in ITEM_FIELDS if field in fields)
+        client = get_aspace_client(self.data_source)
+        context = ResolutionContext(client, self)
+        with ThreadPoolExecutor(max_workers=settings.ARCHIVESSPACE["max_in_flight"]) as executor:
+            for objects in self.fetch_objects(uri_list, client):
+                yield from self.enrich_objects(objects, client, context, dimes_baseurl, executor, fields)
+
+    def get_data(self, uri_list, dimes_baseurl, fields=None):
         """Gets data about an archival object from ArchivesSpace.
 
         Args:
             uri_list (list): A list of ArchivesSpace Archival Object URIs.
             dimes_baseurl (str): base URL for links to objects in DIMES
+            fields (set): fields to include for each object, as for `iter_data`.
 
         Returns:
             data (list): A list containing JSON representations of ArchivesSpace
                          Archival Objects.
         """
-        aspace = ASpace(baseurl=settings.ARCHIVESSPACE["baseurl"],
-                        username=settings.ARCHIVESSPACE["username"],
-                        password=settings.ARCHIVESSPACE["password"],
-                        repository=settings.ARCHIVESSPACE["repo_id"])
-        chunked_list = list_chunks([uri.split("/")[-1] for uri in uri_list], 25)
-        data = []
-        for chunk in chunked_list:
-            objects = aspace.client.get("/repositories/{}/archival_objects".format(settings.ARCHIVESSPACE["repo_id"]),
-                                        params={
-                "id_set": chunk,
-                "resolve": [
-                    "ancestors",
-                    "top_container", "top_container::container_locations",
-                    "instances::digital_object"]})
-            if objects.status_code == 200:
-                for item_json in objects.json():
-                    item_collection = item_json.get("ancestors")[-1].get("_resolved")
-                    parent = self.strip_tags(get_parent_title(item_json.get("ancestors")[0].get("_resolved"))) if len(item_json.get("ancestors")) > 1 else None
-                    format, container, subcontainer, location, barcode, container_uri = get_preferred_format(item_json)
-                    restrictions, restrictions_text = get_rights_info(item_json, aspace.client)
-                    resource_id = get_formatted_resource_id(item_collection, aspace.client)
-                    data.append({
-                        "ead_id": item_collection.get("ead_id"),
-                        "creators": get_resource_creators(item_collection, aspace.client),
-                        "restrictions": restrictions,
-                        "restrictions_text": self.strip_tags(restrictions_text),
-                        "restricted_in_container": get_restricted_in_container(container_uri, aspace.client) if (settings.RESTRICTED_IN_CONTAINER and container_uri and format not in ["digital", "microform"]) else "",
-                        "collection_name": self.strip_tags(item_collection.get("title")),
-                        "parent": parent,
-                        "dates": get_dates(item_json, aspace.client),
-                        "resource_id": resource_id,
-                        "title": self.strip_tags(item_json.get("display_string")),
-                        "uri": item_json["uri"],
-                        "dimes_url": get_url(item_json, aspace.client, dimes_baseurl),
-                        "containers": get_container_indicators(item_json),
-                        "size": get_size(item_json["instances"]),
-                        "preferred_instance": {
-                            "format": format,
-                            "container": self.strip_tags(container),
-                            "subcontainer": self.strip_tags(subcontainer),
-                            "location": self.strip_tags(location),
-                            "barcode": barcode,
-                            "uri": container_uri,
-                        }
-                    })
-            else:
-                raise Exception(objects.json()["error"])
-        return data
+        return list(self.iter_data(uri_list, dimes_baseurl, fields))
+
+    def enrich_objects(self, objects, client, context, dimes_baseurl, executor, fields=ITEM_FIELDS):
+        """Creates records for a chunk of archival objects, running independent
+        lookups concurrently.
+
+        Child statuses for the whole chunk are looked up while the remaining
+        per-item lookups run for many items at once. Requests to ArchivesSpace
+        remain bounded by the limit shared by the process.
+
+        Args:
+            objects (list): json for archival objects.
+            client: an ASnake client
+            context (ResolutionContext): values already resolved for this request.
+            dimes_baseurl (str): base URL for links to objects in DIMES
+            executor (concurrent.futures.Executor): runs the lookups.
+            fields (tuple): fields to include for each object, in the order
+                of ITEM_FIELDS.
+
+        Returns:
+            list: an ItemRecord for each object, in the order of `objects`.
+        """
+        children = executor.submit(get_child_statuses, objects, client, context.waypoints) if "dimes_url" in fields else None
+        return list(executor.map(
+            lambda item_json: self.format_item(item_json, client, context, dimes_baseurl, children, fields), objects))
+
+    def format_item(self, item_json, client, context, dimes_baseurl, children=None, fields=ITEM_FIELDS):
+        """Formats data about a single archival object.
+
+        Args:
+            item_json (dict): json for an archival object, with resolved ancestors,
+                top containers and digital objects.
+            client: an ASnake client
+            context (ResolutionContext): values already resolved for this request.
+            dimes_baseurl (str): base URL for links to objects in DIMES
+            children (concurrent.futures.Future): child statuses for archival
+                object URIs, if `dimes_url` is requested.
+            fields (tuple): fields to include, in the order of ITEM_FIELDS.
+                Only the lookups these fields need are made.
+
+        Returns:
+            ItemRecord: data about the archival object.
+        """
+        item_collection = item_json.get("ancestors")[-1].get("_resolved")
+        format, container, subcontainer, location, barcode, container_uri = get_preferred_format(item_json)
+        if "restrictions" in fields or "restrictions_text" in fields:
+            restrictions, restrictions_text = get_rights_info(item_json, client, context.ancestor_rights)
+        resolvers = {
+            "ead_id": lambda: context.ead_id(item_collection),
+            "creators": lambda: context.creators(item_collection),
+            "restrictions": lambda: restrictions,
+            "restrictions_text": lambda: self.strip_tags(restrictions_text),
+            "restricted_in_container": lambda: context.restricted_in_container(container_uri) if (settings.RESTRICTED_IN_CONTAINER and container_uri and format not in ["digital", "microform"]) else "",
+            "collection_name": lambda: context.collection_name(item_collection),
+            "parent": lambda: context.parent(item_json.get("ancestors")[0].get("_resolved")) if len(item_json.get("ancestors")) > 1 else None,
+            "dates": lambda: get_dates(item_json, client),
+            "resource_id": lambda: context.resource_id(item_collection),
+            "title": lambda: self.strip_tags(item_json.get("display_string")),
+            "uri": lambda: item_json["uri"],
+            "dimes_url": lambda: get_url(item_json, client, dimes_baseurl, children.result().get(item_json["uri"])),
+            "containers": lambda: get_container_indicators(item_json),
+            "size": lambda: get_size(item_json["instances"]),
+            "preferred_instance": lambda: {
+                "format": format,
+                "container": self.strip_tags(container),
+                "subcontainer": self.strip_tags(subcontainer),
+                "location": self.strip_tags(location),
+                "barcode": barcode,
+                "uri": container_uri,
+            },
+        }
+        return ItemRecord(fields, **{field: resolvers[field]() for field in fields})
 
     def is_submittable(self, item):
         """Determines if a request item is submittable.
@@ -126,11 +424,29 @@ class Processor(object):
         Returns:
             parsed (dict): A dicts containing parsed item information.
         """
-        data = self.get_data([uri], baseurl)
-        if not len(data):
-            return {"uri": uri, "submit": False, "submit_reason": "This item is currently unavailable for request. It will not be included in request. Reason: This item cannot be found."}
-        submit, reason = self.is_submittable(data[0])
-        return {"uri": uri, "submit": submit, "submit_reason": reason}
+        return self.parse_batch([uri], baseurl)[0]
+
+    def parse_batch(self, uri_list, baseurl):
+        """Parses a list of requested items with a single fetch, to determine
+        which are submittable.
+
+        Args:
+            uri_list (list): AS archival object URIs.
+            baseurl (str): base URL for links to objects in DIMES
+
+        Returns:
+            list: dicts with `uri`, `submit` and `submit_reason` keys, in the
+                order of `uri_list`.
+        """
+        found = {item["uri"]: item for item in self.get_data(uri_list, baseurl, PARSE_FIELDS)}
+        parsed = []
+        for uri in uri_list:
+            if uri in found:
+                submit, reason = self.is_submittable(found[uri])
+            else:
+                submit, reason = False, "This item is currently unavailable for request. It will not be included in request. Reason: This item cannot be found."
+            parsed.append({"uri": uri, "submit": submit, "submit_reason": reason})
+        return parsed
 
 
 class Mailer(object):
@@ -150,19 +466,51 @@ class Mailer(object):
         Returns:
             str: a string message that the emails were sent.
         """
+        processor = Processor()
+        fetched = processor.get_data(object_list, baseurl, export_fields())
+        return self.deliver(email, fetched, subject, message)
+
+    def deliver(self, email, fetched, subject, message):
+        """Sends an email with data about items which have already been fetched.
+
+        Args:
+            email (str): email address to send email to.
+            fetched (list): data about requested objects.
+            subject (str): string to attach to the subject of the email.
+            message (str): message to prepend to the email body.
+
+        Returns:
+            str: a string message that the emails were sent.
+        """
+        email_message = self.build_message(email, fetched, subject, message)
+        error = self.send_batch([email_message])[0]
+        if error:
+            raise error
+        return "email sent to {}".format(", ".join(email_message.to))
+
+    def build_message(self, email, fetched, subject, message):
+        """Creates an email message with data about fetched items.
+
+        The body is rendered once and the message is addressed to every
+        recipient.
+
+        Returns:
+            django.core.mail.EmailMessage: the message.
+        """
         message = message + "\n\n" if message else ""
         recipient_list = email if isinstance(email, list) else [email]
         subject = subject if subject else "My List from DIMES"
-        processor = Processor()
-        fetched = processor.get_data(object_list, baseurl)
-        message += self.format_items(fetched)
-        send_mail(
-            subject,
-            message,
-            settings.EMAIL_DEFAULT_FROM,
-            recipient_list,
-            fail_silently=False)
-        return "email sent to {}".format(", ".join(recipient_list))
+        return EmailMessage(subject, message + self.format_items(fetched), settings.EMAIL_DEFAULT_FROM, recipient_list)
+
+    def send_batch(self, messages):
+        """Sends email messages over the connection to the mail server which
+        is shared by the process.
+
+        Returns:
+            list: None for each message which was sent, or the exception
+                raised while sending it.
+        """
+        return smtp_connection.send_messages(messages)
 
     def format_items(self, object_list):
         """Appends select keys to the message body unless their value is None.
@@ -173,14 +521,100 @@ class Mailer(object):
         Returns:
             message (str): a string respresentation of the converted dicts.
         """
-        message = ""
+        lines = []
         for obj in object_list:
             for key, label in settings.EXPORT_FIELDS:
                 if obj[key]:
-                    concat_str = "{}: {} \n".format(label, obj[key]) if label else "{} \n".format(obj[key])
-                    message += concat_str
-            message += "\n"
-        return message
+                    lines.append("{}: {} \n".format(label, obj[key]) if label else "{} \n".format(obj[key]))
+            lines.append("\n")
+        return "".join(lines)
+
+
+class EmailJobWorker(object):
+    """Delivers queued email jobs.
+
+    Jobs which fail with a transient ArchivesSpace or SMTP error are retried
+    with exponential backoff, up to `EMAIL_JOBS["max_attempts"]` attempts.
+    Other errors fail the job immediately.
+    """
+
+    progress_interval = 25  # Number of items fetched between progress updates.
+
+    def __init__(self, mailer=None):
+        self.mailer = mailer or Mailer()
+
+    def run(self, once=False):
+        """Claims and delivers jobs until stopped.
+
+        Up to `EMAIL_JOBS["batch_size"]` jobs are claimed at once, and their
+        messages are sent over a single connection.
+
+        Args:
+            once (bool): return when there are no more jobs due, instead of
+                waiting for new jobs.
+
+        Returns:
+            int: number of jobs attempted.
+        """
+        attempted = 0
+        while True:
+            jobs = EmailJob.claim_batch(settings.EMAIL_JOBS["batch_size"])
+            if jobs:
+                self.run_batch(jobs)
+                attempted += len(jobs)
+            elif once:
+                return attempted
+            else:
+                time.sleep(settings.EMAIL_JOBS["poll_interval"])
+
+    def run_batch(self, jobs):
+        """Fetches data about each job's items, then emails it, recording
+        progress and the outcome on each job.
+
+        Jobs wait for the ones before them in the batch, so each job's lease
+        is extended before its items are fetched and again before messages
+        are sent. Jobs which have been claimed by another worker in the
+        meantime are left to that worker.
+        """
+        messages = []
+        for job in jobs:
+            if not job.extend_lease():
+                continue
+            try:
+                fetched = self.fetch(job)
+                messages.append((job, self.mailer.build_message(job.recipients, fetched, job.subject, job.message)))
+            except Exception as e:
+                job.fail(str(e), retry=self.is_transient(e))
+        messages = [(job, message) for job, message in messages if job.extend_lease()]
+        errors = self.mailer.send_batch([message for _, message in messages])
+        for (job, _), error in zip(messages, errors):
+            if error:
+                job.fail(str(error), retry=self.is_transient(error))
+            else:
+                job.complete()
+        return jobs
+
+    def fetch(self, job):
+        """Fetches data about a job's items, recording progress as it goes."""
+        fetched = []
+        for item in Processor().iter_data(job.items, job.baseurl, export_fields()):
+            fetched.append(item)
+            if len(fetched) % self.progress_interval == 0:
+                job.record_progress(len(fetched))
+        job.record_progress(len(fetched))
+        return fetched
+
+    def is_transient(self, error):
+        """Indicates whether an error may not recur if a job is retried."""
+        if isinstance(error, smtplib.SMTPConnectError):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        if isinstance(error, ArchivesSpaceError):
+            return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
 
 
 class AeonRequester(object):
@@ -229,7 +663,7 @@ class AeonRequester(object):
             ValueError: if request_type is not readingroom or duplicate.
         """
         processor = Processor()
-        fetched = processor.get_data(kwargs.get("items"), baseurl)
+        fetched = processor.get_data(kwargs.get("items"), baseurl, AEON_FIELDS)
         if request_type == "readingroom":
             data = self.prepare_reading_room_request(fetched, kwargs)
         elif request_type == "duplication":
@@ -239,6 +673,90 @@ class AeonRequester(object):
                 "Unknown request type '{}', expected either 'readingroom' or 'duplication'".format(request_type))
         return {k: v for k, v in data.items() if v}
 
+    def send_request(self, request_type, baseurl, **kwargs):
+        """Creates reading room or duplication transactions in Aeon.
+
+        Items are grouped into one transaction per grouping field, as the
+        Aeon web form groups them, and independent transactions are sent
+        concurrently through the shared Aeon client. If no Aeon API is
+        configured, nothing is sent.
+
+        Args:
+            request_type (str): string indicating whether the request is for the
+            readingroom or duplication.
+            baseurl (str): Base url for an ArchivesSpace instance.
+            **kwargs (dict): Aeon request information, as for `get_request_data`.
+                username (str): the Aeon user the transactions are created for.
+
+        Returns:
+            dict: Request data formatted for Aeon, as for `get_request_data`.
+
+        Raises:
+            AeonError: if any transaction could not be created. Transactions
+                which were created are listed in the message.
+        """
+        data = self.get_request_data(request_type, baseurl, **kwargs)
+        if not settings.AEON["baseurl"]:
+            return data
+        groups = self.group_items(data)
+        client = aeon_pool.client
+        with ThreadPoolExecutor(max_workers=settings.AEON["max_workers"]) as executor:
+            futures = [
+                executor.submit(client.create_request, self.build_transaction(data, prefixes, kwargs.get("username")))
+                for prefixes in groups]
+        created, errors = [], []
+        for prefixes, future in zip(groups, futures):
+            try:
+                created.append(future.result().get("transactionNumber"))
+            except AeonError as e:
+                errors.append((prefixes, e))
+        if errors:
+            raise AeonError("{} of {} transactions could not be created in Aeon ({}); created transactions {}".format(
+                len(errors), len(groups),
+                "; ".join("items {}: {}".format(", ".join(prefixes), e) for prefixes, e in errors),
+                ", ".join(str(number) for number in created) or "none"), errors[0][1].status_code)
+        return data
+
+    def group_items(self, data):
+        """Groups the items in prepared request data by their grouping field,
+        as the Aeon web form does.
+
+        Returns:
+            list: lists of item request numbers, one for each transaction, in
+                the order of the items.
+        """
+        groups = {}
+        for prefix in data["Request"]:
+            groups.setdefault(data.get("GroupingField_{}".format(prefix), prefix), []).append(prefix)
+        return list(groups.values())
+
+    def build_transaction(self, data, prefixes, username=None):
+        """Maps prepared data about a group of items to an Aeon API transaction.
+
+        Each item field is combined using its `GroupingOption_` value: the
+        distinct values joined with semicolons for `Concatenate`, otherwise
+        the first value.
+
+        Args:
+            data (dict): request data returned by `get_request_data`.
+            prefixes (list): request numbers of the items in the transaction.
+            username (str): the Aeon user the transaction is created for.
+
+        Returns:
+            dict: transaction data for the Aeon API.
+        """
+        transaction = {"username": username} if username else {}
+        for field, api_field in AEON_TRANSACTION_FIELDS.items():
+            values = [data["{}_{}".format(field, prefix)] for prefix in prefixes if data.get("{}_{}".format(field, prefix))]
+            if not values:
+                if data.get(field):
+                    transaction[api_field] = data[field]
+            elif data.get("GroupingOption_{}".format(field)) == "Concatenate":
+                transaction[api_field] = "; ".join(dict.fromkeys(str(value) for value in values))
+            else:
+                transaction[api_field] = values[0]
+        return transaction
+
     def prepare_reading_room_request(self, items, request_data):
         """Maps reading room request data to Aeon fields.
 
@@ -315,3 +833,173 @@ class AeonRequester(object):
                 "ItemIssue_{}".format(request_prefix): i["preferred_instance"]["subcontainer"]
             })
         return parsed
+
+
+class ContainerRestrictionIndexer(object):
+    """Builds an index of restricted subcontainers in each top container.
+
+    A full run crawls every archival object in the repository. Incremental runs
+    only revisit archival objects modified since the last completed run, along
+    with the descendants of archival objects and resources modified since then,
+    whose inherited restrictions may have changed. Deleted records are only
+    removed by a full run.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_aspace_client()
+        self.ancestor_statuses = {}
+
+    def run(self, full=False):
+        """Updates the index.
+
+        Args:
+            full (bool): rebuild the index from scratch, even if a previous run
+                has completed.
+
+        Returns:
+            run (ContainerIndexRun): the completed run.
+        """
+        last_run = ContainerIndexRun.last_completed()
+        full = full or not last_run
+        run = ContainerIndexRun.objects.create(started=timezone.now(), full=full)
+        if full:
+            RestrictedSubcontainer.objects.all().delete()
+            run.indexed = self.index_results("primary_type:archival_object")
+        else:
+            since = last_run.started.strftime("%Y-%m-%dT%H:%M:%SZ")
+            modified_query = f"system_mtime:[{since} TO *]"
+            run.indexed = self.index_results(modified_query)
+            modified_records = self.search_uri(modified_query, ["archival_object", "resource"], resolve_ancestors=False)
+            for record in iter_search_results(modified_records, self.client):
+                run.indexed += self.index_results("ancestors:{}".format(record["uri"].replace("/", "\\/")))
+        run.finished = timezone.now()
+        run.save()
+        return run
+
+    def search_uri(self, query, types, resolve_ancestors=True):
+        """Returns a search URI for records of the given types matching a query."""
+        type_params = "".join(f"&type[]={t}" for t in types)
+        fields = "fields[]=uri,json,ancestors&resolve[]=ancestors:id" if resolve_ancestors else "fields[]=uri"
+        return f"repositories/{settings.ARCHIVESSPACE['repo_id']}/search?q={query}{type_params}&{fields}&page_size={CONTAINER_SEARCH_PAGE_SIZE}"
+
+    def index_results(self, query):
+        """Replaces index entries for all archival objects matching a query.
+
+        Returns:
+            int: the number of archival objects indexed.
+        """
+        results = iter_search_results(self.search_uri(query, ["archival_object"]), self.client)
+        count = 0
+        while True:
+            page = list(islice(results, CONTAINER_SEARCH_PAGE_SIZE))
+            if not page:
+                break
+            with transaction.atomic():
+                RestrictedSubcontainer.objects.filter(archival_object_uri__in=[item["uri"] for item in page]).delete()
+                RestrictedSubcontainer.objects.bulk_create([
+                    RestrictedSubcontainer(
+                        top_container_uri=top_container_uri,
+                        archival_object_uri=item["uri"],
+                        subcontainer=subcontainer)
+                    for item in page
+                    for top_container_uri, subcontainer in get_restricted_subcontainers(item, self.client, self.ancestor_statuses)
+                    if top_container_uri])
+            count += len(page)
+        return count
+
+
+class MirrorSyncer(object):
+    """Copies ArchivesSpace records into the local mirror.
+
+    A full run copies every record and removes records which no longer exist.
+    Incremental runs only copy records modified since the last completed run
+    started, and remove mirrored records which ArchivesSpace no longer lists.
+    Requests bypass the record cache, so that only current data is mirrored.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_aspace_client("live", cached=False)
+
+    def run(self, full=False):
+        """Updates the mirror.
+
+        Args:
+            full (bool): copy every record, even if a previous run has
+                completed.
+
+        Returns:
+            run (MirrorSyncRun): the completed run.
+        """
+        last_run = MirrorSyncRun.last_completed()
+        full = full or not last_run
+        run = MirrorSyncRun.objects.create(started=timezone.now(), full=full)
+        modified_since = 0 if full else int(last_run.started.timestamp())
+        for endpoint in MIRROR_ENDPOINTS:
+            path = endpoint.format(repo_id=settings.ARCHIVESSPACE["repo_id"])
+            run.synced += self.sync_endpoint(path, modified_since, run.started)
+            if not full:
+                self.remove_deleted(path)
+        if full:
+            MirroredRecord.objects.filter(synced__lt=run.started).delete()
+        run.finished = timezone.now()
+        run.save()
+        return run
+
+    def sync_endpoint(self, path, modified_since, synced):
+        """Copies records listed by an endpoint which were modified since a
+        timestamp, fetching a few chunks at once.
+
+        Returns:
+            int: the number of records copied.
+        """
+        chunks = list(list_chunks(self.list_ids(path, modified_since), 25))
+        count = 0
+        max_workers = settings.ARCHIVESSPACE["max_in_flight"]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for group in list_chunks(chunks, max_workers):
+                for records in executor.map(lambda id_chunk: self.fetch_records(path, id_chunk), group):
+                    self.save_records(records, synced)
+                    count += len(records)
+        return count
+
+    def list_ids(self, path, modified_since=0):
+        """Returns identifiers of records listed by an endpoint which were
+        modified since a timestamp."""
+        resp = self.client.get(path, params={"all_ids": True, "modified_since": modified_since})
+        if resp.status_code != 200:
+            raise ArchivesSpaceError(resp.json()["error"], resp.status_code)
+        return decode_response(resp)
+
+    def remove_deleted(self, path):
+        """Removes mirrored records from an endpoint which ArchivesSpace no
+        longer lists.
+
+        Returns:
+            int: the number of records removed.
+        """
+        prefix = "/{}/".format(path)
+        existing = set(str(id) for id in self.list_ids(path))
+        deleted = [
+            uri for uri in MirroredRecord.objects.filter(uri__startswith=prefix).values_list("uri", flat=True)
+            if uri[len(prefix):] not in existing]
+        for uri_chunk in list_chunks(deleted, 500):
+            MirroredRecord.objects.filter(uri__in=uri_chunk).delete()
+        return len(deleted)
+
+    def fetch_records(self, path, id_chunk):
+        resp = self.client.get(path, params={"id_set": id_chunk})
+        if resp.status_code != 200:
+            raise ArchivesSpaceError(resp.json()["error"], resp.status_code)
+        return decode_response(resp)
+
+    def save_records(self, records, synced):
+        """Replaces mirrored records, and the top containers they are in."""
+        with transaction.atomic():
+            MirroredRecord.objects.filter(uri__in=[record["uri"] for record in records]).delete()
+            mirrored = MirroredRecord.objects.bulk_create([MirroredRecord.from_json(record, synced) for record in records])
+            MirroredContainer.objects.bulk_create([
+                MirroredContainer(record=record, top_container_uri=top_container_uri)
+                for record in mirrored
+                for top_container_uri in set(
+                    instance["sub_container"]["top_container"]["ref"] for instance in record.json.get("instances", [])
+                    if instance.get("sub_container", {}).get("top_container"))])
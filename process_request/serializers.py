@@ -1,4 +1,15 @@
 from rest_framework import serializers
 
+from .models import EmailJob
+
+
 class LinkResolverSerializer(serializers.Serializer):
   ref_id = serializers.CharField()
+
+
+class EmailJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source="pk")
+
+    class Meta:
+        model = EmailJob
+        fields = ("job_id", "status", "total", "processed", "attempts", "error", "created", "finished")
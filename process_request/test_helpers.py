@@ -1,11 +1,28 @@
+import copy
 import json
 import random
+import re
 import string
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from os.path import join
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from requests import HTTPError
 
 from request_broker import settings
 
+from .cache import record_cache
+
 FIXTURES_DIR = join(settings.BASE_DIR, "fixtures")
+RECORD_ENDPOINTS = (
+    "/resources", "/top_containers", "/digital_objects", "/locations",
+    "/agents/people", "/agents/corporate_entities", "/agents/families", "/agents/software")
 
 
 def random_string(length=20):
@@ -29,3 +46,443 @@ def json_from_fixture(filename):
     """
     with open(join(FIXTURES_DIR, filename), "r") as df:
         return json.load(df)
+
+
+def archival_objects_from_fixture(count, filename="object_all.json", resources=None, containers=None, instance_type=None):
+    """Returns copies of an archival object fixture with distinct URIs.
+
+    Digital object instances which are not resolved in the fixture are dropped,
+    since `Processor.get_data` always asks for them to be resolved.
+
+    Args:
+        count (int): number of archival objects to return.
+        filename (string): a fixture containing a resolved archival object.
+        resources (int): if set, objects are spread across this many distinct
+            resources.
+        containers (int): if set, objects are spread across this many distinct
+            sets of top containers.
+        instance_type (str): if set, replaces the type of physical instances.
+
+    Returns:
+        list: archival object json, keyed by URI.
+    """
+    base = json_from_fixture(filename)
+    base["instances"] = [i for i in base.get("instances", []) if i["instance_type"] != "digital_object" or "_resolved" in i["digital_object"]]
+    objects = {}
+    for n in range(count):
+        obj = copy.deepcopy(base)
+        obj["uri"] = "/repositories/2/archival_objects/{}".format(n + 1)
+        if resources:
+            resource_uri = "/repositories/2/resources/{}".format(n % resources + 1)
+            obj["resource"]["ref"] = obj["ancestors"][-1]["ref"] = obj["ancestors"][-1]["_resolved"]["uri"] = resource_uri
+        if containers:
+            # Each instance keeps its own container, so a reference always
+            # resolves to the same record.
+            sub_containers = [i["sub_container"] for i in obj["instances"] if i.get("sub_container")]
+            for position, sub_container in enumerate(sub_containers):
+                top_container = sub_container["top_container"]
+                top_container["ref"] = top_container["_resolved"]["uri"] = "/repositories/2/top_containers/{}".format(
+                    (n % containers) * len(sub_containers) + position + 1)
+        if instance_type:
+            for instance in obj["instances"]:
+                if instance.get("sub_container"):
+                    instance["instance_type"] = instance_type
+        objects[obj["uri"]] = obj
+    return objects
+
+
+def synthetic_archival_object(instances=200, ancestors=10, note_length=2000, seed=0):
+    """Generates a large, ArchivesSpace-shaped archival object.
+
+    Built from the shapes of the archival object, instance and note fixtures,
+    scaled up to the sizes seen in large collections.
+
+    Args:
+        instances (int): number of instances, mixing boxes, folder ranges,
+            microform reels and digital objects.
+        ancestors (int): depth of the resolved ancestor chain, ending with a
+            resource.
+        note_length (int): approximate number of characters in each
+            accessrestrict note.
+        seed (int): seed for the random generator, so output is repeatable.
+
+    Returns:
+        dict: json for an archival object with resolved ancestors, top
+            containers, locations and digital objects.
+    """
+    rand = random.Random(seed)
+    base = json_from_fixture("object_all.json")
+    mixed = json_from_fixture("mixed_materials_instance.json")
+    digital = json_from_fixture("digital_object_instance.json")
+    words = "records correspondence reports minutes memoranda grants budgets photographs".split()
+
+    def note(text_prefix):
+        text = text_prefix + " " + " ".join(rand.choice(words) for _ in range(note_length // 8))
+        return {"jsonmodel_type": "note_multipart", "type": "accessrestrict", "publish": True,
+                "subnotes": [{"jsonmodel_type": "note_text", "content": "<p>{}</p>".format(text[:note_length]), "publish": True}]}
+
+    obj_instances = []
+    for n in range(instances):
+        if n % 10 == 9:
+            instance = copy.deepcopy(digital)
+            instance["digital_object"]["_resolved"]["uri"] = "/repositories/2/digital_objects/{}".format(n)
+        else:
+            instance = copy.deepcopy(mixed)
+            if n % 10 == 8:
+                instance["instance_type"] = "microform"
+            sub_container = instance["sub_container"]
+            top_container = sub_container["top_container"]["_resolved"]
+            top_container["indicator"] = str(n // 20 + 1)
+            top_container["uri"] = "/repositories/2/top_containers/{}".format(n // 20 + 1)
+            top_container["barcode"] = "A{:08d}".format(n // 20 + 1)
+            if n % 3 == 0:
+                sub_container["indicator_2"] = "{}-{}".format(n, n + rand.randint(1, 5))
+            elif n % 3 == 1:
+                sub_container["indicator_2"] = "{}{}".format(n, rand.choice("abc"))
+            else:
+                del sub_container["type_2"], sub_container["indicator_2"]
+        obj_instances.append(instance)
+
+    resource = copy.deepcopy(base["ancestors"][-1])
+    chain = []
+    for n in range(ancestors - 1):
+        ancestor = copy.deepcopy(base["ancestors"][0])
+        ancestor["ref"] = ancestor["_resolved"]["uri"] = "/repositories/2/archival_objects/{}".format(1000 + n)
+        ancestor["_resolved"]["notes"] = [note("Open for research.")] if n == ancestors - 2 else []
+        chain.append(ancestor)
+    obj = copy.deepcopy(base)
+    obj.update({
+        "instances": obj_instances,
+        "ancestors": chain + [resource],
+        "notes": [note("Restricted until 2030."), note("Access copy unavailable.")],
+        "display_string": "<title>{}</title> <emph render='italic'>{}</emph>".format(
+            " ".join(rand.choice(words) for _ in range(20)), " ".join(rand.choice(words) for _ in range(10))),
+    })
+    return obj
+
+
+class StubResponse(object):
+    """Minimal stand-in for a requests Response."""
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = json.dumps(data)
+        self.content = self.text.encode("utf-8")
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError("{} Error".format(self.status_code))
+
+
+class StubClient(object):
+    """Stands in for an ASnake client, answering requests from a set of
+    archival objects and recording each call which is made.
+
+    Archival objects are answered with only the references named in the
+    `resolve` parameter resolved. Ancestors, top containers, digital objects,
+    locations and agents resolved in the fixtures can also be fetched by
+    `id_set`, and the identifiers of records modified since a timestamp are
+    listed for `all_ids` requests.
+
+    Args:
+        objects (dict): archival object json keyed by URI.
+        child_counts (dict): number of children for archival object URIs,
+            defaulting to 0.
+        latency (float): seconds to wait before answering each request.
+        measure_decode (bool): time decoding each response body.
+    """
+
+    def __init__(self, objects, child_counts=None, latency=0, measure_decode=False):
+        self.objects = objects
+        self.child_counts = child_counts or {}
+        self.latency = latency
+        self.measure_decode = measure_decode
+        self.records = {}
+        for obj in objects.values():
+            for pointer in obj.get("ancestors", []) + self.instance_pointers(obj):
+                if "_resolved" in pointer:
+                    self.records.setdefault(pointer["ref"], pointer["_resolved"])
+        for record in list(self.records.values()):
+            self.index_records(record)
+        self.response_bytes = 0
+        self.decode_time = 0
+        self.calls = []
+        self.endpoints = Counter()
+        self.helpers = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.helpers_in_flight = Counter()
+        self.concurrency = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        helper = calling_helper()
+        with self._lock:
+            self.endpoints[normalize_endpoint(urlparse(url).path)] += 1
+            self.helpers[helper] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.in_flight, self.max_in_flight)
+            self.helpers_in_flight[helper] += 1
+            self.concurrency[helper] = max(self.helpers_in_flight[helper], self.concurrency[helper])
+        try:
+            time.sleep(self.latency)
+            response = self.respond(url, params)
+            start = time.perf_counter()
+            if self.measure_decode:
+                json.loads(response.content)
+            with self._lock:
+                self.response_bytes += len(response.content)
+                self.decode_time += time.perf_counter() - start
+            return response
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.helpers_in_flight[helper] -= 1
+
+    def respond(self, url, params):
+        parsed = urlparse(url)
+        parsed = parsed._replace(path="/" + parsed.path.lstrip("/"))
+        query = parse_qs(parsed.query)
+        query.update({k: v if isinstance(v, list) else [v] for k, v in (params or {}).items()})
+        self.calls.append(parsed.path)
+        if parsed.path.endswith("/archival_objects") and "all_ids" in query:
+            return StubResponse(self.list_ids(list(self.objects.items()) + list(self.records.items()), parsed.path, query))
+        elif parsed.path.endswith(RECORD_ENDPOINTS) and "all_ids" in query:
+            return StubResponse(self.list_ids(self.records.items(), parsed.path, query))
+        elif parsed.path.endswith("/archival_objects"):
+            ids = list(map(str, query.get("id_set", [])))
+            objects = [
+                self.unresolve(copy.deepcopy(obj), query.get("resolve", [])) for obj in self.objects.values()
+                if obj["uri"].split("/")[-1] in ids]
+            found = [obj["uri"] for obj in objects]
+            return StubResponse([self.unresolve_all(obj, query.get("resolve")) for obj in objects + [
+                dict(copy.deepcopy(record), uri=uri) for uri, record in self.records.items()
+                if uri.startswith(parsed.path + "/") and uri.split("/")[-1] in ids and uri not in found]])
+        elif parsed.path.endswith(RECORD_ENDPOINTS):
+            ids = list(map(str, query.get("id_set", [])))
+            return StubResponse([
+                self.unresolve_all(dict(copy.deepcopy(record), uri=uri), query.get("resolve"))
+                for uri, record in self.records.items()
+                if uri.startswith(parsed.path + "/") and uri.split("/")[-1] in ids])
+        elif parsed.path.endswith("/tree/node"):
+            return StubResponse({"child_count": self.child_counts.get(query["node_uri"][0], 0)})
+        elif parsed.path.endswith("/tree/waypoint"):
+            parent = query.get("parent_node", [None])[0]
+            return StubResponse([
+                {"uri": uri, "child_count": self.child_counts.get(uri, 0)} for uri, obj in self.objects.items()
+                if obj.get("parent", {}).get("ref") == parent])
+        elif parsed.path.endswith("/search") and "top_container_uri" in query.get("q", [""])[0]:
+            return StubResponse({"results": [], "this_page": 1, "last_page": 1})
+        elif parsed.path.endswith("/search"):
+            return StubResponse({"results": [{"title": "Philanthropy Foundation"}], "this_page": 1, "last_page": 1})
+        return StubResponse({"error": "Not found"}, status_code=404)
+
+    def index_records(self, data):
+        """Adds records resolved anywhere within `data` to the records which
+        can be fetched."""
+        if isinstance(data, list):
+            for item in data:
+                self.index_records(item)
+        elif isinstance(data, dict):
+            if "ref" in data and "_resolved" in data:
+                self.records.setdefault(data["ref"], data["_resolved"])
+            for value in data.values():
+                self.index_records(value)
+
+    def list_ids(self, records, path, query):
+        """Returns identifiers of records at `path` modified since the
+        `modified_since` timestamp."""
+        since = datetime.fromtimestamp(int(query.get("modified_since", [0])[0]), timezone.utc)
+        return [
+            int(uri.split("/")[-1]) for uri, record in records
+            if uri.startswith(path + "/") and datetime.fromisoformat(record["system_mtime"].replace("Z", "+00:00")) >= since]
+
+    def unresolve_all(self, data, resolve):
+        """Removes every resolved record if nothing was asked to be resolved."""
+        if resolve:
+            return data
+        if isinstance(data, list):
+            return [self.unresolve_all(item, resolve) for item in data]
+        if isinstance(data, dict):
+            return {key: self.unresolve_all(value, resolve) for key, value in data.items() if key != "_resolved"}
+        return data
+
+    def instance_pointers(self, obj):
+        """Returns references to top containers and digital objects."""
+        pointers = []
+        for instance in obj.get("instances", []):
+            if instance.get("sub_container", {}).get("top_container"):
+                pointers.append(instance["sub_container"]["top_container"])
+            if instance.get("digital_object"):
+                pointers.append(instance["digital_object"])
+        return pointers
+
+    def unresolve(self, obj, resolve):
+        """Removes resolved records which were not asked for."""
+        for pointer in obj.get("ancestors", []) if "ancestors" not in resolve else []:
+            pointer.pop("_resolved", None)
+        for pointer in self.instance_pointers(obj):
+            if ("top_containers" in pointer["ref"] and "top_container" not in resolve) or \
+                    ("digital_objects" in pointer["ref"] and "instances::digital_object" not in resolve):
+                pointer.pop("_resolved", None)
+        return obj
+
+    def calls_to(self, suffix):
+        """Returns the number of calls made to paths ending with `suffix`."""
+        return len([c for c in self.calls if c.endswith(suffix)])
+
+
+def normalize_endpoint(path):
+    """Replaces identifiers in a URL path, so that calls can be grouped by endpoint."""
+    return re.sub(r"/\d+", "/:id", "/" + path.lstrip("/"))
+
+
+def calling_helper(modules=("process_request.helpers", "process_request.routines")):
+    """Returns the name of the innermost helper function or method on the call
+    stack which belongs to one of `modules`.
+
+    Lambdas, comprehensions and nested functions are skipped in favour of the
+    function which defines them.
+    """
+    frame = sys._getframe(1)
+    while frame:
+        name = frame.f_code.co_name
+        if frame.f_globals.get("__name__") in modules and not name.startswith("<") and (
+                name in frame.f_globals or "self" in frame.f_locals):
+            return name
+        frame = frame.f_back
+    return None
+
+
+def count_upstream_calls(fn, objects, child_counts=None, latency=0, measure_decode=False):
+    """Counts the ArchivesSpace calls made while running a function.
+
+    A StubClient answering from `objects` stands in for the shared ArchivesSpace
+    session, and the record cache is emptied first so that every run starts
+    cold.
+
+    Args:
+        fn (callable): a function which takes no arguments.
+        objects (dict): archival object json keyed by URI.
+        child_counts (dict): number of children for archival object URIs.
+        latency (float): seconds to wait before answering each request.
+        measure_decode (bool): time decoding each response body.
+
+    Returns:
+        dict: total calls, calls grouped by endpoint and by helper, the most
+            calls in flight at once overall and for each helper, the wall
+            time in seconds, if latency was injected the wall time expressed
+            as a number of sequential round trips, the size of all response
+            bodies in bytes, and if measured the time spent decoding them.
+    """
+    client = StubClient(objects, child_counts=child_counts, latency=latency, measure_decode=measure_decode)
+    record_cache.clear()
+    with patch("process_request.clients.aspace_pool") as pool:
+        pool.client = client
+        start = time.perf_counter()
+        fn()
+        wall_time = time.perf_counter() - start
+    return {
+        "calls": len(client.calls),
+        "endpoints": dict(client.endpoints),
+        "helpers": dict(client.helpers),
+        "max_in_flight": client.max_in_flight,
+        "concurrency": dict(client.concurrency),
+        "wall_time": round(wall_time, 4),
+        "round_trips": round(wall_time / latency, 1) if latency else None,
+        "response_bytes": client.response_bytes,
+        "decode_ms": round(client.decode_time * 1000, 3) if measure_decode else None,
+    }
+
+
+class AeonStandIn(object):
+    """Local HTTP server standing in for the Aeon API in tests.
+
+    Transactions posted to `/Requests/create` are checked against the fields
+    of the Aeon API request schema, recorded and answered with a transaction
+    number. Every accepted post creates a new transaction.
+
+    Args:
+        failures (int): number of requests answered with a 503 before the
+            server starts creating transactions.
+        latency (float): seconds to wait before answering each request.
+
+    Use as a context manager; `baseurl` is set once the server is running.
+    """
+
+    FIELDS = {
+        "username", "requestType", "documentType", "webRequestForm", "scheduledDate", "specialRequest", "site",
+        "format", "location", "eadNumber", "callNumber", "itemNumber", "itemTitle", "itemSubTitle", "itemAuthor",
+        "itemDate", "itemVolume", "itemIssue", "itemCitation", "itemInfo1", "itemInfo2", "itemInfo3", "itemInfo4",
+        "itemInfo5"}
+
+    def __init__(self, failures=0, latency=0):
+        self.failures = failures
+        self.latency = latency
+        self.requests = []
+        self.transactions = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.baseurl = "http://127.0.0.1:{}/aeon/api".format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, headers, body):
+        """Returns a tuple of (status code, response data)."""
+        with self._lock:
+            self.requests.append({"path": path, "headers": headers, "body": body})
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            with self._lock:
+                if headers.get("X-AEON-API-KEY") != settings.AEON["api_key"]:
+                    return 401, {"message": "Invalid API key"}
+                if path != "/aeon/api/Requests/create":
+                    return 404, {"message": "Not found"}
+                if set(body) - self.FIELDS or "requestType" not in body:
+                    return 400, {"message": "Invalid transaction fields: {}".format(", ".join(sorted(set(body) - self.FIELDS)))}
+                if self.failures:
+                    self.failures -= 1
+                    return 503, {"message": "Service unavailable"}
+                self.transactions.append(dict(body, transactionNumber=len(self.transactions) + 1))
+                return 201, self.transactions[-1]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status, data = stand_in.respond(self.path, dict(self.headers), body)
+                content = json.dumps(data).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except ConnectionError:
+                    pass  # The client timed out and closed the connection.
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,29 +1,73 @@
 import csv
-from datetime import date
+import gc
+import gzip
+import json
+import random
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.client import RemoteDisconnected
+from io import BytesIO, StringIO
 from os.path import join
-from unittest.mock import ANY, patch
+from unittest.mock import ANY, MagicMock, patch
 
+import requests
 import vcr
 from asnake.aspace import ASpace
 from django.conf import settings
 from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage, get_connection
+from django.core.management import call_command
 from django.http import StreamingHttpResponse
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIRequestFactory
-
-from .helpers import (get_container_indicators, get_dates, get_file_versions,
+from urllib3.exceptions import ProtocolError
+
+from benchmarks.__main__ import main as run_benchmarks
+from benchmarks.suites import run_suites
+
+from .cache import (CachedResponse, CachingClient, LRUCache, RecordCache,
+                    SingleFlight, get_record_type, make_key, record_cache)
+from .clients import (AeonAPIClient, AeonError, ArchivesSpaceError,
+                      ArchivesSpaceSessionPool, ConcurrencyLimitedClient,
+                      SMTPConnection, aeon_pool, connection_not_established,
+                      get_aspace_client, smtp_connection)
+from .codec import (CODECS, CodecJSONParser, CodecJSONRenderer, codec_name,
+                    decode_response, dumps, loads)
+from .helpers import (classify_note_text, get_child_statuses,
+                      get_container_indicators, get_dates, get_file_versions,
                       get_formatted_resource_id, get_instance_data,
                       get_locations, get_parent_title, get_preferred_format,
                       get_resource_creators, get_restricted_in_container,
                       get_rights_info, get_rights_status, get_rights_text,
-                      get_size, indicator_to_integer, prepare_values)
-from .models import User
-from .routines import AeonRequester, Mailer, Processor
-from .test_helpers import json_from_fixture, random_list, random_string
+                      get_size, get_url, has_children, indicator_to_integer,
+                      parse_text_content, prepare_values, resolve_ref_id,
+                      strip_tags)
+from .mirror import MirrorClient
+from .models import (ContainerIndexRun, EmailJob, MirroredContainer,
+                     MirroredRecord, MirrorSyncRun, RestrictedSubcontainer,
+                     User)
+from .records import ITEM_FIELDS, ItemRecord
+from .routines import (AEON_FIELDS, PARSE_FIELDS, AeonRequester,
+                       ContainerRestrictionIndexer, EmailJobWorker, Mailer,
+                       MirrorSyncer, Processor, ResolutionContext,
+                       export_fields)
+from .test_helpers import (AeonStandIn, StubClient,
+                           archival_objects_from_fixture, count_upstream_calls,
+                           json_from_fixture, random_list, random_string,
+                           synthetic_archival_object)
 from .views import (DeliverDuplicationRequestView,
-                    DeliverReadingRoomRequestView, DownloadCSVView, MailerView,
-                    ParseRequestView)
+                    DeliverReadingRoomRequestView, DownloadCSVView,
+                    DownloadNDJSONView, EmailJobStatusView, MailerView,
+                    ParseBatchView, ParseRequestView, accepts_encoding)
 
 aspace_vcr = vcr.VCR(
     serializer='json',
@@ -35,6 +79,71 @@ aspace_vcr = vcr.VCR(
 )
 
 
+class TestBenchmarks(TestCase):
+
+    def test_run_benchmarks(self):
+        out = StringIO()
+        run_benchmarks(["note_classifier", "--iterations", "1"], stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results["suites"]["note_classifier"]["object_restricted_note.json"]["status"], "closed")
+
+        with self.assertRaises(SystemExit), patch("sys.stderr", StringIO()):
+            run_benchmarks(["foo", "--iterations", "1"], stdout=out)
+
+    @patch("benchmarks.suites.HELPER_SCALES", (10,))
+    def test_helpers_suite(self):
+        results = run_suites(["helpers"], 1)
+        for name in ["get_size", "get_instance_data", "get_preferred_format", "get_locations",
+                     "get_rights_status", "indicator_to_integer", "prepare_values", "strip_tags"]:
+            self.assertIn("best_us", results["suites"]["helpers"][10][name])
+
+    @patch("benchmarks.suites.UPSTREAM_SCALES", (2,))
+    @patch("benchmarks.suites.UPSTREAM_LATENCY", 0)
+    def test_upstream_calls_suite(self):
+        results = run_suites(["upstream_calls"], 1)["suites"]["upstream_calls"][2]
+        self.assertEqual(results["helpers"]["fetch_chunk"], 1)
+        self.assertEqual(results["calls_per_item"], results["calls"] / 2)
+
+    @patch("benchmarks.suites.RECORD_SCALES", (10,))
+    def test_records_suite(self):
+        results = run_suites(["records"], 1)["suites"]["records"][10]
+        self.assertEqual(set(results), {"dicts", "records", "records_title_only"})
+        self.assertLess(results["records"]["bytes_per_item"], results["dicts"]["bytes_per_item"])
+        self.assertLess(results["records_title_only"]["bytes_per_item"], results["records"]["bytes_per_item"])
+        for result in results.values():
+            self.assertGreater(result["first_field_ms"], 0)
+
+    @patch("benchmarks.suites.UPSTREAM_SCALES", (2,))
+    def test_fetch_strategies_suite(self):
+        results = run_suites(["fetch_strategies"], 1)["suites"]["fetch_strategies"][2]
+        self.assertEqual(set(results), {"resolve", "projected"})
+        for result in results.values():
+            self.assertGreater(result["bytes_per_item"], 0)
+            self.assertGreaterEqual(result["decode_ms_per_item"], 0)
+
+    @patch("benchmarks.suites.CODEC_SCALES", (2,))
+    def test_json_codecs_suite(self):
+        results = run_suites(["json_codecs"], 1)["suites"]["json_codecs"]
+        self.assertEqual(set(results[2]["decode"]), set(CODECS))
+        self.assertEqual(set(results[2]["render_aeon"]), set(CODECS) | {"drf_json"})
+        self.assertEqual(set(results["restricted_search.json"]["decode"]), set(CODECS))
+
+    def test_strip_tags_suite(self):
+        results = run_suites(["strip_tags"], 1)["suites"]["strip_tags"]
+        self.assertEqual(len(results), 8)
+        self.assertIn("chars_per_s", results["mixed_content_x20"]["uncached"])
+
+    def test_synthetic_archival_object(self):
+        item = synthetic_archival_object(instances=40, ancestors=5)
+        self.assertEqual(item, synthetic_archival_object(instances=40, ancestors=5))
+        self.assertEqual(len(item["instances"]), 40)
+        self.assertEqual(len(item["ancestors"]), 5)
+        self.assertEqual(item["ancestors"][-1]["_resolved"]["jsonmodel_type"], "resource")
+        self.assertEqual(get_preferred_format(item)[0], "digital_object")
+        self.assertEqual(get_rights_status(item, None), "closed")
+        self.assertTrue(get_size(item["instances"]))
+
+
 class TestUsers(TestCase):
 
     def test_user(self):
@@ -46,6 +155,205 @@ class TestUsers(TestCase):
         self.assertEqual(str(user), "Patrick Galligan <pgalligan@rockarch.org>")
 
 
+class TestClients(TestCase):
+
+    @patch("process_request.clients.ASnakeClient.authorize")
+    def test_session_pool_reuses_client(self, mock_authorize):
+        pool = ArchivesSpaceSessionPool()
+        client = pool.client
+        self.assertIs(pool.client, client)
+        mock_authorize.assert_called_once()
+        self.assertEqual(client.session.get_adapter("http://").poolmanager.connection_pool_kw["maxsize"],
+                         settings.ARCHIVESSPACE["pool_size"])
+
+        pool.reset()
+        self.assertIsNot(pool.client, client)
+        self.assertEqual(mock_authorize.call_count, 2)
+
+    @patch("process_request.clients.ASnakeClient.authorize")
+    def test_session_pool_reauthorizes_once(self, mock_authorize):
+        pool = ArchivesSpaceSessionPool()
+        client = pool.client
+        client.session.headers["X-ArchivesSpace-Session"] = "expired"
+
+        def login():
+            time.sleep(0.2)
+            client.session.headers["X-ArchivesSpace-Session"] = random_string()
+        mock_authorize.reset_mock()
+        mock_authorize.side_effect = login
+
+        barrier = threading.Barrier(5)
+
+        def expired_request():
+            barrier.wait()
+            client.authorize()
+        threads = [threading.Thread(target=expired_request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mock_authorize.assert_called_once()
+
+    def test_get_paged_through_wrappers(self):
+        pages = MagicMock()
+        pages.get.side_effect = lambda url, params=None, **kwargs: CachedResponse.from_data(
+            {"results": [params["page"]], "this_page": params["page"], "last_page": 3})
+        semaphore = MagicMock()
+        client = CachingClient(ConcurrencyLimitedClient(pages, semaphore))
+        with patch.object(client, "get", wraps=client.get) as mock_get:
+            self.assertEqual(list(client.get_paged("repositories/2/search", params={"q": "foo"})), [1, 2, 3])
+        self.assertEqual(mock_get.call_count, 3, "Pages were not requested through the cache")
+        self.assertEqual(semaphore.__enter__.call_count, 3, "Pages did not wait for a slot")
+        pages.get_paged.assert_not_called()
+
+
+class TestCache(TestCase):
+
+    def test_lru_cache(self):
+        cache = LRUCache(max_entries=3, max_bytes=100)
+        for key in ["a", "b", "c"]:
+            cache.set(key, key, 60, 10)
+        cache.get("a")
+        cache.set("d", "d", 60, 10)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, "a"))
+
+        cache.set("e", "e", 60, 85)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.size, 100)
+        cache.set("f", "f", 60, 101)
+        self.assertEqual(cache.get("f"), (False, None))
+
+        cache.set("g", "g", -1, 1)
+        self.assertEqual(cache.get("g"), (False, None))
+
+    def test_record_types(self):
+        for url, params, expected in [
+                ("/repositories/2/resources/12/tree/node?node_uri=/repositories/2/archival_objects/1", None, "tree_node"),
+                ("/repositories/2/resources/12", None, "resource"),
+                ("/agents/people/4", None, "agent"),
+                ("agents/people", {"all_ids": True, "modified_since": 0}, None),
+                ("/repositories/2/top_containers/191161", None, "top_container"),
+                ("/repositories/2/search?fields[]=title&type[]=agent_person&q=foo", None, "agent"),
+                ("repositories/2/search?q=top_container_uri_u_sstr:foo", None, "top_container"),
+                ("/repositories/2/archival_objects", {"id_set": [1, 2]}, "archival_object"),
+                ("version", None, None)]:
+            self.assertEqual(get_record_type(url, params), expected)
+
+    def test_caching_client(self):
+        cache = RecordCache()
+        cache.clear()
+        objects = archival_objects_from_fixture(1)
+        stub = StubClient(objects)
+        uri = "/repositories/2/resources/13063/tree/node?node_uri=/repositories/2/archival_objects/1"
+        for client in [CachingClient(stub, cache), CachingClient(stub, cache)]:
+            self.assertEqual(client.get(uri).json(), {"child_count": 0})
+        self.assertEqual(stub.calls_to("/tree/node"), 1)
+        self.assertEqual(cache.stats()["record_types"]["tree_node"], {"l1_hits": 1, "l2_hits": 0, "misses": 1})
+        CachingClient(stub, cache).get(uri).json()["child_count"] = 5
+        self.assertEqual(CachingClient(stub, cache).get(uri).json(), {"child_count": 0}, "Cached data was modified by a caller")
+
+        cache.local.clear()
+        CachingClient(stub, cache).get(uri)
+        self.assertEqual(stub.calls_to("/tree/node"), 1)
+        self.assertEqual(cache.stats()["record_types"]["tree_node"]["l2_hits"], 1)
+
+        client = CachingClient(stub, cache)
+        for _ in range(2):
+            self.assertEqual(client.get("/repositories/2/resources/1/unknown").status_code, 404)
+            client.get("/repositories/2/archival_objects", params={"id_set": ["1"]})
+        self.assertEqual(stub.calls_to("/archival_objects"), 2)
+
+    def test_single_flight(self):
+        cache = RecordCache()
+        cache.clear()
+        objects = archival_objects_from_fixture(1)
+        object_id = list(objects)[0].split("/")[-1]
+        tree_uri = "/repositories/2/resources/13063/tree/node?node_uri=/repositories/2/archival_objects/1"
+        for url, params, suffix in [
+                ("/repositories/2/search", {"type[]": ["agent_person"], "q": "/agents/people/1"}, "/search"),
+                (tree_uri, None, "/tree/node")]:
+            stub = StubClient(objects, latency=0.2)
+            # Two SingleFlights stand in for two processes sharing a cache backend.
+            processes = [SingleFlight(), SingleFlight()]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                responses = list(executor.map(
+                    lambda n: CachingClient(stub, cache, processes[n % 2]).get(url, params=params).json(), range(8)))
+            self.assertEqual(stub.calls_to(suffix), 1, "Concurrent requests for {} were not collapsed".format(url))
+            self.assertTrue(all(r == responses[0] for r in responses))
+            self.assertEqual(len(set(id(r) for r in responses)), 8, "Waiting threads shared the same data")
+            self.assertEqual(sum(p.stats()["fetches"] for p in processes), 1)
+            self.assertEqual(processes[0].stats()["shared_in_process"], 3)
+            self.assertEqual(sum(p.stats()["shared_across_processes"] for p in processes), 1)
+
+        stub = StubClient(objects, latency=0.05)
+        flights = SingleFlight()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda n: CachingClient(stub, cache, flights).get(
+                "/repositories/2/archival_objects", params={"id_set": [object_id]}), range(4)))
+        self.assertEqual(stub.calls_to("/archival_objects"), 4)
+        self.assertEqual(flights.stats()["fetches"], 0, "Uncacheable requests used the single flight")
+
+        cache.clear()
+        lease_key = "{}:lease".format(make_key(tree_uri))
+        flights.shared.set(lease_key, "abandoned", 60)
+        with patch.dict(settings.ARCHIVESSPACE_SINGLE_FLIGHT, {"lease": 0.2}):
+            response = CachingClient(stub, cache, flights).get(tree_uri)
+        self.assertEqual(response.status_code, 200, "Waiting process did not fetch after an abandoned lease")
+        self.assertEqual(stub.calls_to("/tree/node"), 1)
+        flights.shared.delete(lease_key)
+
+
+class TestCodec(TestCase):
+
+    def test_codecs(self):
+        item = json_from_fixture("object_all.json")
+        for name in CODECS:
+            with override_settings(JSON_CODEC=name):
+                self.assertEqual(codec_name(), name)
+                encoded = dumps(item)
+                self.assertIsInstance(encoded, bytes)
+                self.assertEqual(loads(encoded), item)
+                self.assertEqual(loads(encoded.decode("utf-8")), item)
+                self.assertEqual(loads(dumps({"title": "Caf\u00e9"})), {"title": "Caf\u00e9"})
+        with override_settings(JSON_CODEC="auto"):
+            self.assertEqual(codec_name(), "orjson" if "orjson" in CODECS else "json")
+        with override_settings(JSON_CODEC="unknown"), self.assertRaises(ImproperlyConfigured):
+            loads("{}")
+
+    def test_decode_response(self):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'[{"uri": "/repositories/2/archival_objects/1"}]'
+        for name in CODECS:
+            with override_settings(JSON_CODEC=name):
+                self.assertEqual(decode_response(response), [{"uri": "/repositories/2/archival_objects/1"}])
+        cached = CachedResponse.from_data({"uri": "/repositories/2/resources/1"})
+        self.assertEqual(decode_response(cached), {"uri": "/repositories/2/resources/1"})
+
+    def test_renderer(self):
+        record = ItemRecord(("collection_name", "resource_id"), collection_name="Annual reports\u2028", resource_id="FA001")
+        data = {"items": [record], "date": datetime(2026, 1, 1, 12, 0), "note": "Caf\u00e9"}
+        expected = JSONRenderer().render(data)
+        for name in CODECS:
+            with override_settings(JSON_CODEC=name):
+                rendered = CodecJSONRenderer().render(data)
+                self.assertEqual(json.loads(rendered), json.loads(expected))
+                self.assertIn(b"\\u2028", rendered)
+                self.assertIn("Caf\u00e9".encode("utf-8"), rendered)
+                self.assertEqual(CodecJSONRenderer().render(None), b"")
+                indented = CodecJSONRenderer().render(data, "application/json; indent=2")
+                self.assertEqual(indented, JSONRenderer().render(data, "application/json; indent=2"))
+
+    def test_parser(self):
+        for name in CODECS:
+            with override_settings(JSON_CODEC=name):
+                parsed = CodecJSONParser().parse(BytesIO('{"items": ["Caf\u00e9"]}'.encode("utf-8")))
+                self.assertEqual(parsed, {"items": ["Caf\u00e9"]})
+                with self.assertRaises(ParseError):
+                    CodecJSONParser().parse(BytesIO(b'{"items": '))
+
+
 class TestHelpers(TestCase):
 
     @aspace_vcr.use_cassette("aspace_request.json")
@@ -170,6 +478,15 @@ class TestHelpers(TestCase):
         self.assertEqual(info[0], "closed")
         self.assertEqual(info[1], "Ancestor Note")
 
+    @patch("process_request.helpers.get_rights_status", wraps=get_rights_status)
+    def test_get_rights_info_memoizes_ancestors(self, mock_status):
+        ancestor_rights = {}
+        for _ in range(5):
+            item = json_from_fixture("object_restricted_ancestor.json")
+            self.assertEqual(get_rights_info(item, self.client, ancestor_rights), ("closed", "Ancestor Note"))
+        self.assertEqual(mock_status.call_count, 5 + len(ancestor_rights))
+        self.assertLessEqual(len(ancestor_rights), len(item["ancestors"]))
+
     def test_get_rights_status(self):
         for fixture, status in [
                 ("object_restricted_note.json", "closed"),
@@ -183,6 +500,18 @@ class TestHelpers(TestCase):
             item = json_from_fixture(fixture)
             self.assertEqual(get_rights_status(item, self.client), status)
 
+    def test_classify_note_text(self):
+        classify_note_text.cache_clear()
+        for text, expected in [
+                ("restricted until 2025.", (True, False)),
+                ("open for research.", (False, True)),
+                ("restricted - open for scholarly research", (True, True)),
+                ("open", (False, True)),
+                ("access copy unavailable.", (False, False))]:
+            self.assertEqual(classify_note_text(text), expected)
+        classify_note_text("open for research.")
+        self.assertEqual(classify_note_text.cache_info().hits, 1)
+
     def test_get_rights_text(self):
         for fixture, status in [
                 ("object_restricted_boolean.json", None),
@@ -194,6 +523,32 @@ class TestHelpers(TestCase):
             item = json_from_fixture(fixture)
             self.assertEqual(get_rights_text(item, self.client), status)
 
+    def test_strip_tags(self):
+        for user_string, expected in [
+                ("Annual reports", "Annual reports"),
+                ("<title render='italic'>Reports</title> &amp; <emph>minutes</emph>", "Reports & minutes"),
+                ("Line<lb/>break &#233;&#x41;", "Linebreak \u00e9A"),
+                ("Smith & Jones <emph>papers</emph>", "Smith & Jones papers"),
+                ("<emph>Unclosed", "Unclosed"),
+                ("<b>bold</i>", "<b>bold"),
+                ("A&nbsp;B", "A&nbsp;B"),
+                ("<!-- note -->Reports <![CDATA[<x>]]>", "Reports <x>"),
+                ("Folder\r\n1", "Folder\n1"),
+                ("", "")]:
+            self.assertEqual(strip_tags(user_string), expected)
+            self.assertEqual(strip_tags(user_string), parse_text_content(user_string))
+        self.assertEqual(Processor().strip_tags(None), None)
+
+    def test_strip_tags_matches_parser(self):
+        fragments = [
+            "<title>", "</title>", "<emph render='italic'>", "</emph>", "<br/>", "<b >", "</b >", "<a:b>",
+            "<a x='1' x='2'>", "</a>", "<\u00e9>", "<!-- c -->", "<![CDATA[x<y]]>", "<?pi?>", "&amp;", "&lt;",
+            "&nbsp;", "&#233;", "&#x1;", "& ", "<", ">", "]]>", "\r\n", "\x01", "Box 1", " ", "\u2603", "</xml>"]
+        rand = random.Random(0)
+        for _ in range(5000):
+            user_string = "".join(rand.choice(fragments) for _ in range(rand.randint(0, 8)))
+            self.assertEqual(strip_tags(user_string), parse_text_content(user_string), repr(user_string))
+
     def test_get_size(self):
         for fixture, size in [
                 ("instances_singular.json", "1 box"),
@@ -229,6 +584,35 @@ class TestHelpers(TestCase):
             result = get_restricted_in_container("/repositories/2/top_container/1", mock_client)
             self.assertEqual(result, expected)
 
+    @patch("asnake.client.web_client.ASnakeClient")
+    def test_get_restricted_in_container_pages(self, mock_client):
+        page = json_from_fixture("restricted_search.json")
+        page["last_page"] = 3
+        mock_client.get.return_value.json.return_value = page
+        expected = "Folder 122A, Folder 117A.1, Folder 118A.1, Folder 121A.1, Folder 123A.1, Folder 119A, Folder 120A.1"
+        result = get_restricted_in_container("/repositories/2/top_container/1", mock_client)
+        self.assertEqual(result, ", ".join([expected] * 3))
+        requested_pages = sorted(c.args[0].split("&page=")[-1] for c in mock_client.get.call_args_list)
+        self.assertEqual(requested_pages, ["1", "2", "3"])
+
+    def test_get_child_statuses(self):
+        objects = archival_objects_from_fixture(4)
+        objects["/repositories/2/archival_objects/4"]["parent"] = {"ref": "/repositories/2/archival_objects/999"}
+        client = StubClient(objects, child_counts={"/repositories/2/archival_objects/2": 3})
+        statuses = get_child_statuses(list(objects.values()), client)
+        self.assertEqual(statuses, {
+            "/repositories/2/archival_objects/1": False,
+            "/repositories/2/archival_objects/2": True,
+            "/repositories/2/archival_objects/3": False,
+            "/repositories/2/archival_objects/4": False})
+        self.assertEqual(client.calls_to("/tree/waypoint"), 2)
+        self.assertEqual(client.calls_to("/tree/node"), 0)
+
+        missing = archival_objects_from_fixture(1)["/repositories/2/archival_objects/1"]
+        missing["uri"] = "/repositories/2/archival_objects/5"
+        self.assertEqual(get_child_statuses([missing], client), {"/repositories/2/archival_objects/5": False})
+        self.assertEqual(client.calls_to("/tree/node"), 1)
+
     @patch("asnake.client.web_client.ASnakeClient")
     def test_get_formatted_resource_id(self, mock_client):
         for fixture, expected in [
@@ -239,16 +623,18 @@ class TestHelpers(TestCase):
             result = get_formatted_resource_id(fixture, mock_client)
             self.assertEqual(result, expected)
 
-    # Test is commented out as the code is currently not used, and this allows us to shed a few configs
-    # def test_aeon_client(self):
-    #     baseurl = random_string(20)
-    #     client = AeonAPIClient(baseurl)
-    #     self.assertEqual(client.baseurl, baseurl)
-    #     self.assertEqual(client.session.headers.get("X-AEON-API-KEY"), settings.AEON_API_KEY)
+    def test_aeon_client(self):
+        baseurl = random_string(20)
+        client = AeonAPIClient(baseurl)
+        self.assertEqual(client.baseurl, baseurl)
+        self.assertEqual(client.session.headers.get("X-AEON-API-KEY"), settings.AEON["api_key"] or "")
 
 
 class TestRoutines(TestCase):
 
+    def setUp(self):
+        record_cache.clear()
+
     @patch("process_request.routines.Processor.get_data")
     def test_parse_item(self, mock_get_data):
         item = json_from_fixture("as_data.json")
@@ -299,6 +685,128 @@ class TestRoutines(TestCase):
             self.assertNotIn("location", mail.outbox[0].body)
             self.assertNotIn("barcode", mail.outbox[0].body)
 
+    @patch("process_request.routines.Processor.iter_data")
+    def test_email_job_worker(self, mock_iter_data):
+        mock_iter_data.side_effect = lambda items, baseurl, fields=None: iter([json_from_fixture("as_data.json") for _ in items])
+        job = EmailJob.enqueue("test@example.com", random_list(), "Subject", "Message", "https://dimes.rockarch.org")
+        self.assertEqual(EmailJobWorker().run(once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, EmailJob.SENT)
+        self.assertEqual(job.processed, job.total)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["test@example.com"])
+        self.assertEqual(EmailJobWorker().run(once=True), 0)
+
+        with self.assertRaises(ValueError):
+            EmailJob.enqueue(None, random_list(), "", "", "https://dimes.rockarch.org")
+
+    @patch("process_request.routines.Processor.iter_data")
+    def test_email_job_worker_retries(self, mock_iter_data):
+        mock_iter_data.side_effect = lambda items, baseurl, fields=None: iter([json_from_fixture("as_data.json") for _ in items])
+        job = EmailJob.enqueue(["foo@example.com", "bar@example.com"], random_list(), "", "", "https://dimes.rockarch.org")
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+                   side_effect=smtplib.SMTPServerDisconnected("Connection unexpectedly closed")) as mock_send:
+            EmailJobWorker().run(once=True)
+        self.assertEqual(mock_send.call_count, 2, "Message was not resent after reconnecting")
+        job.refresh_from_db()
+        self.assertEqual(job.status, EmailJob.QUEUED)
+        self.assertEqual(job.error, "Connection unexpectedly closed")
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(EmailJob.claim(), "Job was claimed before it was due to be retried")
+
+        EmailJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        mock_iter_data.side_effect = ArchivesSpaceError("Internal Server Error", 500)
+        EmailJobWorker().run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (EmailJob.QUEUED, 2))
+
+        EmailJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        mock_iter_data.side_effect = ArchivesSpaceError("Archival Object not found", 404)
+        EmailJobWorker().run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (EmailJob.FAILED, 3))
+        self.assertEqual(len(mail.outbox), 0)
+
+        with override_settings(EMAIL_JOBS={**settings.EMAIL_JOBS, "max_attempts": 1}):
+            job = EmailJob.enqueue("test@example.com", random_list(), "", "", "https://dimes.rockarch.org")
+            mock_iter_data.side_effect = ConnectionError()
+            EmailJobWorker().run(once=True)
+            job.refresh_from_db()
+            self.assertEqual(job.status, EmailJob.FAILED)
+
+    @patch("process_request.routines.Processor.iter_data")
+    def test_email_job_worker_batches(self, mock_iter_data):
+        mock_iter_data.side_effect = lambda items, baseurl, fields=None: iter([json_from_fixture("as_data.json") for _ in items])
+        jobs = [EmailJob.enqueue("{}@example.com".format(n), random_list(), "", "", "https://dimes.rockarch.org") for n in range(5)]
+        smtp_connection.close()
+        with patch("process_request.clients.get_connection", wraps=get_connection) as mock_get_connection, \
+                override_settings(EMAIL_JOBS={**settings.EMAIL_JOBS, "batch_size": 3}):
+            self.assertEqual(EmailJobWorker().run(once=True), 5)
+        mock_get_connection.assert_called_once()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), sorted(job.recipients[0] for job in jobs))
+        self.assertEqual(EmailJob.objects.filter(status=EmailJob.SENT).count(), 5)
+
+    def test_email_job_worker_batch_leases(self):
+        leases = []
+
+        def fetch(job):
+            leases.append(EmailJob.objects.get(pk=job.pk).locked_until)
+            return [json_from_fixture("as_data.json") for _ in job.items]
+
+        for n in range(3):
+            EmailJob.enqueue("{}@example.com".format(n), random_list(), "", "", "https://dimes.rockarch.org")
+        jobs = EmailJob.claim_batch(3)
+        EmailJob.objects.update(locked_until=timezone.now() + timedelta(seconds=1))
+        EmailJob.objects.filter(pk=jobs[2].pk).update(attempts=2)
+        with patch.object(EmailJobWorker, "fetch", side_effect=fetch):
+            EmailJobWorker().run_batch(jobs)
+        self.assertEqual(len(leases), 2, "Job claimed by another worker was fetched")
+        for lease in leases:
+            self.assertGreater(
+                lease, timezone.now() + timedelta(seconds=settings.EMAIL_JOBS["lease"] - 60), "Lease was not extended before fetching items")
+        self.assertEqual([m.to[0] for m in mail.outbox], jobs[0].recipients + jobs[1].recipients)
+        self.assertEqual(EmailJob.objects.get(pk=jobs[2].pk).status, EmailJob.RUNNING)
+
+    def test_smtp_connection(self):
+        connection = SMTPConnection()
+        message = EmailMessage("Subject", "Body", "from@example.com", ["to@example.com"])
+        with patch("process_request.clients.get_connection", wraps=get_connection) as mock_get_connection:
+            self.assertEqual(connection.send_messages([message, message]), [None, None])
+            mock_get_connection.assert_called_once()
+            with patch("process_request.clients.settings.EMAIL_CONNECTION_IDLE_TIMEOUT", 0):
+                time.sleep(0.01)
+                connection.send_messages([message])
+            self.assertEqual(mock_get_connection.call_count, 2, "Idle connection was not reopened")
+        self.assertEqual(len(mail.outbox), 3)
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages",
+                   side_effect=[smtplib.SMTPServerDisconnected(), 1, smtplib.SMTPRecipientsRefused({})]):
+            results = connection.send_messages([message, message])
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], smtplib.SMTPRecipientsRefused)
+
+    def test_email_job_claim_expired_lease(self):
+        job = EmailJob.enqueue("test@example.com", random_list(), "", "", "https://dimes.rockarch.org")
+        self.assertEqual(EmailJob.claim(), job)
+        self.assertIsNone(EmailJob.claim())
+        EmailJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = EmailJob.claim()
+        self.assertEqual((claimed, claimed.attempts), (job, 2))
+
+        EmailJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() + timedelta(seconds=1))
+        claimed.record_progress(5)
+        job.refresh_from_db()
+        self.assertEqual(job.processed, 5)
+        self.assertGreater(job.locked_until, timezone.now() + timedelta(seconds=settings.EMAIL_JOBS["lease"] - 60), "Lease was not extended")
+
+        EmailJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        with override_settings(EMAIL_JOBS={**settings.EMAIL_JOBS, "max_attempts": 2}):
+            self.assertIsNone(EmailJob.claim(), "Job was claimed after using up its attempts")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (EmailJob.FAILED, 2))
+        self.assertIsNone(job.locked_until)
+
     @aspace_vcr.use_cassette("aspace_request.json")
     @override_settings(RESTRICTED_IN_CONTAINER=False)
     @patch("process_request.routines.get_resource_creators")
@@ -308,6 +816,84 @@ class TestRoutines(TestCase):
         self.assertTrue(isinstance(get_as_data, list))
         self.assertEqual(len(get_as_data), 1)
 
+    @override_settings(RESTRICTED_IN_CONTAINER=False)
+    @patch("process_request.routines.get_aspace_client")
+    def test_get_data_memoizes_collection_values(self, mock_client):
+        objects = archival_objects_from_fixture(30)
+        mock_client.return_value = client = StubClient(objects)
+        data = Processor().get_data(list(objects), "https://dimes.rockarch.org")
+        self.assertEqual(len(data), 30)
+        self.assertEqual(client.calls_to("/search"), 1)
+        self.assertEqual(client.calls_to("/tree/waypoint"), 1)
+        self.assertEqual(client.calls_to("/tree/node"), 0)
+        for item in data:
+            self.assertEqual(item["creators"], "Philanthropy Foundation")
+            self.assertEqual(item["resource_id"], "121212")
+            self.assertEqual(item["collection_name"], "KMTests")
+
+    @override_settings(RESTRICTED_IN_CONTAINER=False)
+    @patch("process_request.clients.aspace_pool")
+    def test_get_data_concurrent_chunks(self, mock_pool):
+        objects = archival_objects_from_fixture(150)
+        mock_pool.client = client = StubClient(objects, latency=0.02)
+        uri_list = random.sample(list(objects), len(objects))
+        data = Processor().get_data(uri_list, "https://dimes.rockarch.org")
+        self.assertEqual([item["uri"] for item in data], uri_list)
+        self.assertEqual(client.calls_to("/archival_objects"), 6)
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertLessEqual(client.max_in_flight, settings.ARCHIVESSPACE["max_in_flight"])
+
+    @patch("process_request.clients.aspace_pool")
+    def test_iter_data(self, mock_pool):
+        objects = archival_objects_from_fixture(300)
+        mock_pool.client = client = StubClient(objects)
+        data = Processor().iter_data(list(objects), "https://dimes.rockarch.org")
+        self.assertEqual(next(data)["uri"], "/repositories/2/archival_objects/1")
+        self.assertLessEqual(client.calls_to("/archival_objects"), settings.ARCHIVESSPACE["max_in_flight"] + 1)
+        self.assertEqual([item["uri"] for item in data], list(objects)[1:])
+        self.assertEqual(client.calls_to("/archival_objects"), 12)
+
+    @patch("process_request.clients.aspace_pool")
+    def test_item_records(self, mock_pool):
+        objects = archival_objects_from_fixture(3)
+        mock_pool.client = StubClient(objects)
+        record, = Processor().get_data(list(objects)[:1], "https://dimes.rockarch.org", export_fields())
+        self.assertIsInstance(record, ItemRecord)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual(list(record), [field for field in ITEM_FIELDS if field in export_fields()])
+        self.assertIn("title", record)
+        self.assertNotIn("restrictions", record)
+        self.assertIsNone(record.get("restrictions"))
+        with self.assertRaises(KeyError):
+            record["restrictions"]
+        self.assertEqual(record["size"], record.size)
+        with self.assertRaises(AttributeError):
+            record.title = "foo"
+        values = [id(value) for value in record.values()] + [id(ItemRecord)]
+        for referent in gc.get_referents(record):
+            self.assertTrue(id(referent) in values or referent == tuple(record), "Record kept a reference to {!r}".format(referent))
+
+        row = StringIO()
+        csv.DictWriter(row, fieldnames=[key for key, _ in settings.EXPORT_FIELDS], extrasaction="ignore").writerow(record)
+        self.assertIn(record["title"], row.getvalue())
+        self.assertEqual(record.uri, list(objects)[0])
+        self.assertEqual(json.loads(json.dumps(dict(record))), dict(record))
+        self.assertEqual(dict(record), record)
+
+    @override_settings(RESTRICTED_IN_CONTAINER=True)
+    @patch("process_request.clients.aspace_pool")
+    def test_get_data_concurrent_enrichment(self, mock_pool):
+        objects = archival_objects_from_fixture(20)
+        mock_pool.client = client = StubClient(objects, latency=0.02)
+        with override_settings(ARCHIVESSPACE={**settings.ARCHIVESSPACE, "max_in_flight": 1}):
+            expected = Processor().get_data(list(objects), "https://dimes.rockarch.org")
+        self.assertEqual(client.max_in_flight, 1)
+
+        record_cache.clear()
+        data = Processor().get_data(list(objects), "https://dimes.rockarch.org")
+        self.assertEqual(data, expected)
+        self.assertGreater(client.max_in_flight, 1)
+
     @aspace_vcr.use_cassette("aspace_request.json")
     @patch("asnake.client.web_client.ASnakeClient.get")
     def test_invalid_get_data(self, mock_as_get):
@@ -318,6 +904,45 @@ class TestRoutines(TestCase):
         with self.assertRaises(Exception, msg=error_message):
             Processor().get_data(["/repositories/2/archival_objects/1134638"], "https://dimes.rockarch.org")
 
+    @patch("asnake.client.web_client.ASnakeClient")
+    def test_container_restriction_index(self, mock_client):
+        search = json_from_fixture("restricted_search.json")
+        mock_client.get.return_value.json.return_value = search
+        container_uri = "/repositories/2/top_containers/85908"
+        expected = "Folder 122A, Folder 117A.1, Folder 118A.1, Folder 121A.1, Folder 123A.1, Folder 119A, Folder 120A.1"
+
+        run = ContainerRestrictionIndexer(mock_client).run()
+        self.assertTrue(run.full)
+        self.assertEqual(run.indexed, len(search["results"]))
+        self.assertTrue(ContainerIndexRun.is_fresh())
+        mock_client.reset_mock()
+        self.assertEqual(get_restricted_in_container(container_uri, mock_client), expected)
+        self.assertEqual(get_restricted_in_container("/repositories/2/top_containers/1", mock_client), "")
+        mock_client.get.assert_not_called()
+        context = ResolutionContext(mock_client, Processor())
+        with patch("process_request.routines.ContainerIndexRun.is_fresh", wraps=ContainerIndexRun.is_fresh) as mock_is_fresh:
+            self.assertEqual(context.restricted_in_container(container_uri), expected)
+            self.assertEqual(context.restricted_in_container("/repositories/2/top_containers/1"), "")
+        self.assertEqual(mock_is_fresh.call_count, 1, "Index freshness was looked up more than once for a request")
+        context = ResolutionContext(mock_client, Processor())
+        with patch("process_request.routines.close_old_connections") as mock_close:
+            context.restricted_in_container(container_uri)
+            mock_close.assert_not_called()
+            # Lookups made off the thread which created the context.
+            context.thread = None
+            self.assertEqual(context.restricted_in_container("/repositories/2/top_containers/1"), "")
+        self.assertTrue(mock_close.called, "Worker thread did not close its connection")
+
+        modified = {"results": [{"uri": "/repositories/2/resources/682"}], "this_page": 1, "last_page": 1}
+        mock_client.get.return_value.json.side_effect = lambda: modified if "fields[]=uri&" in mock_client.get.call_args.args[0] else search
+        run = ContainerRestrictionIndexer(mock_client).run()
+        self.assertFalse(run.full)
+        self.assertEqual(run.indexed, 2 * len(search["results"]))
+        self.assertEqual(RestrictedSubcontainer.objects.filter(top_container_uri=container_uri).count(), 7)
+
+        with override_settings(CONTAINER_INDEX_MAX_AGE=0):
+            self.assertFalse(ContainerIndexRun.is_fresh())
+
     @patch("process_request.routines.Processor.get_data")
     def test_send_aeon_requests(self, mock_get_data):
         mock_get_data.return_value = [json_from_fixture("as_data.json")]
@@ -334,6 +959,327 @@ class TestRoutines(TestCase):
         with self.assertRaises(ValueError, msg="Unknown request type '{}', expected either 'readingroom' or 'duplication'".format(request_type)):
             AeonRequester().get_request_data(request_type, "https://dimes.rockarch.org", **data)
 
+    @patch("process_request.routines.Processor.get_data")
+    def test_submit_aeon_transactions(self, mock_get_data):
+        items = []
+        for n in range(6):
+            item = json_from_fixture("as_data.json")
+            item["uri"] = "/repositories/2/archival_objects/{}".format(n)
+            item["dates"] = "19{}0".format(n)
+            item["preferred_instance"]["uri"] = "/repositories/2/top_containers/{}".format(n % 3)
+            items.append(item)
+        mock_get_data.return_value = items
+        data = {"scheduledDate": date.today().isoformat(), "items": random_list(), "username": "researcher"}
+        prepared = AeonRequester().get_request_data("readingroom", "https://dimes.rockarch.org", **data)
+
+        self.assertEqual(
+            AeonRequester().send_request("readingroom", "https://dimes.rockarch.org", **data), prepared,
+            "Request data was not returned when no Aeon API is configured")
+
+        with AeonStandIn(latency=0.05) as aeon, \
+                patch.dict(settings.AEON, {"baseurl": aeon.baseurl, "api_key": "aeonkey", "backoff": 0, "max_workers": 3}):
+            aeon_pool.reset()
+            delivered = AeonRequester().send_request("readingroom", "https://dimes.rockarch.org", **data)
+            self.assertEqual(delivered, prepared)
+            self.assertEqual(len(aeon.transactions), 3)
+            self.assertEqual(len(aeon.requests), 3)
+            self.assertGreater(aeon.max_in_flight, 1, "Transactions were not sent concurrently")
+            transaction = sorted(aeon.transactions, key=lambda t: t["itemCitation"])[0]
+            self.assertEqual(transaction["username"], "researcher")
+            self.assertEqual(transaction["requestType"], "Loan")
+            self.assertEqual(transaction["scheduledDate"], data["scheduledDate"])
+            self.assertEqual(transaction["itemCitation"], "/repositories/2/archival_objects/0")
+            self.assertEqual(transaction["itemDate"], "1900; 1930")
+            self.assertEqual(transaction["location"], items[0]["preferred_instance"]["location"])
+
+            AeonRequester().send_request("readingroom", "https://dimes.rockarch.org", **data)
+            self.assertEqual(len(aeon.transactions), 6, "Identical requests were not both created")
+
+        with AeonStandIn(failures=1) as aeon, \
+                patch.dict(settings.AEON, {"baseurl": aeon.baseurl, "api_key": "aeonkey", "backoff": 0, "max_attempts": 2}):
+            aeon_pool.reset()
+            with self.assertRaises(AeonError) as cm:
+                AeonRequester().send_request("duplication", "https://dimes.rockarch.org", **data)
+            self.assertEqual(cm.exception.status_code, 503)
+            self.assertEqual(len(aeon.requests), 3, "Server errors were retried")
+            self.assertEqual(len(aeon.transactions), 2)
+
+        with AeonStandIn(latency=0.5) as aeon, \
+                patch.dict(settings.AEON, {"baseurl": aeon.baseurl, "api_key": "aeonkey", "backoff": 0, "timeout": 0.1}):
+            aeon_pool.reset()
+            with self.assertRaises(AeonError):
+                AeonRequester().send_request("duplication", "https://dimes.rockarch.org", **data)
+            self.assertEqual(len(aeon.requests), 3, "Timed out transactions were retried")
+
+        with AeonStandIn() as aeon:
+            pass
+        with patch.dict(settings.AEON, {"baseurl": aeon.baseurl, "api_key": "aeonkey", "backoff": 0, "max_attempts": 2}):
+            aeon_pool.reset()
+            with patch.object(aeon_pool.client.session, "post", wraps=aeon_pool.client.session.post) as mock_post, \
+                    self.assertRaises(AeonError):
+                AeonRequester().send_request("duplication", "https://dimes.rockarch.org", **data)
+            self.assertEqual(mock_post.call_count, 6, "Refused connections were not retried")
+        self.assertFalse(connection_not_established(requests.ConnectionError(
+            ProtocolError("Connection aborted.", RemoteDisconnected("Remote end closed connection without response")))))
+
+        with AeonStandIn() as aeon, \
+                patch.dict(settings.AEON, {"baseurl": aeon.baseurl, "api_key": "aeonkey", "backoff": 0}):
+            aeon_pool.reset()
+            with patch.object(aeon_pool.client.session, "headers", {"X-AEON-API-KEY": "wrong"}), \
+                    self.assertRaises(AeonError) as cm:
+                AeonRequester().send_request("duplication", "https://dimes.rockarch.org", **data)
+            self.assertEqual(cm.exception.status_code, 401)
+            self.assertEqual(len(aeon.requests), 3, "Client errors were retried")
+        aeon_pool.reset()
+
+
+class TestUpstreamCallBudgets(TestCase):
+    """Fails when a change increases the number of ArchivesSpace calls made
+    while processing a list of items."""
+
+    ITEMS = 50
+    RESOURCES = 3
+    CONTAINERS = 5
+    CALLS_PER_ITEM = 0.3
+    # The most calls each helper may make for ITEMS items.
+    HELPER_BUDGETS = {
+        "fetch_chunk": 2,
+        "get_child_statuses": RESOURCES,
+        "get_resource_creators": RESOURCES,
+        "iter_search_results": CONTAINERS,
+    }
+    SINGLE_ITEM_CALLS = 4  # The object, its child count, creators and container.
+    # Latency keeps calls in flight long enough for concurrent calls to overlap.
+    LATENCY = 0.02
+
+    def setUp(self):
+        self.objects = archival_objects_from_fixture(
+            self.ITEMS, resources=self.RESOURCES, containers=self.CONTAINERS, instance_type="mixed materials")
+        self.uri_list = list(self.objects)
+
+    def assertWithinBudget(self, report, items, helper_budgets):
+        for helper, calls in report["helpers"].items():
+            self.assertLessEqual(
+                calls, helper_budgets.get(helper, 0), "{} made too many calls: {}".format(helper, report))
+        self.assertLessEqual(report["calls"], self.CALLS_PER_ITEM * items if items > 1 else self.SINGLE_ITEM_CALLS, report)
+
+    @override_settings(RESTRICTED_IN_CONTAINER=True)
+    def test_get_data(self):
+        report = count_upstream_calls(
+            lambda: Processor().get_data(self.uri_list, "https://dimes.rockarch.org"), self.objects, latency=self.LATENCY)
+        self.assertWithinBudget(report, self.ITEMS, self.HELPER_BUDGETS)
+        self.assertEqual(report["endpoints"]["/repositories/:id/archival_objects"], report["helpers"]["fetch_chunk"])
+        # Helpers which make several calls send them concurrently.
+        for helper in ["fetch_chunk", "get_resource_creators", "iter_search_results"]:
+            if report["helpers"].get(helper, 0) > 1:
+                self.assertGreater(report["concurrency"][helper], 1, report)
+
+    @override_settings(RESTRICTED_IN_CONTAINER=True)
+    def test_parse_item(self):
+        report = count_upstream_calls(
+            lambda: Processor().parse_item(self.uri_list[0], "https://dimes.rockarch.org"), self.objects)
+        self.assertWithinBudget(report, 1, {helper: 1 for helper in self.HELPER_BUDGETS})
+
+    def test_parse_batch(self):
+        report = count_upstream_calls(
+            lambda: Processor().parse_batch(self.uri_list, "https://dimes.rockarch.org"), self.objects)
+        self.assertWithinBudget(report, self.ITEMS, self.HELPER_BUDGETS)
+
+    def test_field_plans(self):
+        full = count_upstream_calls(
+            lambda: Processor().get_data(self.uri_list, "https://dimes.rockarch.org"), self.objects)
+        for fields in [PARSE_FIELDS, AEON_FIELDS, export_fields()]:
+            fetched = []
+            report = count_upstream_calls(
+                lambda: fetched.extend(Processor().get_data(self.uri_list, "https://dimes.rockarch.org", fields)),
+                self.objects)
+            self.assertTrue(all(set(item) == set(fields) for item in fetched))
+            self.assertLessEqual(report["calls"], full["calls"])
+            if "dimes_url" not in fields:
+                self.assertNotIn("get_child_statuses", report["helpers"])
+            if "creators" not in fields:
+                self.assertNotIn("get_resource_creators", report["helpers"])
+        report = count_upstream_calls(
+            lambda: Processor().parse_batch(self.uri_list, "https://dimes.rockarch.org"), self.objects)
+        self.assertEqual(report["calls"], report["helpers"]["fetch_chunk"], "Parsing made lookups besides fetching objects")
+
+        with self.assertRaises(ValueError):
+            Processor().get_data(self.uri_list, "https://dimes.rockarch.org", ["uri", "foo"])
+
+    @override_settings(RESTRICTED_IN_CONTAINER=True)
+    def test_fetch_strategies(self):
+        resolved = []
+        full = count_upstream_calls(
+            lambda: resolved.extend(dict(item) for item in Processor().get_data(self.uri_list, "https://dimes.rockarch.org")),
+            self.objects, measure_decode=True)
+        with patch.dict(settings.ARCHIVESSPACE, {"fetch_strategy": "projected"}):
+            projected = []
+            report = count_upstream_calls(
+                lambda: projected.extend(dict(item) for item in Processor().get_data(self.uri_list, "https://dimes.rockarch.org")),
+                self.objects, measure_decode=True)
+        self.assertEqual(projected, resolved)
+        self.assertLess(report["response_bytes"], full["response_bytes"])
+        # Chunks fetched concurrently each fetch the shared records they claim
+        # first, so each kind of shared record (resources and top containers
+        # here) is fetched at most once per chunk.
+        self.assertWithinBudget(report, self.ITEMS, dict(self.HELPER_BUDGETS, fetch_shared_records=2 * self.HELPER_BUDGETS["fetch_chunk"]))
+
+    def test_send_message(self):
+        report = count_upstream_calls(
+            lambda: Mailer().send_message("test@example.com", self.uri_list, "", "", "https://dimes.rockarch.org"),
+            self.objects)
+        self.assertWithinBudget(report, self.ITEMS, self.HELPER_BUDGETS)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_get_request_data(self):
+        for request_type in ["readingroom", "duplication"]:
+            report = count_upstream_calls(
+                lambda: AeonRequester().get_request_data(request_type, "https://dimes.rockarch.org", items=self.uri_list),
+                self.objects)
+            self.assertWithinBudget(report, self.ITEMS, self.HELPER_BUDGETS)
+
+
+class TestMirror(TransactionTestCase):
+    """Items are processed in worker threads, which read the mirror over their
+    own database connections, so mirrored records are committed."""
+
+    ITEMS = 30
+
+    def setUp(self):
+        self.objects = archival_objects_from_fixture(
+            self.ITEMS, resources=3, containers=5, instance_type="mixed materials")
+        for n, obj in enumerate(self.objects.values()):
+            obj["ref_id"] = "ref{}".format(n)
+        self.uri_list = list(self.objects)
+        self.stub = StubClient(self.objects)
+
+    def get_data(self, data_source=None):
+        fetched = []
+        report = count_upstream_calls(
+            lambda: fetched.extend(dict(item) for item in Processor(data_source).get_data(self.uri_list, "https://dimes.rockarch.org")),
+            self.objects)
+        return fetched, report
+
+    def test_sync(self):
+        run = MirrorSyncer(self.stub).run()
+        self.assertTrue(run.full)
+        # Objects, their parent, resources, top containers, a location and an agent.
+        self.assertEqual(run.synced, self.ITEMS + 1 + 3 + 15 + 1 + 1)
+        self.assertEqual(MirroredRecord.objects.count(), run.synced)
+        self.assertEqual(MirroredRecord.objects.filter(record_type="archival_object").count(), self.ITEMS + 1)
+        self.assertEqual(MirroredContainer.objects.count(), self.ITEMS * 3)
+        obj = MirroredRecord.objects.get(uri=self.uri_list[0])
+        self.assertEqual((obj.ref_id, obj.parent_uri, obj.resource_uri), ("ref0", "/repositories/2/archival_objects/1154299", "/repositories/2/resources/1"))
+        self.assertNotIn("_resolved", obj.json["ancestors"][0], "Mirrored records were stored resolved")
+        self.assertTrue(MirrorSyncRun.is_fresh())
+
+        modified = self.objects[self.uri_list[0]]
+        modified.update(title="Modified", system_mtime=(timezone.now() + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+        self.stub.calls.clear()
+        run = MirrorSyncer(self.stub).run()
+        self.assertFalse(run.full)
+        self.assertEqual(run.synced, 1)
+        self.assertEqual(MirroredRecord.objects.get(uri=self.uri_list[0]).json["title"], "Modified")
+        # Modified and all identifiers are listed, and one chunk is fetched.
+        self.assertEqual(self.stub.calls_to("/archival_objects"), 3, "Unmodified records were fetched")
+
+        deleted = self.objects.pop(self.uri_list[-1])
+        MirrorSyncer(StubClient(self.objects)).run()
+        self.assertFalse(MirroredRecord.objects.filter(uri=deleted["uri"]).exists(), "Incremental run kept a deleted record")
+        self.assertFalse(MirroredContainer.objects.filter(record__uri=deleted["uri"]).exists())
+        self.assertEqual(MirroredRecord.objects.count(), self.ITEMS + 1 + 3 + 15 + 1 + 1 - 1)
+        deleted = self.objects.pop(self.uri_list[-2])
+        run = MirrorSyncer(StubClient(self.objects)).run(full=True)
+        self.assertFalse(MirroredRecord.objects.filter(uri=deleted["uri"]).exists())
+
+        with patch("process_request.management.commands.sync_archivesspace_mirror.MirrorSyncer") as mock_syncer:
+            mock_syncer.return_value.run.return_value = run
+            out = StringIO()
+            call_command("sync_archivesspace_mirror", full=True, stdout=out)
+            mock_syncer.return_value.run.assert_called_once_with(full=True)
+            self.assertIn("Synced {} records".format(run.synced), out.getvalue())
+
+    @patch("process_request.clients.aspace_pool")
+    def test_sync_bypasses_record_cache(self, mock_pool):
+        mock_pool.client = self.stub
+        record_cache.clear()
+        MirrorSyncer(CachingClient(self.stub)).run()
+
+        later = (timezone.now() + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        agent_uri = next(uri for uri in self.stub.records if uri.startswith("/agents/"))
+        self.stub.records[agent_uri] = dict(self.stub.records[agent_uri], title="Renamed", system_mtime=later)
+        new_agent_uri = "/agents/people/999999"
+        self.stub.records[new_agent_uri] = dict(self.stub.records[agent_uri], uri=new_agent_uri)
+        new_object_uri = "/repositories/2/archival_objects/999999"
+        self.objects[new_object_uri] = dict(self.objects[self.uri_list[0]], uri=new_object_uri, ref_id="new", system_mtime=later)
+        MirrorSyncer().run()
+        self.assertEqual(MirroredRecord.objects.get(uri=agent_uri).json["title"], "Renamed", "A cached copy of a modified record was mirrored")
+        self.assertTrue(MirroredRecord.objects.filter(uri=new_agent_uri).exists(), "A new record was removed")
+        self.assertTrue(MirroredRecord.objects.filter(uri=new_object_uri).exists(), "A new record was removed")
+
+    @override_settings(RESTRICTED_IN_CONTAINER=False)
+    def test_get_data(self):
+        live, _ = self.get_data()
+        MirrorSyncer(self.stub).run()
+        for strategy in ["resolve", "projected"]:
+            with patch.dict(settings.ARCHIVESSPACE, {"fetch_strategy": strategy}):
+                mirrored, report = self.get_data("mirror")
+            self.assertEqual(mirrored, live)
+            self.assertEqual(report["calls"], 0, report)
+        with patch.dict(settings.ARCHIVESSPACE, {"data_source": "mirror"}), \
+                patch("process_request.mirror.MirrorSyncRun.is_fresh", wraps=MirrorSyncRun.is_fresh) as mock_is_fresh, \
+                patch("process_request.mirror.close_old_connections") as mock_close:
+            self.assertEqual(self.get_data()[1]["calls"], 0)
+        self.assertEqual(mock_is_fresh.call_count, 1, "Freshness was looked up more than once for a request")
+        self.assertTrue(mock_close.called, "Worker threads did not close their connections")
+
+        # Missing records are fetched individually, and objects which refer
+        # to them are fetched from ArchivesSpace.
+        MirroredRecord.objects.filter(uri=self.uri_list[3]).delete()
+        mirrored, report = self.get_data("mirror")
+        self.assertEqual(mirrored, live)
+        self.assertEqual(report["helpers"], {"fetch_chunk": 1, "has_children": 1}, report)
+        MirroredRecord.objects.filter(uri="/repositories/2/top_containers/10").delete()
+        mirrored, report = self.get_data("mirror")
+        self.assertEqual(mirrored, live)
+        self.assertEqual(report["helpers"]["fetch_chunk"], 2, report)
+
+        # Stale records are fetched, and child counts looked up, from ArchivesSpace.
+        stale = timezone.now() - timedelta(seconds=settings.ARCHIVESSPACE_MIRROR["max_age"] + 1)
+        MirrorSyncRun.objects.update(started=stale)
+        MirroredRecord.objects.update(synced=stale)
+        self.assertFalse(MirrorSyncRun.is_fresh())
+        mirrored, report = self.get_data("mirror")
+        self.assertEqual(mirrored, live)
+        self.assertEqual(report["calls"], self.get_data()[1]["calls"])
+
+        with self.assertRaises(ValueError):
+            get_aspace_client("elsewhere")
+
+    def test_lookups(self):
+        MirrorSyncer(self.stub).run()
+        self.stub.calls.clear()
+        client = MirrorClient(self.stub)
+        obj = self.objects[self.uri_list[0]]
+        parent = obj["ancestors"][0]["_resolved"]
+        self.assertTrue(has_children(parent, client))
+        self.assertFalse(has_children(obj, client))
+        self.assertEqual(get_child_statuses([obj], client), {obj["uri"]: False})
+        self.assertEqual(resolve_ref_id(2, "ref0", client), get_url(obj, None, children=False))
+        self.assertEqual(get_resource_creators(obj["ancestors"][-1]["_resolved"], client), "Philanthropy Foundation")
+
+        container_uri = obj["instances"][0]["sub_container"]["top_container"]["ref"]
+        self.assertEqual(get_restricted_in_container(container_uri, client), "")
+        restricted = MirroredRecord.objects.get(uri=obj["uri"])
+        restricted.json["rights_statements"] = [{"acts": [{"restriction": "disallow"}]}]
+        restricted.save()
+        self.assertEqual(get_restricted_in_container(container_uri, client), "Folder 1699")
+        self.assertEqual(self.stub.calls, [])
+
+        MirroredRecord.objects.filter(uri=parent["uri"]).delete()
+        get_restricted_in_container(container_uri, client)
+        self.assertEqual(self.stub.calls_to("/search"), 1, "Container was not searched when an ancestor was missing")
+
 
 class TestViews(TestCase):
 
@@ -357,10 +1303,10 @@ class TestViews(TestCase):
         self.assertEqual(
             response.data["detail"], exception_text, "Exception string not in response")
 
-    @patch("process_request.routines.Processor.get_data")
+    @patch("process_request.routines.Processor.iter_data")
     def test_download_csv_view(self, mock_get_data):
         to_process = random_list()
-        mock_get_data.return_value = [json_from_fixture("as_data.json") for n in range(len(to_process))]
+        mock_get_data.return_value = iter([json_from_fixture("as_data.json") for n in range(len(to_process))])
         request = self.factory.post(
             reverse("download-csv"), {"items": to_process}, format="json")
         response = DownloadCSVView.as_view()(request)
@@ -373,18 +1319,81 @@ class TestViews(TestCase):
             sum(1 for row in reader), len(to_process) + 1,
             "Incorrect number of rows in CSV file")
 
+        mock_get_data.return_value = iter([json_from_fixture("as_data.json") for n in range(60)])
+        request = self.factory.post(
+            reverse("download-csv"), {"items": to_process}, format="json")
+        response = DownloadCSVView.as_view()(request)
+        self.assertEqual(len(list(response.streaming_content)), 4)
+
         self.assert_handles_exceptions(
             mock_get_data, "foobar", "download-csv", DownloadCSVView)
 
-    @patch("process_request.routines.Mailer.send_message")
-    def test_send_email_request_view(self, mock_sent):
-        mock_sent.return_value = "email sent"
-        self.assert_handles_routine(
-            {"items": random_list(), "to_address": "test@example.com", "subject": "DIMES list"},
-            "deliver-email",
-            MailerView)
+    @patch("process_request.routines.Processor.iter_data")
+    def test_download_ndjson_view(self, mock_get_data):
+        to_process = random_list()
+        expected = [json_from_fixture("as_data.json") for n in range(len(to_process))]
+        mock_get_data.return_value = iter(expected)
+        request = self.factory.post(
+            reverse("download-ndjson"), {"items": to_process}, format="json")
+        response = DownloadNDJSONView.as_view()(request)
+        self.assertTrue(isinstance(response, StreamingHttpResponse))
+        self.assertEqual(response.get("Content-Type"), "application/x-ndjson")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        lines = response.getvalue().decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        mock_get_data.return_value = iter(expected)
+        request = self.factory.post(
+            reverse("download-ndjson"), {"items": to_process}, format="json", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        response = DownloadNDJSONView.as_view()(request)
+        self.assertEqual(response.get("Content-Encoding"), "gzip")
+        lines = gzip.decompress(response.getvalue()).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        mock_get_data.return_value = iter(expected)
+        request = self.factory.post(
+            reverse("download-ndjson"), {"items": to_process}, format="json", HTTP_ACCEPT_ENCODING="gzip;q=0, deflate")
+        response = DownloadNDJSONView.as_view()(request)
+        self.assertFalse(response.has_header("Content-Encoding"), "Response was compressed with a refused coding")
+
         self.assert_handles_exceptions(
-            mock_sent, "foobar", "deliver-email", MailerView)
+            mock_get_data, "foobar", "download-ndjson", DownloadNDJSONView)
+
+    def test_accepts_encoding(self):
+        for header, accepted in [
+                ("gzip", True),
+                ("deflate, gzip;q=0.5", True),
+                ("GZIP; Q=1.0", True),
+                ("*", True),
+                ("", False),
+                ("deflate", False),
+                ("gzip;q=0", False),
+                ("gzip;q=0.000", False),
+                ("gzip;q=foo", False),
+                ("*;q=0.5, gzip;q=0", False),
+                ("identity, *;q=0", False)]:
+            self.assertEqual(accepts_encoding(header, "gzip"), accepted, header)
+
+    def test_send_email_request_view(self):
+        items = random_list()
+        request = self.factory.post(
+            reverse("deliver-email"), {"items": items, "email": "test@example.com", "subject": "DIMES list"}, format="json")
+        response = MailerView.as_view()(request)
+        self.assertEqual(response.status_code, 200, "Response error: {}".format(response.data))
+        job = EmailJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.recipients, ["test@example.com"])
+        self.assertEqual(job.items, items)
+
+        response = EmailJobStatusView.as_view()(self.factory.get(reverse("email-status", args=[job.pk])), job_id=job.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], EmailJob.QUEUED)
+        self.assertEqual(response.data["total"], len(items))
+        response = EmailJobStatusView.as_view()(self.factory.get(reverse("email-status", args=[job.pk])), job_id=uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+
+        with patch("process_request.views.EmailJob.enqueue") as mock_enqueue:
+            self.assert_handles_exceptions(
+                mock_enqueue, "foobar", "deliver-email", MailerView)
 
     @patch("process_request.routines.Processor.parse_item")
     def test_parse_request_view(self, mock_parse):
@@ -395,6 +1404,46 @@ class TestViews(TestCase):
         self.assert_handles_exceptions(
             mock_parse, "bar", "parse-request", ParseRequestView)
 
+    @patch("process_request.routines.Processor.get_data")
+    def test_parse_batch_view(self, mock_get_data):
+        uri_list = ["/repositories/2/archival_objects/{}".format(n) for n in range(5)]
+
+        def get_data(uris, baseurl, fields=None):
+            items = []
+            for uri in uris:
+                if uri != uri_list[3]:
+                    item = json_from_fixture("as_data.json")
+                    item["uri"] = uri
+                    items.append(item)
+            return items
+        mock_get_data.side_effect = get_data
+
+        parsed, cursor = [], None
+        with patch("process_request.views.settings.PARSE_BATCH_PAGE_SIZE", 3):
+            while True:
+                request = self.factory.post(
+                    reverse("parse-batch"), {"items": uri_list, "cursor": cursor, "page_size": 2}, format="json")
+                response = ParseBatchView.as_view()(request)
+                self.assertEqual(response.status_code, 200, "Response error: {}".format(response.data))
+                self.assertEqual(response.data["count"], len(uri_list))
+                self.assertLessEqual(len(response.data["items"]), 2)
+                parsed += response.data["items"]
+                cursor = response.data["cursor"]
+                if not cursor:
+                    break
+        self.assertEqual(mock_get_data.call_count, 3, "Each page was not fetched with a single call")
+        self.assertEqual([p["uri"] for p in parsed], uri_list)
+        self.assertEqual([p["submit"] for p in parsed], [True, True, True, False, True])
+        self.assertIn("This item cannot be found.", parsed[3]["submit_reason"])
+
+        for data in [
+                {"items": uri_list, "cursor": "foo"},
+                {"items": uri_list[:4], "cursor": ParseBatchView().make_cursor(2, uri_list)},
+                {"items": []}]:
+            request = self.factory.post(reverse("parse-batch"), data, format="json")
+            response = ParseBatchView.as_view()(request)
+            self.assertEqual(response.status_code, 500)
+
     @patch("process_request.routines.AeonRequester.get_request_data")
     def test_deliver_readingroomrequest_view(self, mock_send):
         delivered = {"foo": "bar"}
@@ -1,7 +1,11 @@
 import csv
+import hashlib
+import json
+import zlib
 from datetime import datetime
+from itertools import chain, islice
 
-from asnake.aspace import ASpace
+from django.core import signing
 from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
 from request_broker import settings
@@ -10,9 +14,12 @@ from rest_framework.views import APIView
 
 from request_broker import settings
 
+from .cache import record_cache, single_flight
+from .clients import get_aspace_client
 from .helpers import resolve_ref_id
-from .routines import AeonRequester, Mailer, Processor
-from .serializers import LinkResolverSerializer
+from .models import EmailJob
+from .routines import AeonRequester, Processor, export_fields
+from .serializers import EmailJobSerializer, LinkResolverSerializer
 
 class BaseRequestView(APIView):
     """Base view which handles POST requests returns the appropriate response.
@@ -36,8 +43,52 @@ class ParseRequestView(BaseRequestView):
         return Processor().parse_item(uri, baseurl)
 
 
+class ParseBatchView(BaseRequestView):
+    """Parses a list of items to determine which are submittable.
+
+    Items are parsed a page at a time. When more items remain, the response
+    includes a `cursor`, which is sent back with the same list of items to
+    get the next page."""
+
+    def get_response_data(self, request):
+        uri_list = request.data.get("items")
+        if not uri_list:
+            raise ValueError("No items were provided.")
+        page_size = min(int(request.data.get("page_size", settings.PARSE_BATCH_PAGE_SIZE)), settings.PARSE_BATCH_PAGE_SIZE)
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1.")
+        cursor = request.data.get("cursor")
+        start = self.read_cursor(cursor, uri_list) if cursor else 0
+        end = start + page_size
+        baseurl = request.META.get("HTTP_ORIGIN", settings.DIMES_BASEURL)
+        return {
+            "count": len(uri_list),
+            "items": Processor().parse_batch(uri_list[start:end], baseurl),
+            "cursor": self.make_cursor(end, uri_list) if end < len(uri_list) else None,
+        }
+
+    def make_cursor(self, offset, uri_list):
+        return signing.dumps({"offset": offset, "items": self.list_digest(uri_list)}, salt="parse-batch")
+
+    def read_cursor(self, cursor, uri_list):
+        """Returns the offset in a cursor, checking that it was issued for
+        this list of items."""
+        try:
+            data = signing.loads(cursor, salt="parse-batch")
+        except signing.BadSignature:
+            raise ValueError("Invalid cursor.")
+        if data["items"] != self.list_digest(uri_list):
+            raise ValueError("Cursor does not match the list of items.")
+        return data["offset"]
+
+    def list_digest(self, uri_list):
+        return hashlib.sha1("\n".join(uri_list).encode("utf-8")).hexdigest()
+
+
 class MailerView(BaseRequestView):
-    """Delivers email messages containing data."""
+    """Queues email messages containing data, which are delivered by a worker.
+
+    Returns an identifier for the job, which can be used to check its status."""
 
     def get_response_data(self, request):
         object_list = request.data.get("items")
@@ -45,8 +96,19 @@ class MailerView(BaseRequestView):
         subject = request.data.get("subject", "")
         message = request.data.get("message")
         baseurl = request.META.get("HTTP_ORIGIN", settings.DIMES_BASEURL)
-        emailed = Mailer().send_message(to_address, object_list, subject, message, baseurl)
-        return {"detail": emailed}
+        job = EmailJob.enqueue(to_address, object_list, subject, message, baseurl)
+        return {"detail": "email queued for delivery to {}".format(", ".join(job.recipients)), "job_id": str(job.pk)}
+
+
+class EmailJobStatusView(APIView):
+    """Reports the progress of a queued email job."""
+
+    def get(self, request, job_id):
+        try:
+            job = EmailJob.objects.get(pk=job_id)
+            return Response(EmailJobSerializer(job).data, status=200)
+        except EmailJob.DoesNotExist:
+            return Response({"detail": "Email job {} not found".format(job_id)}, status=404)
 
 
 class DeliverReadingRoomRequestView(BaseRequestView):
@@ -55,7 +117,7 @@ class DeliverReadingRoomRequestView(BaseRequestView):
     def get_response_data(self, request):
         request_data = request.data
         baseurl = request.META.get("HTTP_ORIGIN", settings.DIMES_BASEURL)
-        delivered = AeonRequester().get_request_data(
+        delivered = AeonRequester().send_request(
             "readingroom", baseurl, **request_data)
         return delivered
 
@@ -66,7 +128,7 @@ class DeliverDuplicationRequestView(BaseRequestView):
     def get_response_data(self, request):
         request_data = request.data
         baseurl = request.META.get("HTTP_ORIGIN", settings.DIMES_BASEURL)
-        delivered = AeonRequester().get_request_data(
+        delivered = AeonRequester().send_request(
             "duplication", baseurl, **request_data)
         return delivered
 
@@ -81,49 +143,135 @@ class Echo:
         return value
 
 
-class DownloadCSVView(APIView):
-    """Downloads a CSV file."""
+class BaseDownloadView(APIView):
+    """Base view which streams a file of data about requested items.
 
-    def iter_items(self, items, pseudo_buffer):
-        """Returns an iterable containing the spreadsheet rows."""
-        fieldnames = [key for key, _ in settings.EXPORT_FIELDS]
-        writer = csv.DictWriter(pseudo_buffer, fieldnames=fieldnames, extrasaction="ignore")
-        yield writer.writerow(dict((fn, fn) for fn in writer.fieldnames))
-        for row in items:
-            yield writer.writerow(row)
+    Requires children to implement an `iter_items` method which yields strings
+    for batches of items, and to set `content_type` and `file_extension`.
+    Responses are gzip-compressed as they are streamed if `compress` is set
+    and the client accepts gzip encoding.
+    """
+
+    rows_per_write = 25
+    compress = False
+    fields = None
+
+    def iter_batches(self, items):
+        """Yields lists of up to `rows_per_write` items."""
+        items = iter(items)
+        yield from iter(lambda: list(islice(items, self.rows_per_write)), [])
+
+    def accepts_gzip(self, request):
+        return self.compress and accepts_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""), "gzip")
 
     def post(self, request):
-        """Streams a large CSV file."""
+        """Streams a large file.
+
+        The first item is fetched before the response starts, so that errors
+        fetching it are still reported with a 500 response.
+        """
         try:
             submitted = request.data.get("items")
             baseurl = request.META.get("HTTP_ORIGIN", settings.DIMES_BASEURL)
             processor = Processor()
-            fetched = processor.get_data(submitted, baseurl)
+            fetched = processor.iter_data(submitted, baseurl, self.fields)
+            first = list(islice(fetched, 1))
+            streaming_content = self.iter_items(chain(first, fetched))
+            filename = "dimes-{}.{}".format(datetime.now().isoformat(), self.file_extension)
+            compressed = self.accepts_gzip(request)
+            if compressed:
+                streaming_content = gzip_stream(streaming_content)
             response = StreamingHttpResponse(
-                streaming_content=(self.iter_items(fetched, Echo())),
-                content_type="text/csv",
-            ) 
-            filename = "dimes-{}.csv".format(datetime.now().isoformat())
+                streaming_content=streaming_content,
+                content_type=self.content_type,
+            )
+            if self.compress:
+                response["Vary"] = "Accept-Encoding"
+            if compressed:
+                response["Content-Encoding"] = "gzip"
             response["Content-Disposition"] = "attachment; filename={}".format(filename)
             return response
         except Exception as e:
             return Response({"detail": str(e)}, status=500)
 
+
+def accepts_encoding(header, encoding):
+    """Indicates whether an Accept-Encoding header allows a content coding.
+
+    A coding is acceptable if it is listed, or covered by `*`, with a quality
+    value above zero. A coding listed by name takes precedence over `*`.
+    """
+    qualities = {}
+    for value in header.lower().split(","):
+        coding, _, params = value.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, q = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0
+        qualities[coding.strip()] = quality
+    return qualities.get(encoding, qualities.get("*", 0)) > 0
+
+
+def gzip_stream(chunks):
+    """Compresses an iterable of strings into a stream of gzip data."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class DownloadCSVView(BaseDownloadView):
+    """Downloads a CSV file."""
+
+    content_type = "text/csv"
+    file_extension = "csv"
+
+    @property
+    def fields(self):
+        return export_fields()
+
+    def iter_items(self, items):
+        """Returns an iterable containing the spreadsheet rows.
+
+        The header is written first, and then rows are written in batches as
+        items become available.
+        """
+        fieldnames = [key for key, _ in settings.EXPORT_FIELDS]
+        writer = csv.DictWriter(Echo(), fieldnames=fieldnames, extrasaction="ignore")
+        yield writer.writerow(dict((fn, fn) for fn in writer.fieldnames))
+        for rows in self.iter_batches(items):
+            yield "".join(writer.writerow(row) for row in rows)
+
+
+class DownloadNDJSONView(BaseDownloadView):
+    """Downloads complete data about items as newline-delimited JSON, one
+    object per line."""
+
+    content_type = "application/x-ndjson"
+    file_extension = "ndjson"
+    compress = True
+
+    def iter_items(self, items):
+        for rows in self.iter_batches(items):
+            yield "".join(json.dumps(dict(row), separators=(",", ":")) + "\n" for row in rows)
+
+
 class LinkResolverView(APIView):
     """Takes POST from Islandora. Resolves ASpace ID"""
 
     def get(self, request):
-
-        aspace = ASpace(baseurl=settings.ARCHIVESSPACE["baseurl"],
-                        username=settings.ARCHIVESSPACE["username"],
-                        password=settings.ARCHIVESSPACE["password"],
-                        repository=settings.ARCHIVESSPACE["repo_id"])
-
         try:
+            client = get_aspace_client()
             data = request.GET["ref_id"]
             host = settings.DIMES_BASEURL
             repo = settings.ARCHIVESSPACE["repo_id"]
-            uri = resolve_ref_id(repo, data, aspace.client)
+            uri = resolve_ref_id(repo, data, client)
             response = redirect("{}{}".format(host, uri))
             return response
         except Exception as e:
@@ -135,10 +283,8 @@ class PingView(APIView):
 
     def get(self, request):
         try:
-            ASpace(baseurl=settings.ARCHIVESSPACE["baseurl"],
-                   username=settings.ARCHIVESSPACE["username"],
-                   password=settings.ARCHIVESSPACE["password"],
-                   repository=settings.ARCHIVESSPACE["repo_id"])
-            return Response({"pong": True}, status=200)
+            resp = get_aspace_client().get("version")
+            resp.raise_for_status()
+            return Response({"pong": True, "cache": record_cache.stats(), "single_flight": single_flight.stats()}, status=200)
         except Exception as e:
             return Response({"error": str(e), "pong": False}, status=200)
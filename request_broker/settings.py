@@ -91,6 +91,33 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared between processes in production, e.g. DatabaseCache or FileBasedCache.
+    "archivesspace": {
+        "BACKEND": getattr(config, "AS_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": getattr(config, "AS_CACHE_LOCATION", "archivesspace"),
+    },
+}
+
+# JSON codec used to decode ArchivesSpace responses and to render and parse
+# API requests. "auto" uses orjson when it is installed.
+JSON_CODEC = getattr(config, "JSON_CODEC", "auto")
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "process_request.codec.CodecJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "process_request.codec.CodecJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -147,10 +174,51 @@ ARCHIVESSPACE = {
     "username": config.AS_USERNAME,
     "password": config.AS_PASSWORD,
     "repo_id": config.AS_REPO_ID,
+    "pool_size": getattr(config, "AS_POOL_SIZE", 10),
+    "max_in_flight": getattr(config, "AS_MAX_IN_FLIGHT", 4),
+    "warm_up": getattr(config, "AS_WARM_UP", False),
+    "fetch_strategy": getattr(config, "AS_FETCH_STRATEGY", "resolve"),
+    "data_source": getattr(config, "AS_DATA_SOURCE", "live"),
+}
+
+ARCHIVESSPACE_MIRROR = {
+    "max_age": getattr(config, "AS_MIRROR_MAX_AGE", 86400),
 }
 
+ARCHIVESSPACE_CACHE = {
+    "max_entries": getattr(config, "AS_CACHE_MAX_ENTRIES", 5000),
+    "max_bytes": getattr(config, "AS_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    "ttls": {
+        "archival_object": 0,
+        "resource": 3600,
+        "agent": 3600,
+        "top_container": 300,
+        "tree_node": 3600,
+        **getattr(config, "AS_CACHE_TTLS", {}),
+    },
+}
+
+ARCHIVESSPACE_SINGLE_FLIGHT = {
+    "enabled": getattr(config, "AS_SINGLE_FLIGHT", True),
+    "lease": getattr(config, "AS_SINGLE_FLIGHT_LEASE", 10),
+    "poll_interval": getattr(config, "AS_SINGLE_FLIGHT_POLL_INTERVAL", 0.05),
+    "result_ttl": getattr(config, "AS_SINGLE_FLIGHT_RESULT_TTL", 2),
+}
+
+PARSE_BATCH_PAGE_SIZE = getattr(config, "PARSE_BATCH_PAGE_SIZE", 100)
+
 RESOLVER_HOSTNAME = config.DIMES_HOSTNAME
 
+AEON = {
+    "baseurl": getattr(config, "AEON_BASEURL", None),
+    "api_key": getattr(config, "AEON_API_KEY", None),
+    "pool_size": getattr(config, "AEON_POOL_SIZE", 10),
+    "max_workers": getattr(config, "AEON_MAX_WORKERS", 4),
+    "max_attempts": getattr(config, "AEON_MAX_ATTEMPTS", 3),
+    "backoff": getattr(config, "AEON_BACKOFF", 0.5),
+    "timeout": getattr(config, "AEON_TIMEOUT", 30),
+}
+
 EMAIL_HOST = config.EMAIL_HOST
 EMAIL_PORT = config.EMAIL_PORT
 EMAIL_HOST_USER = config.EMAIL_HOST_USER
@@ -158,6 +226,15 @@ EMAIL_HOST_PASSWORD = config.EMAIL_HOST_PASSWORD
 EMAIL_USE_TLS = config.EMAIL_USE_TLS
 EMAIL_USE_SSL = config.EMAIL_USE_SSL
 EMAIL_DEFAULT_FROM = config.DEFAULT_FROM_EMAIL
+EMAIL_CONNECTION_IDLE_TIMEOUT = getattr(config, "EMAIL_CONNECTION_IDLE_TIMEOUT", 60)
+
+EMAIL_JOBS = {
+    "max_attempts": getattr(config, "EMAIL_JOB_MAX_ATTEMPTS", 5),
+    "retry_delay": getattr(config, "EMAIL_JOB_RETRY_DELAY", 60),
+    "lease": getattr(config, "EMAIL_JOB_LEASE", 600),
+    "poll_interval": getattr(config, "EMAIL_JOB_POLL_INTERVAL", 5),
+    "batch_size": getattr(config, "EMAIL_JOB_BATCH_SIZE", 10),
+}
 
 EXPORT_FIELDS = [
     ("title", None),
@@ -169,6 +246,7 @@ EXPORT_FIELDS = [
     ("parent", "Parent Collection Name")]
 
 RESTRICTED_IN_CONTAINER = config.RESTRICTED_IN_CONTAINER
+CONTAINER_INDEX_MAX_AGE = getattr(config, "CONTAINER_INDEX_MAX_AGE", 86400)
 OFFSITE_BUILDINGS = getattr(config, 'OFFSITE_BUILDINGS', [])
 USE_LOCATION_TITLE = config.USE_LOCATION_TITLE
 RESOURCE_ID_SEPARATOR = config.RESOURCE_ID_SEPARATOR
@@ -18,16 +18,21 @@ from django.urls import path
 
 from process_request.views import (DeliverDuplicationRequestView,
                                    DeliverReadingRoomRequestView,
-                                   DownloadCSVView, LinkResolverView,
-                                   MailerView, ParseRequestView, PingView)
+                                   DownloadCSVView, DownloadNDJSONView,
+                                   EmailJobStatusView, LinkResolverView,
+                                   MailerView, ParseBatchView,
+                                   ParseRequestView, PingView)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/deliver-request/email", MailerView.as_view(), name="deliver-email"),
+    path("api/deliver-request/email/<uuid:job_id>", EmailJobStatusView.as_view(), name="email-status"),
     path("api/deliver-request/duplication", DeliverDuplicationRequestView.as_view(), name="deliver-duplication"),
     path("api/deliver-request/reading-room", DeliverReadingRoomRequestView.as_view(), name="deliver-readingroom"),
     path("api/process-request/parse", ParseRequestView.as_view(), name="parse-request"),
+    path("api/process-request/parse-batch", ParseBatchView.as_view(), name="parse-batch"),
     path("api/process-request/resolve", LinkResolverView.as_view(), name="resolve-request"),
     path("api/download-csv/", DownloadCSVView.as_view(), name="download-csv"),
+    path("api/download-ndjson/", DownloadNDJSONView.as_view(), name="download-ndjson"),
     path("api/status/", PingView.as_view(), name="ping")
 ]
@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'request_broker.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.ARCHIVESSPACE["warm_up"]:
+    from process_request.clients import aspace_pool  # noqa: E402
+
+    try:
+        aspace_pool.warm_up()
+    except Exception:
+        # Requests will log in lazily if ArchivesSpace is not reachable yet.
+        pass